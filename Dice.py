@@ -0,0 +1,118 @@
+# Dice expressions - characteristics written as a number or as nDk+m ('D3', '2D6', 'D6+3'), parsed once when the
+# datasheet is loaded. The same expression gives scalar rolls, batched samples and its exact distribution
+import re
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from functools import lru_cache
+from utility_functions import roll, dice_mask, weigh_dice
+import logging
+logger = logging.getLogger(__name__)
+
+DICE_PATTERN = re.compile(r'^(\d*)D(\d+)(?:([+-])(\d+))?$')
+
+
+@dataclass(frozen=True, slots=True)
+class DiceExpression:
+    num_dice: int = 0 # 0 for a fixed value
+    die_sides: int = 6
+    modifier: int = 0
+
+    @classmethod
+    def parse(cls, value: 'int | str | DiceExpression') -> 'DiceExpression':
+        if isinstance(value, DiceExpression):
+            return value
+        if isinstance(value, (int, np.integer)):
+            return cls(modifier=int(value))
+        text = str(value).replace(' ', '').upper()
+        if text.lstrip('+-').isdigit():
+            return cls(modifier=int(text))
+        match = DICE_PATTERN.match(text)
+        if match is None or int(match.group(2)) < 1:
+            raise ValueError(f'Cannot parse dice expression {value!r}, expected e.g. 3, D3, 2D6 or D6+3')
+        num_dice, die_sides, sign, modifier = match.groups()
+        return cls(
+            num_dice=int(num_dice or 1),
+            die_sides=int(die_sides),
+            modifier=int(modifier or 0) * (-1 if sign == '-' else 1)
+        )
+
+    def __str__(self) -> str:
+        if not self.is_random:
+            return str(self.modifier)
+        dice = f'{self.num_dice if self.num_dice > 1 else ""}D{self.die_sides}'
+        return dice + (f'{self.modifier:+d}' if self.modifier else '')
+
+    @property
+    def is_random(self) -> bool:
+        return self.num_dice > 0
+
+    @property
+    def minimum(self) -> int:
+        return max(self.num_dice + self.modifier, 0)
+
+    @property
+    def maximum(self) -> int:
+        return max(self.num_dice * self.die_sides + self.modifier, 0)
+
+    @property
+    def mean(self) -> float:
+        return float(np.arange(len(self.pmf())) @ self.pmf())
+
+    def roll(self, num_rolls: int=1) -> NDArray[np.integer]:
+        # num_rolls independent results, drawn from the shared generator like every other scalar roll
+        if not self.is_random:
+            return np.full(num_rolls, self.modifier)
+        rolls = roll(num_rolls * self.num_dice, self.die_sides).reshape(num_rolls, self.num_dice)
+        return np.maximum(rolls.sum(axis=1) + self.modifier, 0)
+
+    def sample_each(self, rng: np.random.Generator, num_trials: int, width: int) -> NDArray[np.integer]:
+        # (trials x width) independent results, e.g. the damage of every unsaved wound of every trial at once
+        if not self.is_random:
+            return np.full((num_trials, width), self.modifier)
+        rolls = rng.integers(1, self.die_sides + 1, size=(num_trials, width, self.num_dice))
+        results = rolls.sum(axis=2) + self.modifier
+        return np.maximum(results, 0) if self.modifier < 0 else results
+
+    def sample(
+            self, rng: np.random.Generator, num_trials: int, count: int | NDArray[np.integer]=1
+    ) -> NDArray[np.integer]:
+        # Per trial, the sum of count independent results, count being the same for every trial or given per trial
+        count = np.broadcast_to(count, (num_trials,))
+        if not self.is_random:
+            return self.modifier * count
+        results = self.sample_each(rng, num_trials, count.max(initial=0))
+        in_play = dice_mask(count, results.shape[1])
+        weigh_dice(rng, in_play)
+        return (results * in_play).sum(axis=1)
+
+    def pmf(self, count: int=1) -> NDArray[np.floating]:
+        # Exact distribution of the sum of count independent results, pmf[v] is the probability of v
+        return expression_pmf(self, count)
+
+
+@lru_cache(maxsize=None)
+def expression_pmf(expression: DiceExpression, count: int) -> NDArray[np.floating]:
+    # Cached and shared between callers, so the arrays are read-only
+    if count == 0:
+        pmf = np.array([1.0])
+    elif count > 1:
+        half = expression_pmf(expression, count // 2)
+        pmf = np.convolve(half, half)
+        if count % 2:
+            pmf = np.convolve(pmf, expression_pmf(expression, 1))
+    else:
+        pmf = single_pmf(expression)
+    pmf.flags.writeable = False
+    return pmf
+
+
+def single_pmf(expression: DiceExpression) -> NDArray[np.floating]:
+    pmf = np.array([1.0])
+    die = np.full(expression.die_sides, 1 / expression.die_sides)
+    for _ in range(expression.num_dice):
+        pmf = np.convolve(pmf, die)
+    lowest = expression.num_dice + expression.modifier # lowest total, results below 0 count as 0
+    if lowest >= 0:
+        return np.concatenate([np.zeros(lowest), pmf])
+    return np.concatenate([[pmf[:1 - lowest].sum()], pmf[1 - lowest:]])
@@ -1,7 +1,11 @@
 from utility_functions import *
+import phase_profiler
+import trace_recorder
+from time import perf_counter
 import logging
 logger = logging.getLogger(__name__)
-from copy import deepcopy
+from copy import copy
+from dataclasses import dataclass
 from typing import List, Dict, Set, TYPE_CHECKING
 if TYPE_CHECKING:
     from Weapon import Weapon
@@ -9,6 +13,20 @@ if TYPE_CHECKING:
     from Unit import Unit
 
 
+@dataclass(frozen=True, slots=True)
+class ModelProfile:
+    # Abilities and keywords parsed once, so damage and eligibility checks don't scan strings
+    feel_no_pain: int = 0
+    monster_or_vehicle: bool = False
+
+    @classmethod
+    def from_keywords(cls, abilities: Set[str], keywords: Set[str]) -> 'ModelProfile':
+        return cls(
+            feel_no_pain=get_keyword_x_value(check_keyword('feel_no_pain', abilities)),
+            monster_or_vehicle='monster' in keywords or 'vehicle' in keywords
+        )
+
+
 class Model:
     def __init__(
             self,
@@ -44,73 +62,97 @@ class Model:
         self.keywords = keywords
         self.faction_keywords = faction_keywords
         self.alive = True
+        self.profile = ModelProfile.from_keywords(abilities, keywords)
         # self.unit = unit
 
     def __mul__(self, count: int) -> List:
         """Return a list of independent copies of this item"""
         if not isinstance(count, int) or count < 0:
             raise ValueError('Can only multiply items by non-negative integers')
-        return [deepcopy(self) for _ in range(count)]
+        return [self.spawn() for _ in range(count)]
 
     def __rmul__(self, count: int):
         """Support reverse multiplication (3 * item)"""
         return self.__mul__(count)
 
+    # Stats, weapons and keywords are shared between copies, only current_wounds and alive change during a fight
+    def __deepcopy__(self, memo) -> 'Model':
+        return copy(self)
+
+    def spawn(self) -> 'Model':
+        """Return a fresh, undamaged copy of this model"""
+        model = copy(self)
+        model.reset()
+        return model
+
+    def reset(self):
+        self.current_wounds = self.starting_wounds
+        self.alive = True
+
     def can_shoot(self, weapon: 'Weapon', engagement: 'Engagement', unit: 'Unit') -> bool:
-        if unit.last_action == 'advanced' and 'assault' not in weapon.keywords:
-            logger.debug(
-                f'Cannot attack because the weapon wielder advanced and the weapon has no assault capabilities. '
-                f'Weapon keywords: {weapon.keywords}.'
-            )
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if unit.last_action == 'advanced' and not weapon.profile.assault:
+            if debug:
+                logger.debug(
+                    f'Cannot attack because the weapon wielder advanced and the weapon has no assault capabilities. '
+                    f'Weapon keywords: {weapon.keywords}.'
+                )
             return False
         if unit.last_action == 'fall_back':
             logger.debug('Cannot attack because the weapon wielder fell back.')
             return False
         if engagement.distance > weapon.weapon_range:
-            logger.debug(
-                f'Cannot attack because the distance to target ({engagement.distance}) is larger than '
-                f'the weapon\'s range ({weapon.weapon_range}).'
-            )
-            return False
-        if not engagement.line_of_sight and 'indirect_fire' not in weapon.keywords:
-            logger.debug(
-                f'Cannot attack because target is beyond line of sight and the weapon has no indirect fire capabilities. '
-                f'Weapon keywords: {weapon.keywords}.'
-            )
+            if debug:
+                logger.debug(
+                    f'Cannot attack because the distance to target ({engagement.distance}) is larger than '
+                    f'the weapon\'s range ({weapon.weapon_range}).'
+                )
             return False
-
-        if 'blast' in weapon.keywords:
-            if engagement.opponent.in_melee_with: # blast > big guns never tire. If our weapon has blast, it doesn't matter what's the target
+        if not engagement.line_of_sight and not weapon.profile.indirect_fire:
+            if debug:
                 logger.debug(
-                    f'Cannot shoot because weapon has the \'blast\' keyword and target is engaged with an ally.'
+                    f'Cannot attack because target is beyond line of sight and the weapon has no indirect fire capabilities. '
                     f'Weapon keywords: {weapon.keywords}.'
                 )
+            return False
+
+        if weapon.profile.blast:
+            if engagement.opponent.in_melee_with: # blast > big guns never tire. If our weapon has blast, it doesn't matter what's the target
+                if debug:
+                    logger.debug(
+                        f'Cannot shoot because weapon has the \'blast\' keyword and target is engaged with an ally.'
+                        f'Weapon keywords: {weapon.keywords}.'
+                    )
                 return False
 
         # If in melee (and not a monster of vehicle), we can only shoot the enemy we're in melee with, and only with a pistol
-        if unit.in_melee_with and not any(keyword in self.keywords for keyword in ['monster', 'vehicle']):
-            if 'pistol' not in weapon.keywords:
-                logger.debug(
-                    f'Cannot shoot because model is in melee and weapon is not a pistol.'
-                    f'Weapon keywords: {weapon.keywords}.'
-                )
+        if unit.in_melee_with and not self.profile.monster_or_vehicle:
+            if not weapon.profile.pistol:
+                if debug:
+                    logger.debug(
+                        f'Cannot shoot because model is in melee and weapon is not a pistol.'
+                        f'Weapon keywords: {weapon.keywords}.'
+                    )
                 return False
             if engagement.opponent not in unit.in_melee_with: # TODO - make sure this works. E.g. UID on Unit level, that gets passed to Models in that unit? Or at least to this method?
-                logger.debug(f'Cannot shoot this target because model is in melee with a different target.')
+                logger.debug('Cannot shoot this target because model is in melee with a different target.')
                 return False
-            logger.debug(
-                f'Can shoot because model is in melee with the target and has a pistol.'
-                f'Weapon keywords: {weapon.keywords}.'
-            )
+            if debug:
+                logger.debug(
+                    f'Can shoot because model is in melee with the target and has a pistol.'
+                    f'Weapon keywords: {weapon.keywords}.'
+                )
             return True
 
         # If we aren't in melee, then we need to consider if opponent is in melee
         if engagement.opponent.in_melee_with:
-            if not any(keyword in engagement.opponent.get_all_models_keywords() for keyword in ['monster', 'vehicle']):
-                logger.debug(
-                    f'Cannot shoot because target is engaged and is not a monster or a vehicle.'
-                    f'Target keywords: {engagement.opponent.get_all_models_keywords()}'
-                )
+            target_keywords = engagement.opponent.get_all_models_keywords()
+            if 'monster' not in target_keywords and 'vehicle' not in target_keywords:
+                if debug:
+                    logger.debug(
+                        f'Cannot shoot because target is engaged and is not a monster or a vehicle.'
+                        f'Target keywords: {target_keywords}'
+                    )
                 return False
 
         return True
@@ -119,53 +161,66 @@ class Model:
         if num_wounds == 0:
             logger.debug('No wounds to save.')
             return 0
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
+        debug = logger.isEnabledFor(logging.DEBUG)
         wounds_taken = 0
         # No save vs mortal wounds so crit wounds score direct damage, and then we only consider the normal wounds
-        if 'devastating_wounds' in weapon.keywords:
+        if weapon.profile.devastating_wounds:
+            if profiler is not None:
+                profiler.count('devastating_wounds')
             wounds_taken += num_crit_wounds
             num_wounds -= num_crit_wounds
-            logger.debug(f'Suffering {num_crit_wounds} mortal wounds due to {num_crit_wounds} critical wounds from a \
-             weapon with the devastating wounds keyword. Remaining wounds to resolve: {num_wounds}')
+            if debug:
+                logger.debug(f'Suffering {num_crit_wounds} mortal wounds due to {num_crit_wounds} critical wounds from a \
+                 weapon with the devastating wounds keyword. Remaining wounds to resolve: {num_wounds}')
 
         rolls = roll(num_wounds)
+        save_dice = rolls
         crit_fails = (rolls == 1).sum() # Unmodified rolls of 1 always fail
         wounds_taken += crit_fails
-        logger.debug(f'Initial save rolls: {rolls}. Critical fails: {crit_fails}. Reminder rolls: {rolls[(rolls != 1)]}')
+        if debug:
+            logger.debug(f'Initial save rolls: {rolls}. Critical fails: {crit_fails}. Reminder rolls: {rolls[(rolls != 1)]}')
         rolls = rolls[(rolls != 1)] # Exclude auto failed rolls
 
-        normal_save = self.save
-        if 'ignores_cover' in weapon.keywords:
-            engagement.in_cover = False
-        # make sure cover only works vs shooting
-        if engagement.in_cover and weapon.weapon_range > 1:
-            if normal_save >= 4 or weapon.armor_piercing > 0:
-                rolls += 1
-                logger.debug(f'Due to the target being in cover, rolls receive a +1 modifier. New rolls: {rolls}')
-
-        # Make sure save wasn't incremented by more than 1
-        if normal_save > (self.save + 1):
-            normal_save = self.save + 1
-        # Select between normal and invulnerable save
-        if normal_save + weapon.armor_piercing < self.invulnerable_save:
-            save_used = normal_save
-        else:
-            save_used = self.invulnerable_save
-        logger.debug(
-            f'{self.name}\'s save characteristic used: {save_used}. '
-        )
-        rolls -= weapon.armor_piercing
+        cover = benefits_from_cover(self.save, weapon, engagement)
+        if cover:
+            logger.debug('Due to the target being in cover, the armour save receives a +1 modifier.')
+        # Select between normal (modified by AP and cover) and invulnerable save
+        save_used = find_save_roll_requirement(self.save, self.invulnerable_save, weapon.armor_piercing, cover)
         wounds_taken += (rolls < save_used).sum()
-        logger.debug(
-            f'Armor piercing: {weapon.armor_piercing}. Final roll values: {rolls}, resulting in {wounds_taken} '
-            f'successful instances of damage.'
-        )
+        if debug:
+            logger.debug(
+                f'{self.name}\'s save roll requirement: {save_used}. '
+            )
+            logger.debug(
+                f'Armor piercing: {weapon.armor_piercing}. Final roll values: {rolls}, resulting in {wounds_taken} '
+                f'successful instances of damage.'
+            )
+        tracer = trace_recorder.active
+        if tracer is not None and tracer.recording:
+            tracer.record(
+                'save', weapon=weapon.name, model=self.name, rolls=save_dice, requirement=save_used, cover=cover,
+                wounds_taken=wounds_taken
+            )
+        if profiler is not None:
+            profiler.record('save', start, dice=num_wounds)
         return wounds_taken
 
     def take_damage(self, damage_taken: int):
-        damage_taken -= feel_no_pain(damage_taken, self.abilities)
+        if self.profile.feel_no_pain:
+            profiler = phase_profiler.active
+            start = perf_counter() if profiler is not None else 0.0
+            damage_ignored = (roll(damage_taken) >= self.profile.feel_no_pain).sum()
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Ignoring {damage_ignored} out of {damage_taken} damage due to the "Feel No Pain" rule.')
+            damage_taken -= damage_ignored
+            if profiler is not None:
+                profiler.record('feel_no_pain', start, dice=damage_taken + damage_ignored)
         self.current_wounds -= damage_taken
         if self.current_wounds < 1:
-            logger.debug(f'Alas, death claims {self.name}!')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Alas, death claims {self.name}!')
             self.alive = False
 
 
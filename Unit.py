@@ -1,10 +1,14 @@
 from math import ceil
-from collections import defaultdict
-from copy import deepcopy
-from utility_functions import roll
+from collections import Counter, defaultdict
+from copy import copy, deepcopy
+from Dice import DiceExpression
+import phase_profiler
+import trace_recorder
+import weapon_selection
+from time import perf_counter
 import logging
 logger = logging.getLogger(__name__)
-from typing import List, Set, TYPE_CHECKING
+from typing import List, Set, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from Model import Model
     from Engagement import Engagement
@@ -20,12 +24,14 @@ class Unit:
             in_melee_with: List['Unit'] # TODO Each unit on the battlefield should get a unique identifier so we can keep track
     ):
         self.name = name
+        self.starting_models = list(models) # full roster, models only ever leave self.models
         self.models = models
         self.point_cost = point_cost
         self.total_objective_control = sum([model.objective_control for model in self.models])
         self.in_melee_with = in_melee_with
         self.last_action = None
         self.alive = True
+        self.build_index()
 
     def __mul__(self, count: int) -> List:
         """Return a list of independent copies of this item"""
@@ -37,57 +43,168 @@ class Unit:
         """Support reverse multiplication (3 * item)"""
         return self.__mul__(count)
 
-    def allocate_wounds(self, num_wounds: int, damage_per_wound: int|str):
-        if 'D' in str(damage_per_wound).upper():
-            logger.debug(f'Rolling a {damage_per_wound} die to find damage per wound.')
-            damage_per_wound = roll(1, int(damage_per_wound[1]))
-            logger.debug(f'Taking {damage_per_wound} damage per wound.')
-        while num_wounds > 0 and self.models:
-            # Find first model that can take damage
-            model = next((model for model in self.models if model.current_wounds < model.starting_wounds), self.models[0])
-
-            total_absorbable_wounds = ceil(model.current_wounds / damage_per_wound) # How many wounds can the model take?
-            wounds_to_apply = min(total_absorbable_wounds, num_wounds)
-
-            model.take_damage(wounds_to_apply * damage_per_wound)
-            if not model.alive:
-                self.models.remove(model)
-                self.total_objective_control -= model.objective_control
-
-            num_wounds -= wounds_to_apply
-
+    # Models share their datasheet stats and weapons, so copying a unit only copies its combat state
+    def __deepcopy__(self, memo) -> 'Unit':
+        unit = copy(self)
+        model_copies = {id(model): copy(model) for model in self.starting_models}
+        unit.starting_models = [model_copies[id(model)] for model in self.starting_models]
+        unit.models = [model_copies.get(id(model)) or copy(model) for model in self.models]
+        unit.in_melee_with = list(self.in_melee_with)
+        unit.build_index()
+        return unit
+
+    def spawn(self) -> 'Unit':
+        """Return a fresh, full strength copy of this unit"""
+        return Unit(
+            name=self.name,
+            models=[model.spawn() for model in self.starting_models],
+            point_cost=self.point_cost,
+            in_melee_with=[]
+        )
+
+    def reset(self):
+        """Bring every model back to full strength, e.g. between trials"""
+        for model in self.starting_models:
+            model.reset()
+        self.models = list(self.starting_models)
+        self.total_objective_control = sum([model.objective_control for model in self.models])
+        self.alive = True
+        self.build_index()
+
+    def build_index(self):
+        # Aggregates read on every attack (keywords, allocation target, toughness), built once here and then kept up
+        # to date by apply_damage, so reading them doesn't walk the models. Characters in a unit that also has other
+        # models are its leaders: wounds go to the bodyguard while any of it is left, unless the attack has precision
+        self.keyword_counts = Counter(keyword for model in self.models for keyword in model.keywords)
+        self.keywords = set(self.keyword_counts)
+        characters = [model for model in self.models if 'character' in model.keywords]
+        self.leaders = characters if len(characters) < len(self.models) else []
+        leader_ids = {id(model) for model in self.leaders}
+        self.bodyguards = [model for model in self.models if id(model) not in leader_ids]
+        self.damaged = [model for model in self.models if model.current_wounds < model.starting_wounds]
+        self.update_allocation_targets()
+
+    def update_allocation_targets(self):
+        # A model that has already lost wounds keeps taking them, within its group
+        self.allocation_target = self.group_target(self.bodyguards or self.leaders)
+        self.precision_target = self.group_target(self.leaders) if self.leaders else self.allocation_target
+
+    def group_target(self, group: List['Model']) -> 'Model | None':
+        if not group:
+            return None
+        return next((model for model in self.damaged if model in group), group[0])
+
+    def target(self, precision: bool=False) -> 'Model':
+        return self.precision_target if precision else self.allocation_target
+
+    def allocation_groups(self) -> Tuple[List['Model'], List['Model']]:
+        # Bodyguards and leaders, each in the order wounds reach them: the damaged models first
+        return tuple(
+            [model for model in self.damaged if model in group] + [model for model in group if model not in self.damaged]
+            for group in (self.bodyguards, self.leaders)
+        )
+
+    def allocation_order(self) -> List['Model']:
+        # Every model in the order ordinary wounds reach it, the same order the exact and batch engines use
+        bodyguards, leaders = self.allocation_groups()
+        return bodyguards + leaders
+
+    def allocate_wounds(self, num_wounds: int, damage_per_wound: 'int | str | DiceExpression', precision: bool=False):
+        profiler = phase_profiler.active
+        damage_per_wound = DiceExpression.parse(damage_per_wound)
+        damage_rolls = None
+        if damage_per_wound.is_random:
+            # Every unsaved wound rolls its own damage, all of them in one go
+            start = perf_counter() if profiler is not None else 0.0
+            damage_rolls = damage_per_wound.roll(num_wounds)
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Rolled {damage_per_wound} damage for each of {num_wounds} wounds: {damage_rolls}.')
+            if profiler is not None:
+                profiler.record('damage', start, dice=num_wounds * damage_per_wound.num_dice)
+        start = perf_counter() if profiler is not None else 0.0
+
+        if damage_rolls is not None:
+            # Damage beyond what the model has left is lost, the next wound starts on the next model
+            for damage in damage_rolls:
+                if not self.models:
+                    break
+                self.apply_damage(self.target(precision), int(damage))
+        elif damage_per_wound.modifier > 0:
+            while num_wounds > 0 and self.models:
+                model = self.target(precision)
+
+                total_absorbable_wounds = ceil(model.current_wounds / damage_per_wound.modifier) # How many wounds can the model take?
+                wounds_to_apply = min(total_absorbable_wounds, num_wounds)
+
+                self.apply_damage(model, wounds_to_apply * damage_per_wound.modifier)
+                num_wounds -= wounds_to_apply
+
+        tracer = trace_recorder.active
+        if tracer is not None and tracer.recording:
+            tracer.record(
+                'allocation', damage_per_wound=str(damage_per_wound), damage_rolls=damage_rolls,
+                remaining_wounds=[model.current_wounds for model in self.models]
+            )
+        if profiler is not None:
+            profiler.record('allocation', start)
+
+    def apply_damage(self, model: 'Model', damage: int):
+        model.take_damage(damage)
+        if not model.alive:
+            self.remove_model(model)
+        elif model.current_wounds < model.starting_wounds and model not in self.damaged:
+            self.damaged.append(model)
+        self.update_allocation_targets()
+
+    def remove_model(self, model: 'Model'):
+        self.models.remove(model)
+        self.total_objective_control -= model.objective_control
+        (self.leaders if model in self.leaders else self.bodyguards).remove(model)
+        if model in self.damaged:
+            self.damaged.remove(model)
+        for keyword in model.keywords:
+            self.keyword_counts[keyword] -= 1
+            if not self.keyword_counts[keyword]:
+                self.keywords.discard(keyword)
         if not self.models:
-            logger.debug(f'Alas, death claims {self.name}!')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Alas, death claims {self.name}!')
             self.alive = False
 
     def do_saves(self, num_wounds: int, num_crit_wounds: int, weapon: 'Weapon', engagement: 'Engagement') -> int:
-        model = next((model for model in self.models if model.current_wounds < model.starting_wounds), self.models[0])
-        return model.save_roll(num_wounds, num_crit_wounds, weapon, engagement)
+        return self.target(weapon.profile.precision).save_roll(num_wounds, num_crit_wounds, weapon, engagement)
 
     def get_toughness(self) -> int:
-        # TODO - fix model selection so it takes one of the bodyguards. With current logic, if the leader gets tapped
-        #  once via precision, everything following will go to him again
-        model = next((model for model in self.models if model.current_wounds < model.starting_wounds), self.models[0])
-        return model.toughness
+        # An attached unit uses its bodyguard's toughness, which is the allocation target's while any of it is left.
+        # A unit that is wiped out has no toughness, nothing may be resolved against it
+        return self.allocation_target.toughness
 
-    def select_weapon(self, model: 'Model') -> 'Weapon':
-        # TODO get a weapon selection logic
-        weapon_name = list(model.ranged_weapons.keys())[0]
-        return model.ranged_weapons[weapon_name]
+    def select_weapon(self, model: 'Model', engagement: 'Engagement') -> 'Weapon':
+        # The ranged weapon model can fire with the most expected damage, read from the shared lookup table
+        return weapon_selection.table.best_weapon(model.ranged_weapons.values(), model, self, engagement)
 
     def get_all_models_keywords(self) -> Set:
-        return {keyword for model in self.models for keyword in model.keywords}
+        # The live index, don't modify it
+        return self.keywords
 
     def shoot(self, engagement: 'Engagement') -> defaultdict[str, List[int]]:
-        # total_wounds, total_crit_wounds = 0, 0
+        # Models with the same weapon and the same rules shoot as one group: one eligibility check and one array of
+        # dice per group instead of per model. Hits and wounds add up, so the result is the same as model by model
         wounds_per_weapon = defaultdict(lambda: [0, 0])
-        for i, model in enumerate(self.models):
-            logger.debug(f'Shooting with: {model.name} ({i+1}/{len(self.models)})')
-            weapon = self.select_weapon(model)
-            # wounds, crit_wounds = model.ranged_weapons[weapon].wound_roll(engagement, model)
-            wounds, crit_wounds = weapon.wound_roll(engagement, model, self)
-            # total_wounds += wounds
-            # total_crit_wounds += crit_wounds
+        if not engagement.opponent.alive: # no target left to pick weapons against or roll to wound
+            return wounds_per_weapon
+        groups = defaultdict(list)
+        for model in self.models:
+            groups[(self.select_weapon(model, engagement), model.profile)].append(model)
+
+        debug = logger.isEnabledFor(logging.DEBUG)
+        for (weapon, _), models in groups.items():
+            if debug:
+                logger.debug(f'Shooting with: {len(models)}x {models[0].name}')
+            result = weapon.wound_roll(engagement, models[0], self, models)
+            if result is None:
+                continue
+            wounds, crit_wounds = result
             if wounds > 0:
                 wounds_per_weapon[weapon.name][0] += wounds
                 wounds_per_weapon[weapon.name][1] += crit_wounds
@@ -0,0 +1,190 @@
+import numpy as np
+from numpy.typing import NDArray
+from utility_functions import roll_batch, dice_mask, dice_stream, weigh_dice
+from Dice import DiceExpression
+import phase_profiler
+from time import perf_counter
+import logging
+logger = logging.getLogger(__name__)
+from typing import TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+
+
+class UnitState:
+    # Struct-of-arrays view of a unit: one row per trial, one column per model. Static stats are shared between
+    # trials, only the wounds are per trial. A model is alive while it has wounds left
+    def __init__(
+            self,
+            current_wounds: NDArray[np.integer],
+            starting_wounds: NDArray[np.integer],
+            toughness: NDArray[np.integer],
+            save: NDArray[np.integer],
+            invulnerable_save: NDArray[np.integer],
+            objective_control: NDArray[np.integer],
+            feel_no_pain: NDArray[np.integer],
+            leader: NDArray[np.bool_] | None = None
+    ):
+        self.current_wounds = current_wounds
+        self.starting_wounds = starting_wounds
+        self.toughness = toughness
+        self.save = save
+        self.invulnerable_save = invulnerable_save # 7 when the model has none
+        self.objective_control = objective_control
+        self.feel_no_pain = feel_no_pain # 7 when the model has none
+        self.leader = leader if leader is not None else np.zeros(len(starting_wounds), dtype=bool)
+        self.rows = np.arange(len(current_wounds))
+
+    @classmethod
+    def from_unit(cls, unit: 'Unit', num_trials: int=1) -> 'UnitState':
+        models = unit.models
+        leader_ids = {id(model) for model in unit.leaders}
+        return cls(
+            current_wounds=np.tile([model.current_wounds for model in models], (num_trials, 1)),
+            starting_wounds=np.array([model.starting_wounds for model in models]),
+            toughness=np.array([model.toughness for model in models]),
+            save=np.array([model.save for model in models]),
+            invulnerable_save=np.array([model.invulnerable_save or 7 for model in models]),
+            objective_control=np.array([model.objective_control for model in models]),
+            feel_no_pain=np.array([model.profile.feel_no_pain or 7 for model in models]),
+            leader=np.array([id(model) in leader_ids for model in models], dtype=bool)
+        )
+
+    def subset(self, rows: NDArray[np.integer]) -> 'UnitState':
+        # The same unit in some of the trials, with its own copy of their wounds. merge writes them back
+        return UnitState(
+            self.current_wounds[rows], self.starting_wounds, self.toughness, self.save, self.invulnerable_save,
+            self.objective_control, self.feel_no_pain, self.leader
+        )
+
+    def merge(self, rows: NDArray[np.integer], part: 'UnitState'):
+        self.current_wounds[rows] = part.current_wounds
+
+    @property
+    def num_trials(self) -> int:
+        return len(self.current_wounds)
+
+    @property
+    def alive(self) -> NDArray[np.bool_]:
+        return self.current_wounds > 0
+
+    @property
+    def models_remaining(self) -> NDArray[np.integer]:
+        return self.alive.sum(axis=1)
+
+    @property
+    def unit_alive(self) -> NDArray[np.bool_]:
+        return self.alive.any(axis=1)
+
+    @property
+    def total_wounds(self) -> NDArray[np.integer]:
+        return self.current_wounds.sum(axis=1)
+
+    @property
+    def total_objective_control(self) -> NDArray[np.integer]:
+        return self.alive @ self.objective_control
+
+    def allocation_priority(self, precision: bool=False) -> NDArray[np.integer]:
+        # Same rule as Unit.target: bodyguard before leaders, leaders first for precision attacks, within each the
+        # damaged models first, then the rest in unit order, the dead at the end
+        alive = self.alive
+        damaged = alive & (self.current_wounds < self.starting_wounds)
+        later = ~self.leader if precision else self.leader
+        return np.where(alive, 2 * later + ~damaged, 4)
+
+    def allocation_order(self, precision: bool=False) -> NDArray[np.integer]:
+        return np.argsort(self.allocation_priority(precision), axis=1, kind='stable')
+
+    def allocation_targets(self, precision: bool=False) -> NDArray[np.integer]:
+        return self.allocation_priority(precision).argmin(axis=1)
+
+    def get_toughness(self) -> NDArray[np.integer]:
+        return self.toughness[self.allocation_targets()]
+
+    def take_damage(
+            self, damage: NDArray[np.integer], rng: np.random.Generator, fnp_rolls: NDArray[np.integer] | None = None,
+            precision: bool=False
+    ) -> NDArray[np.integer]:
+        # Damage to the current allocation target of each trial, with feel no pain rolled per point of damage.
+        # fnp_rolls are (trials x points) dice drawn up front, they are rolled here when not given
+        targets = self.allocation_targets(precision)
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
+        if fnp_rolls is None:
+            fnp_stream = dice_stream(rng, 'feel_no_pain')
+            fnp_rolls = roll_batch(
+                fnp_stream, self.num_trials, damage.max(initial=0), boundary=self.feel_no_pain[targets][:, None]
+            )
+            weigh_dice(fnp_stream, dice_mask(damage, fnp_rolls.shape[1]))
+        num_dice = damage.sum()
+        damage = damage - (dice_mask(damage, fnp_rolls.shape[1]) & (fnp_rolls >= self.feel_no_pain[targets][:, None])).sum(axis=1)
+        if profiler is not None:
+            profiler.record('feel_no_pain', start, dice=num_dice)
+        damage = np.minimum(damage, self.current_wounds[self.rows, targets])
+        self.current_wounds[self.rows, targets] -= damage
+        return damage
+
+    def allocate_wounds(
+            self, num_wounds: NDArray[np.integer], damage_per_wound: 'int | str | DiceExpression',
+            rng: np.random.Generator, bonus_damage: int=0, precision: bool=False
+    ):
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
+        damage_per_wound = DiceExpression.parse(damage_per_wound)
+        if damage_per_wound.is_random or (self.feel_no_pain < 7).any():
+            self.allocate_wounds_one_by_one(num_wounds, damage_per_wound, rng, bonus_damage, precision)
+        elif damage_per_wound.modifier + bonus_damage > 0:
+            self.allocate_fixed_damage(num_wounds, damage_per_wound.modifier + bonus_damage, precision)
+        if profiler is not None:
+            profiler.record('allocation', start)
+
+    def allocate_wounds_one_by_one(
+            self, num_wounds: NDArray[np.integer], damage_per_wound: DiceExpression, rng: np.random.Generator,
+            bonus_damage: int=0, precision: bool=False
+    ):
+        # Damage is rolled for every unsaved wound of every trial up front. The k-th wound of every trial is then
+        # resolved in one step, so the Python loop runs over wounds, not trials
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
+        max_wounds = num_wounds.max(initial=0)
+        damage_stream = dice_stream(rng, 'damage')
+        damage = damage_per_wound.sample_each(damage_stream, self.num_trials, max_wounds) + bonus_damage
+        if profiler is not None and damage_per_wound.is_random:
+            profiler.record('damage', start, dice=damage.size * damage_per_wound.num_dice)
+        # Feel no pain dice are drawn up front too, a fixed number per wound, so wound k always gets the same dice
+        max_damage = damage_per_wound.maximum + bonus_damage if (self.feel_no_pain < 7).any() else 0
+        fnp_stream = dice_stream(rng, 'feel_no_pain')
+        fnp_rolls = roll_batch(
+            fnp_stream, self.num_trials, max_wounds * max_damage, boundary=self.feel_no_pain.min()
+        ).reshape(self.num_trials, max_wounds, max_damage)
+        resolved = np.zeros((self.num_trials, max_wounds), dtype=bool)
+        for k in range(damage.shape[1]):
+            to_resolve = (k < num_wounds) & self.unit_alive
+            if not to_resolve.any():
+                break
+            resolved[:, k] = to_resolve
+            self.take_damage(np.where(to_resolve, damage[:, k], 0), rng, fnp_rolls[:, k], precision)
+        # Only the dice of wounds that were resolved count towards importance sampling weights
+        if damage_per_wound.is_random:
+            weigh_dice(damage_stream, resolved)
+        fnp_used = resolved[:, :, None] & (np.arange(max_damage) < damage[:, :, None])
+        weigh_dice(fnp_stream, fnp_used.reshape(self.num_trials, -1))
+
+    def allocate_fixed_damage(self, num_wounds: NDArray[np.integer], damage_per_wound: int, precision: bool=False):
+        # With fixed damage and no feel no pain the outcome is known up front: walking down the allocation order,
+        # each model soaks ceil(wounds / damage) wounds, so the slain models are a prefix of that order
+        order = self.allocation_order(precision)
+        wounds_in_order = np.take_along_axis(self.current_wounds, order, axis=1)
+        wounds_to_kill = np.where(wounds_in_order > 0, -(-wounds_in_order // damage_per_wound), num_wounds.max(initial=0) + 1)
+        cumulative = np.cumsum(wounds_to_kill, axis=1)
+        num_slain = (cumulative <= num_wounds[:, None]).sum(axis=1)
+
+        slain = np.arange(order.shape[1]) < num_slain[:, None]
+        wounds_in_order[slain] = 0
+        has_next = num_slain < order.shape[1]
+        rows = self.rows[has_next]
+        next_model = num_slain[has_next]
+        used = np.where(next_model > 0, cumulative[rows, np.maximum(next_model - 1, 0)], 0)
+        leftover = num_wounds[has_next] - used
+        wounds_in_order[rows, next_model] = np.maximum(wounds_in_order[rows, next_model] - leftover * damage_per_wound, 0)
+        np.put_along_axis(self.current_wounds, order, wounds_in_order, axis=1)
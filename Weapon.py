@@ -1,99 +1,220 @@
 # Weapons
 from utility_functions import *
+from Dice import DiceExpression
+import phase_profiler
+import trace_recorder
+from time import perf_counter
+from dataclasses import dataclass
 import logging
 logger = logging.getLogger(__name__)
-from typing import Tuple, TYPE_CHECKING
+from typing import List, Tuple, TYPE_CHECKING
 if TYPE_CHECKING:
     from Engagement import Engagement
     from Model import Model
     from Unit import Unit
 
 
+@dataclass(frozen=True, slots=True)
+class WeaponProfile:
+    # Weapon keywords parsed once, so rolls read flags and ints instead of scanning keyword strings
+    rapid_fire: int = 0
+    sustained_hits: int = 0
+    melta: int = 0
+    anti_keyword: str | None = None
+    anti_threshold: int = 6
+    torrent: bool = False
+    blast: bool = False
+    heavy: bool = False
+    lance: bool = False
+    lethal_hits: bool = False
+    twin_linked: bool = False
+    devastating_wounds: bool = False
+    ignores_cover: bool = False
+    hazardous: bool = False
+    assault: bool = False
+    pistol: bool = False
+    indirect_fire: bool = False
+    precision: bool = False
+
+    @classmethod
+    def from_keywords(cls, keywords: Set[str]) -> 'WeaponProfile':
+        anti_keyword_full = check_keyword('anti', keywords)
+        return cls(
+            rapid_fire=get_keyword_x_value(check_keyword('rapid_fire', keywords)),
+            sustained_hits=get_keyword_x_value(check_keyword('sustained_hits', keywords)),
+            melta=get_keyword_x_value(check_keyword('melta', keywords)),
+            anti_keyword='_'.join(anti_keyword_full.split('_')[1:-1]) if anti_keyword_full else None,
+            anti_threshold=get_keyword_x_value(anti_keyword_full) or 6,
+            torrent='torrent' in keywords,
+            blast='blast' in keywords,
+            heavy='heavy' in keywords,
+            lance='lance' in keywords,
+            lethal_hits='lethal_hits' in keywords,
+            twin_linked='twin-linked' in keywords,
+            devastating_wounds='devastating_wounds' in keywords,
+            ignores_cover='ignores_cover' in keywords,
+            hazardous='hazardous' in keywords,
+            assault='assault' in keywords,
+            pistol='pistol' in keywords,
+            indirect_fire='indirect_fire' in keywords,
+            precision='precision' in keywords
+        )
+
+    def crit_wound_boundary(self, opponent_keywords: Set[str]) -> int:
+        if self.anti_keyword is not None and self.anti_keyword in opponent_keywords:
+            return self.anti_threshold
+        return 6
+
+
 class Weapon:
     def __init__(
             self,
             name: str,
             weapon_range: int,
-            attacks: int | str,
+            attacks: int | str | DiceExpression,
             ballistic_skill: int,
             strength: int,
             armor_piercing: int,
-            damage: int,
+            damage: int | str | DiceExpression,
             keywords: Set[str]
     ):
         self.name = name
         self.weapon_range = weapon_range
-        self.attacks = attacks
+        self.attacks = DiceExpression.parse(attacks) # '2', 'D3', '2D6', 'D6+3' and the like, parsed once here
         self.ballistic_skill = ballistic_skill
         self.strength = strength
         self.armor_piercing = armor_piercing
-        self.damage = damage
-        self.keywords = keywords
+        self.damage = DiceExpression.parse(damage)
+        self.keywords = frozenset(keywords)
+        self.profile = WeaponProfile.from_keywords(keywords)
+
+    # Weapons are datasheet templates and never change during a fight, so every copy can share the same instance
+    def __copy__(self) -> 'Weapon':
+        return self
 
-    def get_num_attacks(self, engagement: 'Engagement'):
-        if 'D' in str(self.attacks).upper():
-            num_attacks = roll(1, int(self.attacks[1]))
+    def __deepcopy__(self, memo) -> 'Weapon':
+        return self
+
+    def get_num_attacks(self, engagement: 'Engagement', num_models: int=1):
+        # Total attacks of num_models models firing this weapon together
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
+        if self.attacks.is_random:
+            num_attacks = self.attacks.roll(num_models).sum()
         else:
-            num_attacks = self.attacks
-        num_attacks += rapid_fire(self.weapon_range, self.keywords, engagement.distance)
-        if 'blast' in self.keywords:
-            num_attacks += blast(engagement)
+            num_attacks = self.attacks.modifier * num_models
+        if engagement.distance <= self.weapon_range / 2:
+            num_attacks += num_models * self.profile.rapid_fire
+        if self.profile.blast:
+            num_attacks += num_models * blast(engagement)
+        if profiler is not None:
+            profiler.record('attacks', start, dice=num_models * self.attacks.num_dice)
         return num_attacks
 
-    def hit_roll(self, wielder_unit: 'Unit', engagement: 'Engagement') -> Tuple[int, int]:
-        num_attacks = self.get_num_attacks(engagement)
-        logger.debug(f'Weapon number of attacks: {num_attacks}.')
-        if 'torrent' in self.keywords:
+    def hit_roll(self, wielder_unit: 'Unit', engagement: 'Engagement', num_models: int=1) -> Tuple[int, int]:
+        num_attacks = self.get_num_attacks(engagement, num_models)
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(f'Weapon number of attacks: {num_attacks}.')
+        if self.profile.torrent:
             logger.debug('All attacks automatically hit due to the weapon having the "torrent" keyword.')
+            if profiler is not None:
+                profiler.count('torrent')
+                profiler.record('hit', start)
             return num_attacks, 0
 
         rolls = roll(num_attacks)
+        num_dice = len(rolls)
+        hit_dice = rolls
         num_crit_hits, rolls = handle_crits(rolls, 1, 6)
         if not engagement.line_of_sight: # implied that the weapon has 'indirect_fire' keyword, else would have failed the wielder.can_shoot() check
             rolls = rolls[(rolls > 3)]
             rolls -= 1
 
-        if 'heavy' in self.keywords:
+        if self.profile.heavy:
+            if profiler is not None and wielder_unit.last_action == 'remained_stationary':
+                profiler.count('heavy')
             rolls = heavy(rolls, wielder_unit)
 
-        logger.debug(f'Hit requirement is {self.ballistic_skill}')
         num_hits = (rolls >= self.ballistic_skill).sum() + num_crit_hits
-        num_hits += sustained_hits(num_crit_hits, self.keywords)
-        logger.debug(f'Hits: {num_hits}, of which Crits: {num_crit_hits}')
+        num_hits += num_crit_hits * self.profile.sustained_hits
+        if debug:
+            logger.debug(f'Hit requirement is {self.ballistic_skill}')
+            logger.debug(f'Hits: {num_hits}, of which Crits: {num_crit_hits}')
+        tracer = trace_recorder.active
+        if tracer is not None and tracer.recording:
+            tracer.record(
+                'hit', weapon=self.name, rolls=hit_dice, requirement=self.ballistic_skill, hits=num_hits,
+                crit_hits=num_crit_hits
+            )
+        if profiler is not None:
+            profiler.record('hit', start, dice=num_dice)
         return num_hits, num_crit_hits
 
-    def wound_roll(self, engagement: 'Engagement', wielder: 'Model', wielder_unit: 'Unit') -> Tuple[int, int] | None:
+    def wound_roll(
+            self, engagement: 'Engagement', wielder: 'Model', wielder_unit: 'Unit', group: List['Model'] | None = None
+    ) -> Tuple[int, int] | None:
+        # group: models with the same loadout and rules as wielder, all firing this weapon with one roll of the dice.
+        # Eligibility is checked for wielder only, so it stands for the whole group
+        group = [wielder] if group is None else group
         if not wielder.can_shoot(self, engagement, wielder_unit):
             return None
-        num_hits, num_crit_hits = self.hit_roll(wielder_unit, engagement)
+        num_hits, num_crit_hits = self.hit_roll(wielder_unit, engagement, len(group))
         if num_hits == 0:
             return 0, 0
+        profiler = phase_profiler.active
+        start = perf_counter() if profiler is not None else 0.0
 
         num_wounds = 0
-        if 'lethal_hits' in self.keywords:  # crit hits automatically become wounds
+        if self.profile.lethal_hits:  # crit hits automatically become wounds
             num_wounds, num_hits = lethal_hits(num_hits, num_crit_hits)
 
-        wound_roll_requirement = find_wound_roll_requirement(self.strength, engagement.opponent.get_toughness())
-        logger.debug(
-            f'Wound roll requirement is {wound_roll_requirement} due to weapon strength being {self.strength} and '
-            f'opponent toughness being {engagement.opponent.get_toughness()}.'
-        )
+        toughness = engagement.opponent.get_toughness()
+        wound_roll_requirement = find_wound_roll_requirement(self.strength, toughness)
+        debug = logger.isEnabledFor(logging.DEBUG)
+        if debug:
+            logger.debug(
+                f'Wound roll requirement is {wound_roll_requirement} due to weapon strength being {self.strength} and '
+                f'opponent toughness being {toughness}.'
+            )
 
         rolls = roll(num_hits)
-        if 'twin-linked' in self.keywords:
+        num_dice = len(rolls)
+        if self.profile.twin_linked:
+            if profiler is not None:
+                profiler.count('twin_linked')
+                num_dice += (rolls < wound_roll_requirement).sum()
             rolls = twin_linked(rolls, wound_roll_requirement)
+        wound_dice = rolls
 
-        crit_success_boundary = anti_keyword(self.keywords, engagement.opponent.get_all_models_keywords())
+        crit_success_boundary = self.profile.crit_wound_boundary(engagement.opponent.get_all_models_keywords())
         num_crit_wounds, rolls = handle_crits(rolls, fail_boundary=1, success_boundary=crit_success_boundary)
 
-        if 'lance' in self.keywords:
+        if self.profile.lance:
+            if profiler is not None and wielder_unit.last_action == 'charged':
+                profiler.count('lance')
             rolls = lance(rolls, wielder_unit)
 
-        if 'hazardous' in self.keywords:
-            hazardous(wielder)
+        if self.profile.hazardous:
+            if profiler is not None:
+                profiler.count('hazardous', len(group))
+                num_dice += len(group)
+            for model in group:
+                hazardous(model, wielder_unit)
 
         num_wounds += (rolls >= wound_roll_requirement).sum() + num_crit_wounds
-        logger.debug(f'Wounds: {num_wounds}, of which Crits: {num_crit_wounds}')
+        if debug:
+            logger.debug(f'Wounds: {num_wounds}, of which Crits: {num_crit_wounds}')
+        tracer = trace_recorder.active
+        if tracer is not None and tracer.recording:
+            tracer.record(
+                'wound', weapon=self.name, rolls=wound_dice, requirement=wound_roll_requirement,
+                crit_boundary=crit_success_boundary, wounds=num_wounds, crit_wounds=num_crit_wounds
+            )
+        if profiler is not None:
+            profiler.record('wound', start, dice=num_dice)
         return num_wounds, num_crit_wounds
 
 
@@ -0,0 +1,191 @@
+# Streaming accumulators - constant memory summaries of simulation outcomes that can be fed batch by batch and
+# merged across shards and workers
+import numpy as np
+from numpy.typing import NDArray
+from collections import Counter
+from math import ceil, log, sqrt
+from statistics import NormalDist
+from typing import Sequence
+
+
+def z_score(confidence: float) -> float:
+    return NormalDist().inv_cdf((1 + confidence) / 2)
+
+
+class RunningStats:
+    # Welford mean and variance, batches are folded in with Chan's parallel update
+    def __init__(self, count: int=0, mean: float=0.0, m2: float=0.0):
+        self.count = count
+        self.mean = mean
+        self.m2 = m2 # sum of squared deviations from the mean
+
+    def update(self, values: NDArray[np.number]):
+        if len(values):
+            batch_mean = float(values.mean())
+            self.fold(len(values), batch_mean, float(((values - batch_mean) ** 2).sum()))
+
+    def fold(self, count: int, mean: float, m2: float):
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta ** 2 * self.count * count / total
+        self.count = total
+
+    def merge(self, other: 'RunningStats') -> 'RunningStats':
+        merged = RunningStats(self.count, self.mean, self.m2)
+        if other.count:
+            merged.fold(other.count, other.mean, other.m2)
+        return merged
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def standard_error(self) -> float:
+        return sqrt(self.variance / self.count) if self.count else float('inf')
+
+    def half_width(self, confidence: float=0.95) -> float:
+        return z_score(confidence) * self.standard_error
+
+    def confidence_interval(self, confidence: float=0.95) -> tuple[float, float]:
+        half_width = self.half_width(confidence)
+        return self.mean - half_width, self.mean + half_width
+
+
+class BinomialCounter:
+    # Success counts with Wilson score intervals, which stay sensible for probabilities close to 0 or 1
+    def __init__(self, successes: int=0, trials: int=0):
+        self.successes = successes
+        self.trials = trials
+
+    def update(self, outcomes: NDArray[np.bool_]):
+        self.successes += int(outcomes.sum())
+        self.trials += len(outcomes)
+
+    def merge(self, other: 'BinomialCounter') -> 'BinomialCounter':
+        return BinomialCounter(self.successes + other.successes, self.trials + other.trials)
+
+    @property
+    def proportion(self) -> float:
+        return self.successes / self.trials if self.trials else 0.0
+
+    def confidence_interval(self, confidence: float=0.95) -> tuple[float, float]:
+        if not self.trials:
+            return 0.0, 1.0
+        z = z_score(confidence)
+        p = self.proportion
+        denominator = 1 + z ** 2 / self.trials
+        centre = (p + z ** 2 / (2 * self.trials)) / denominator
+        spread = z * sqrt(p * (1 - p) / self.trials + z ** 2 / (4 * self.trials ** 2)) / denominator
+        return max(centre - spread, 0.0), min(centre + spread, 1.0)
+
+    def half_width(self, confidence: float=0.95) -> float:
+        low, high = self.confidence_interval(confidence)
+        return (high - low) / 2
+
+
+class IntegerHistogram:
+    # Counts of non-negative integer outcomes (damage, models slain, wounds left), grown with np.bincount. Memory is
+    # set by the largest value seen, not by the number of trials, and quantiles are exact without sorting anything
+    def __init__(self, counts: NDArray[np.integer] | None = None):
+        self.counts = np.zeros(0, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    def update(self, values: NDArray[np.integer]):
+        counts = np.bincount(np.asarray(values).ravel(), minlength=len(self.counts))
+        self.counts = np.pad(self.counts, (0, len(counts) - len(self.counts))) + counts
+
+    def merge(self, other: 'IntegerHistogram') -> 'IntegerHistogram':
+        size = max(len(self.counts), len(other.counts))
+        return IntegerHistogram(
+            np.pad(self.counts, (0, size - len(self.counts))) + np.pad(other.counts, (0, size - len(other.counts)))
+        )
+
+    @property
+    def total(self) -> int:
+        return int(self.counts.sum())
+
+    @property
+    def mean(self) -> float:
+        return float(np.arange(len(self.counts)) @ self.counts / self.total) if self.total else 0.0
+
+    def stats(self) -> RunningStats:
+        values = np.arange(len(self.counts))
+        mean = self.mean
+        return RunningStats(self.total, mean, float(self.counts @ (values - mean) ** 2))
+
+    def distribution(self) -> NDArray[np.floating]:
+        return self.counts / self.total if self.total else self.counts.astype(float)
+
+    def probability_at_least(self, value: int) -> float:
+        return float(self.counts[value:].sum() / self.total) if self.total else 0.0
+
+    def quantiles(self, quantiles: Sequence[float]) -> NDArray[np.integer]:
+        # The smallest value with at least that share of trials at or below it
+        if not self.total:
+            raise ValueError('Cannot take quantiles of an empty histogram')
+        targets = np.maximum(np.ceil(np.asarray(quantiles) * self.total - 1e-9), 1) # 1e-9: 0.7 * 10 is 7.000...1
+        return np.searchsorted(np.cumsum(self.counts), targets)
+
+    def quantile(self, quantile: float) -> int:
+        return int(self.quantiles([quantile])[0])
+
+
+class QuantileSketch:
+    # Streaming quantiles of real valued outcomes, e.g. paired differences or weighted samples. A value lands in the
+    # log spaced bucket ceil(log_gamma(|value|)) (as in DDSketch), so quantiles come back within relative_accuracy of
+    # the true value. Merging adds bucket counts, which is exact and associative, and the number of buckets only
+    # grows with the log of the range of values
+    def __init__(self, relative_accuracy: float=0.01):
+        if not 0 < relative_accuracy < 1:
+            raise ValueError('relative_accuracy must be between 0 and 1')
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.positive = Counter()
+        self.negative = Counter()
+        self.zeros = 0
+
+    @property
+    def count(self) -> int:
+        return self.zeros + sum(self.positive.values()) + sum(self.negative.values())
+
+    def update(self, values: NDArray[np.number]):
+        values = np.asarray(values, dtype=float).ravel()
+        self.zeros += int((values == 0).sum())
+        for buckets, magnitudes in ((self.positive, values[values > 0]), (self.negative, -values[values < 0])):
+            keys, counts = np.unique(np.ceil(np.log(magnitudes) / log(self.gamma)).astype(int), return_counts=True)
+            buckets.update(dict(zip(keys.tolist(), counts.tolist())))
+
+    def merge(self, other: 'QuantileSketch') -> 'QuantileSketch':
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError('Can only merge sketches with the same relative accuracy')
+        merged = QuantileSketch(self.relative_accuracy)
+        merged.positive = self.positive + other.positive
+        merged.negative = self.negative + other.negative
+        merged.zeros = self.zeros + other.zeros
+        return merged
+
+    def bucket_value(self, key: int) -> float:
+        # Middle of (gamma^(key-1), gamma^key], within relative_accuracy of everything in the bucket
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantile(self, quantile: float) -> float:
+        count = self.count
+        if not count:
+            raise ValueError('Cannot take quantiles of an empty sketch')
+        rank = max(ceil(quantile * count - 1e-9), 1)
+        for key in sorted(self.negative, reverse=True):
+            rank -= self.negative[key]
+            if rank <= 0:
+                return -self.bucket_value(key)
+        rank -= self.zeros
+        if rank <= 0:
+            return 0.0
+        for key in sorted(self.positive):
+            rank -= self.positive[key]
+            if rank <= 0:
+                return self.bucket_value(key)
+        return self.bucket_value(max(self.positive))
+
+    def quantiles(self, quantiles: Sequence[float]) -> list[float]:
+        return [self.quantile(quantile) for quantile in quantiles]
@@ -0,0 +1,171 @@
+# Benchmarks for the combat pipeline - per-call latency and calls (trials) per second of every step of a shooting
+# round, on the datasheets plus synthetic horde and elite units of several sizes.
+# The modules import each other both flat and as warhammer.*, so run from inside a checkout named warhammer with
+# its parent and itself on the path:
+#   PYTHONPATH=..:. python benchmarks/bench_combat.py run --output current.json
+#   PYTHONPATH=..:. python benchmarks/bench_combat.py compare baseline.json current.json --threshold 0.1
+# tests/test_benchmarks.py runs every benchmark once, so a signature change breaks the test suite too
+import sys
+import json
+import time
+import argparse
+import platform
+import statistics
+import numpy as np
+from warhammer.datasheets.unit_collection import unit_collection
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+from utility_functions import roll
+from wh_standard_sim import shooting_round
+from wh_batch_sim import batch_shooting_round
+from typing import Callable, Dict, List
+
+UNIT_SIZES = (5, 10, 20, 30)
+BATCH_TRIALS = 10_000
+
+
+def synthetic_horde(size: int) -> Unit:
+    rifle = Weapon(
+        name='horde_rifle', weapon_range=24, attacks=1,
+        ballistic_skill=4, strength=3, armor_piercing=0, damage=1, keywords={'rapid_fire_1'}
+    )
+    model = Model(
+        name='horde_trooper', movement=6, toughness=3, save=5, invulnerable_save=None, wounds=1, leadership=7,
+        objective_control=2, ranged_weapons={'horde_rifle': rifle}, melee_weapons={}, abilities=set(),
+        faction=[], keywords={'infantry'}, faction_keywords=[]
+    )
+    return Unit(name=f'horde_{size}', models=model * size, point_cost=6 * size, in_melee_with=[])
+
+
+def synthetic_elite(size: int) -> Unit:
+    cannon = Weapon(
+        name='elite_cannon', weapon_range=18, attacks='D3',
+        ballistic_skill=3, strength=8, armor_piercing=2, damage='D3', keywords={'sustained_hits_1', 'twin-linked'}
+    )
+    model = Model(
+        name='elite_warrior', movement=5, toughness=6, save=3, invulnerable_save=4, wounds=3, leadership=6,
+        objective_control=1, ranged_weapons={'elite_cannon': cannon}, melee_weapons={}, abilities={'feel_no_pain_6'},
+        faction=[], keywords={'infantry'}, faction_keywords=[]
+    )
+    return Unit(name=f'elite_{size}', models=model * size, point_cost=40 * size, in_melee_with=[])
+
+
+def measure(func: Callable, setup: Callable | None = None, number: int = 200, repeat: int = 5) -> Dict[str, float]:
+    # Only func is timed, setup (e.g. resetting the defender) runs outside the timer before every call
+    per_call = []
+    for _ in range(repeat):
+        total = 0.0
+        for _ in range(number):
+            if setup is not None:
+                setup()
+            start = time.perf_counter()
+            func()
+            total += time.perf_counter() - start
+        per_call.append(total / number)
+    return {
+        'per_call_seconds': min(per_call),
+        'median_per_call_seconds': statistics.median(per_call),
+        'calls_per_second': 1 / min(per_call)
+    }
+
+
+def pipeline_benchmarks(label: str, attacker: Unit, defender: Unit, number: int) -> Dict[str, Dict[str, float]]:
+    engagement = Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=defender)
+    model = attacker.models[0]
+    weapon = attacker.select_weapon(model, engagement)
+    target = defender.models[0]
+    results = {
+        f'{label}/weapon.hit_roll': measure(lambda: weapon.hit_roll(attacker, engagement), number=number),
+        f'{label}/weapon.wound_roll': measure(lambda: weapon.wound_roll(engagement, model, attacker), number=number),
+        f'{label}/model.save_roll': measure(lambda: target.save_roll(4, 1, weapon, engagement), number=number),
+        f'{label}/unit.allocate_wounds': measure(
+            lambda: defender.allocate_wounds(4, weapon.damage), setup=defender.reset, number=number
+        ),
+        f'{label}/unit.shoot': measure(lambda: attacker.shoot(engagement), number=number),
+        f'{label}/shooting_round': measure(
+            lambda: shooting_round(attacker, engagement), setup=defender.reset, number=number
+        ),
+    }
+    defender.reset()
+    batch = measure(lambda: batch_shooting_round(attacker, engagement, BATCH_TRIALS), number=3, repeat=3)
+    results[f'{label}/batch_shooting_round'] = {**batch, 'calls_per_second': BATCH_TRIALS / batch['per_call_seconds']}
+    return results
+
+
+def run_benchmarks(number: int) -> Dict:
+    results = {
+        'roll/6': measure(lambda: roll(6), number=number * 10),
+        'roll/60': measure(lambda: roll(60), number=number * 10),
+    }
+    matchups = [
+        ('ctan_vs_allarus', unit_collection['ctan_shard_of_the_nightbringer'], unit_collection['allarus_custodians']),
+        ('allarus_vs_ctan', unit_collection['allarus_custodians'], unit_collection['ctan_shard_of_the_nightbringer']),
+        ('terminators_vs_terminators', unit_collection['example_terminator_unit'], unit_collection['example_terminator_unit']),
+    ]
+    matchups += [(f'horde_{size}_vs_elite_5', synthetic_horde(size), synthetic_elite(5)) for size in UNIT_SIZES]
+    matchups += [(f'elite_{size}_vs_horde_30', synthetic_elite(size), synthetic_horde(30)) for size in UNIT_SIZES]
+    for label, attacker, defender in matchups:
+        results.update(pipeline_benchmarks(label, attacker.spawn(), defender.spawn(), number))
+
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'python': platform.python_version(),
+            'numpy': np.__version__,
+            'machine': platform.machine(),
+            'processor': platform.processor(),
+        },
+        'results': results
+    }
+
+
+def compare(baseline: Dict, current: Dict, threshold: float) -> List[str]:
+    # A benchmark regresses when its best per call time got slower than baseline by more than threshold
+    regressions = []
+    print(f'{"benchmark":<55} {"baseline":>12} {"current":>12} {"change":>8}')
+    for name, result in current['results'].items():
+        if name not in baseline['results']:
+            print(f'{name:<55} {"-":>12} {result["per_call_seconds"] * 1e6:>10.1f}us {"new":>8}')
+            continue
+        before = baseline['results'][name]['per_call_seconds']
+        after = result['per_call_seconds']
+        change = after / before - 1
+        flag = ''
+        if change > threshold:
+            flag = '  SLOWER'
+            regressions.append(name)
+        print(f'{name:<55} {before * 1e6:>10.1f}us {after * 1e6:>10.1f}us {change:>+7.1%}{flag}')
+    return regressions
+
+
+def main(argv: List[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(description='Combat pipeline benchmarks.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    run_parser = subparsers.add_parser('run', help='run the benchmarks and write the results as JSON')
+    run_parser.add_argument('--output', default='bench_results.json')
+    run_parser.add_argument('--number', type=int, default=200, help='calls per timing repeat')
+    compare_parser = subparsers.add_parser('compare', help='flag slowdowns against a stored baseline')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=0.10, help='allowed slowdown, 0.10 = 10%%')
+    args = parser.parse_args(argv)
+
+    if args.command == 'run':
+        results = run_benchmarks(args.number)
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=4)
+        print(f'Wrote {len(results["results"])} benchmarks to {args.output}')
+        return 0
+
+    with open(args.baseline) as baseline_file, open(args.current) as current_file:
+        regressions = compare(json.load(baseline_file), json.load(current_file), args.threshold)
+    if regressions:
+        print(f'{len(regressions)} benchmark(s) slower than baseline by more than {args.threshold:.0%}')
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,108 @@
+# Datasheet catalog - weapons, models and units live in JSON files and are only built into objects when asked for.
+# The parsed JSON (plain dicts, not built objects) is cached as a pickle next to each file, keyed by the source file's
+# mtime and size, so a fresh process (e.g. a pool worker) skips the JSON parsing. Objects are still built from those
+# dicts, once per process and only for the entries it actually uses
+import os
+import json
+import pickle
+from collections.abc import Mapping
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+import logging
+logger = logging.getLogger(__name__)
+from typing import Any, Callable, Dict, Iterator
+
+CATALOG_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIRECTORY_NAME = '.catalog_cache'
+
+
+def load_entries(path: str) -> Dict[str, Dict[str, Any]]:
+    source = os.stat(path)
+    cache_path = os.path.join(os.path.dirname(path), CACHE_DIRECTORY_NAME, os.path.basename(path) + '.pickle')
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            cached = pickle.load(cache_file)
+        if cached['mtime_ns'] == source.st_mtime_ns and cached['size'] == source.st_size:
+            return cached['entries']
+        logger.debug(f'Cached entries of {path} are stale, parsing it again.')
+    except (OSError, EOFError, KeyError, pickle.UnpicklingError):
+        logger.debug(f'No usable cached entries for {path}, parsing it.')
+
+    with open(path) as source_file:
+        entries = json.load(source_file)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        temporary_path = f'{cache_path}.{os.getpid()}.tmp' # workers may rebuild at the same time, replace atomically
+        with open(temporary_path, 'wb') as cache_file:
+            pickle.dump({'mtime_ns': source.st_mtime_ns, 'size': source.st_size, 'entries': entries}, cache_file)
+        os.replace(temporary_path, cache_path)
+    except OSError:
+        logger.debug(f'Could not cache the entries of {path}, carrying on without them.')
+    return entries
+
+
+class LazyCollection(Mapping):
+    # Read-only name -> object mapping. The entries are loaded on first access, each object is built on first lookup.
+    # Built objects are templates: with spawn, every lookup hands out a fresh spawn() of the template, so no caller
+    # can change what the next one gets. Without it the template itself is shared, only for immutable objects
+    def __init__(self, path: str, build: Callable[[str, Dict[str, Any]], Any], spawn: bool=True):
+        self.path = path
+        self.build = build
+        self.spawn = spawn
+        self._entries = None
+        self._built = {}
+
+    @property
+    def entries(self) -> Dict[str, Dict[str, Any]]:
+        if self._entries is None:
+            self._entries = load_entries(self.path)
+        return self._entries
+
+    def __getitem__(self, name: str) -> Any:
+        if name not in self._built:
+            self._built[name] = self.build(name, self.entries[name])
+        return self._built[name].spawn() if self.spawn else self._built[name]
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.entries)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def __contains__(self, name: object) -> bool:
+        return name in self.entries
+
+
+class Catalog:
+    def __init__(self, directory: str=CATALOG_DIRECTORY):
+        # Weapons are never modified once built (copying one returns itself), so one instance is shared
+        self.weapons = LazyCollection(os.path.join(directory, 'weapons.json'), self.build_weapon, spawn=False)
+        self.models = LazyCollection(os.path.join(directory, 'models.json'), self.build_model)
+        self.units = LazyCollection(os.path.join(directory, 'units.json'), self.build_unit)
+
+    def build_weapon(self, name: str, entry: Dict[str, Any]) -> Weapon:
+        return Weapon(name=name, **{**entry, 'keywords': set(entry['keywords'])})
+
+    def build_model(self, name: str, entry: Dict[str, Any]) -> Model:
+        return Model(
+            name=name,
+            **{
+                **entry,
+                'ranged_weapons': {weapon: self.weapons[weapon] for weapon in entry['ranged_weapons']},
+                'melee_weapons': {weapon: self.weapons[weapon] for weapon in entry['melee_weapons']},
+                'abilities': set(entry['abilities']),
+                'keywords': set(entry['keywords'])
+            }
+        )
+
+    def build_unit(self, name: str, entry: Dict[str, Any]) -> Unit:
+        return Unit(
+            name=name,
+            models=[model for model_name, count in entry['models'].items() for model in self.models[model_name] * count],
+            point_cost=entry['point_cost'],
+            in_melee_with=[]
+        )
+
+
+catalog = Catalog()
@@ -0,0 +1,108 @@
+# Opt-in profiling of the attack sequence - call counts, dice rolled and wall time per phase, plus how often each
+# keyword branch fires. Instrumented code only checks `phase_profiler.active is not None` while profiling is off,
+# so the hooks can stay in the hot paths. Phase times are taken around the phase's own work, except allocation,
+# which includes the feel no pain rolls made while allocating
+import time
+from collections import Counter
+from contextlib import contextmanager
+from dataclasses import dataclass, asdict
+from functools import wraps
+from typing import Any, Callable, Dict, Iterator
+
+PHASES = ('attacks', 'hit', 'wound', 'save', 'damage', 'feel_no_pain', 'allocation')
+KEYWORD_BRANCHES = ('torrent', 'heavy', 'lance', 'twin_linked', 'hazardous', 'devastating_wounds')
+
+
+@dataclass
+class PhaseStats:
+    calls: int = 0
+    dice: int = 0
+    seconds: float = 0.0
+
+
+class Profiler:
+    def __init__(self):
+        self.phases = {phase: PhaseStats() for phase in PHASES}
+        self.keywords = Counter({keyword: 0 for keyword in KEYWORD_BRANCHES})
+
+    def record(self, phase: str, start: float, dice: int=0, calls: int=1):
+        stats = self.phases[phase]
+        stats.calls += calls
+        stats.dice += int(dice)
+        stats.seconds += time.perf_counter() - start
+
+    def count(self, keyword: str, times: int=1):
+        # Batch engines count once per model and trial, so the numbers compare with the model-by-model path
+        self.keywords[keyword] += int(times)
+
+    def merge(self, other: 'Profiler') -> 'Profiler':
+        merged = Profiler()
+        for phase in PHASES:
+            mine, theirs = self.phases[phase], other.phases[phase]
+            merged.phases[phase] = PhaseStats(mine.calls + theirs.calls, mine.dice + theirs.dice, mine.seconds + theirs.seconds)
+        merged.keywords = self.keywords + other.keywords
+        merged.keywords.update({keyword: 0 for keyword in KEYWORD_BRANCHES})
+        return merged
+
+    def report(self) -> Dict[str, Any]:
+        total_seconds = sum(stats.seconds for stats in self.phases.values())
+        return {
+            'phases': {
+                phase: {**asdict(stats), 'share': stats.seconds / total_seconds if total_seconds else 0.0}
+                for phase, stats in self.phases.items()
+            },
+            'keywords': dict(self.keywords),
+            'total_seconds': total_seconds
+        }
+
+    def format_report(self) -> str:
+        report = self.report()
+        lines = [f'{"phase":<14} {"calls":>10} {"dice":>12} {"seconds":>10} {"share":>7}']
+        for phase, stats in report['phases'].items():
+            lines.append(
+                f'{phase:<14} {stats["calls"]:>10} {stats["dice"]:>12} {stats["seconds"]:>10.4f} {stats["share"]:>7.1%}'
+            )
+        lines.append('keyword branches: ' + ', '.join(f'{keyword}={count}' for keyword, count in report['keywords'].items()))
+        return '\n'.join(lines)
+
+
+active: Profiler | None = None
+
+
+def enable(profiler: Profiler | None = None) -> Profiler:
+    global active
+    active = profiler if profiler is not None else Profiler()
+    return active
+
+
+def disable() -> Profiler | None:
+    global active
+    profiler, active = active, None
+    return profiler
+
+
+@contextmanager
+def profiling(profiler: Profiler | None = None) -> Iterator[Profiler]:
+    """Profile everything run inside the with block, then restore whatever was active before"""
+    global active
+    previous = active
+    try:
+        yield enable(profiler)
+    finally:
+        active = previous
+
+
+def timed(phase: str) -> Callable[[Callable], Callable]:
+    # For functions that make up a whole phase on their own (the exact engine has no dice to count)
+    def decorator(func: Callable) -> Callable:
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            profiler = active
+            if profiler is None:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            result = func(*args, **kwargs)
+            profiler.record(phase, start)
+            return result
+        return wrapper
+    return decorator
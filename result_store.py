@@ -0,0 +1,170 @@
+# Append-only columnar store for per-trial outcomes. Each column is a raw binary file that is only ever appended to,
+# read back through np.memmap, and a JSON manifest records how many rows are committed. The manifest is replaced
+# atomically after the column data is flushed to disk, so a crash loses at most the chunk being written: opening
+# the store again cuts the columns back to the committed rows. Aggregates are computed chunk by chunk, so memory
+# stays flat however many trials are stored
+import os
+import json
+import numpy as np
+from numpy.typing import NDArray
+from accumulators import RunningStats, IntegerHistogram
+import logging
+logger = logging.getLogger(__name__)
+from typing import Any, Callable, Dict, Iterator, Sequence, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from wh_batch_sim import BatchResult
+
+MANIFEST = 'manifest.json'
+STORE_VERSION = 1
+
+
+def outcome_columns(num_defender_models: int) -> Dict[str, Tuple[str, Tuple[int, ...]]]:
+    # Column name -> (dtype, shape of one row) for the outcomes of a BatchResult
+    return {
+        'damage': ('int32', ()),
+        'models_slain': ('int16', ()),
+        'hazardous_damage': ('int32', ()),
+        'remaining_wounds': ('int16', (num_defender_models,))
+    }
+
+
+def batch_outcomes(result: 'BatchResult') -> Dict[str, NDArray[np.integer]]:
+    return {
+        'damage': result.damage,
+        'models_slain': result.models_slain,
+        'hazardous_damage': result.hazardous_damage,
+        'remaining_wounds': result.remaining_wounds
+    }
+
+
+class ResultStore:
+    def __init__(self, path: str, manifest: Dict[str, Any]):
+        # Use ResultStore.create or ResultStore.open
+        self.path = path
+        self.manifest = manifest
+        self.columns = {
+            name: (np.dtype(dtype), tuple(shape)) for name, (dtype, shape) in manifest['columns'].items()
+        }
+
+    @classmethod
+    def create(
+            cls, path: str, columns: Dict[str, Tuple[str, Tuple[int, ...]]], metadata: Dict[str, Any] | None = None
+    ) -> 'ResultStore':
+        """Create an empty store in directory path"""
+        if os.path.exists(os.path.join(path, MANIFEST)):
+            raise ValueError(f'{path} already holds a result store')
+        os.makedirs(path, exist_ok=True)
+        store = cls(path, {
+            'version': STORE_VERSION,
+            'columns': {name: [np.dtype(dtype).str, list(shape)] for name, (dtype, shape) in columns.items()},
+            'rows': 0,
+            'chunks': [],
+            'metadata': metadata or {}
+        })
+        for name in store.columns:
+            open(store.column_path(name), 'wb').close()
+        store.checkpoint()
+        return store
+
+    @classmethod
+    def open(cls, path: str) -> 'ResultStore':
+        """Open an existing store, dropping anything written after its last checkpoint"""
+        with open(os.path.join(path, MANIFEST)) as manifest_file:
+            manifest = json.load(manifest_file)
+        if manifest['version'] != STORE_VERSION:
+            raise ValueError(f'{path} is a version {manifest["version"]} result store, expected {STORE_VERSION}')
+        store = cls(path, manifest)
+        for name in store.columns:
+            committed = store.rows * store.row_bytes(name)
+            if os.path.getsize(store.column_path(name)) > committed:
+                logger.debug(f'Dropping uncommitted rows of {name}')
+                os.truncate(store.column_path(name), committed)
+        return store
+
+    @property
+    def rows(self) -> int:
+        return self.manifest['rows']
+
+    @property
+    def chunks(self) -> list:
+        return self.manifest['chunks']
+
+    @property
+    def metadata(self) -> Dict[str, Any]:
+        return self.manifest['metadata']
+
+    def column_path(self, name: str) -> str:
+        return os.path.join(self.path, f'{name}.bin')
+
+    def row_bytes(self, name: str) -> int:
+        dtype, shape = self.columns[name]
+        return dtype.itemsize * int(np.prod(shape, dtype=int))
+
+    def append(self, outcomes: Dict[str, NDArray[np.number]], **chunk_info: Any):
+        """Append one chunk of rows to every column and checkpoint"""
+        if set(outcomes) != set(self.columns):
+            raise ValueError(f'Expected columns {sorted(self.columns)}, got {sorted(outcomes)}')
+        num_rows = {len(values) for values in outcomes.values()}
+        if len(num_rows) != 1:
+            raise ValueError('Every column of a chunk needs the same number of rows')
+        num_rows = num_rows.pop()
+        for name, values in outcomes.items():
+            dtype, shape = self.columns[name]
+            if np.shape(values)[1:] != shape:
+                raise ValueError(f'Rows of {name} have shape {np.shape(values)[1:]}, expected {shape}')
+            with open(self.column_path(name), 'ab') as column_file:
+                np.ascontiguousarray(values, dtype=dtype).tofile(column_file)
+                column_file.flush()
+                os.fsync(column_file.fileno())
+        self.manifest['rows'] += num_rows
+        self.manifest['chunks'].append({'rows': num_rows, **chunk_info})
+        self.checkpoint()
+
+    def checkpoint(self):
+        # Write the manifest next to the old one and swap it in, a reader never sees a half written manifest
+        temporary = os.path.join(self.path, MANIFEST + '.tmp')
+        with open(temporary, 'w') as manifest_file:
+            json.dump(self.manifest, manifest_file, indent=4)
+            manifest_file.flush()
+            os.fsync(manifest_file.fileno())
+        os.replace(temporary, os.path.join(self.path, MANIFEST))
+
+    def column(self, name: str) -> NDArray[np.number]:
+        """Read-only memory map of the committed rows of a column"""
+        dtype, shape = self.columns[name]
+        if self.rows == 0:
+            return np.empty((0, *shape), dtype=dtype)
+        return np.memmap(self.column_path(name), dtype=dtype, mode='r', shape=(self.rows, *shape))
+
+    def iter_chunks(
+            self, name: str, chunk_rows: int = 1_000_000, transform: Callable[[NDArray], NDArray] | None = None
+    ) -> Iterator[NDArray[np.number]]:
+        # transform turns a chunk into one value per row, e.g. lambda wounds: wounds.sum(axis=1)
+        column = self.column(name)
+        for start in range(0, self.rows, chunk_rows):
+            chunk = np.asarray(column[start:start + chunk_rows])
+            yield transform(chunk) if transform is not None else chunk
+
+    def histogram(
+            self, name: str, chunk_rows: int = 1_000_000, transform: Callable[[NDArray], NDArray] | None = None
+    ) -> IntegerHistogram:
+        """Counts of every value of an integer column"""
+        histogram = IntegerHistogram()
+        for chunk in self.iter_chunks(name, chunk_rows, transform):
+            histogram.update(chunk)
+        return histogram
+
+    def quantiles(
+            self, name: str, quantiles: Sequence[float], chunk_rows: int = 1_000_000,
+            transform: Callable[[NDArray], NDArray] | None = None
+    ) -> NDArray[np.integer]:
+        """Exact quantiles of an integer column, the smallest value with at least that share of rows at or below it"""
+        return self.histogram(name, chunk_rows, transform).quantiles(quantiles)
+
+    def stats(
+            self, name: str, chunk_rows: int = 1_000_000, transform: Callable[[NDArray], NDArray] | None = None
+    ) -> RunningStats:
+        stats = RunningStats()
+        for chunk in self.iter_chunks(name, chunk_rows, transform):
+            stats.update(chunk.ravel().astype(float))
+        return stats
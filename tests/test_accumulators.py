@@ -0,0 +1,62 @@
+# Fixed memory accumulators: histograms are exact and merge exactly, quantile sketches stay within their relative
+# accuracy, whichever way the data is split between them
+import numpy as np
+import pytest
+from accumulators import IntegerHistogram, QuantileSketch
+
+QUANTILES = (0.01, 0.1, 0.25, 0.5, 0.7, 0.9, 0.99, 1.0)
+
+
+def test_histogram_quantiles_are_exact():
+    values = np.random.default_rng(0).poisson(4, size=10_001)
+    histogram = IntegerHistogram()
+    for batch in np.array_split(values, 3):
+        histogram.update(batch)
+    assert histogram.total == len(values)
+    assert histogram.quantiles(QUANTILES).tolist() == np.quantile(values, QUANTILES, method='inverted_cdf').tolist()
+    assert histogram.mean == pytest.approx(values.mean())
+    assert histogram.stats().variance == pytest.approx(values.var(ddof=1))
+    assert histogram.probability_at_least(6) == pytest.approx((values >= 6).mean())
+    assert IntegerHistogram(np.bincount([0, 0, 1, 2, 3, 3, 3, 4, 5, 9])).quantile(0.7) == 3 # 7 of 10 values are <= 3
+
+
+def test_histogram_merge_is_the_histogram_of_all_values():
+    first, second = IntegerHistogram(), IntegerHistogram()
+    first.update(np.array([0, 1, 1, 5]))
+    second.update(np.array([2, 12]))
+    merged = first.merge(second)
+    assert merged.counts.tolist() == np.bincount([0, 1, 1, 5, 2, 12]).tolist()
+    assert len(first.counts) == 6 # merging leaves both inputs alone
+    with pytest.raises(ValueError):
+        IntegerHistogram().quantiles([0.5])
+
+
+def test_sketch_quantiles_are_within_relative_accuracy():
+    rng = np.random.default_rng(1)
+    values = np.concatenate([rng.lognormal(2, 1.5, 20_000), -rng.lognormal(0, 1, 5_000), np.zeros(1_000)])
+    sketch = QuantileSketch(relative_accuracy=0.01)
+    for batch in np.array_split(rng.permutation(values), 4):
+        sketch.update(batch)
+    assert sketch.count == len(values)
+    for quantile, true in zip(QUANTILES, np.quantile(values, QUANTILES, method='inverted_cdf')):
+        assert abs(sketch.quantile(quantile) - true) <= 0.01 * abs(true) + 1e-12, quantile
+
+
+def test_sketch_merge_matches_one_sketch_of_everything():
+    rng = np.random.default_rng(2)
+    parts = [rng.normal(0, 10, 1_000) for _ in range(3)]
+    whole = QuantileSketch()
+    whole.update(np.concatenate(parts))
+    sketches = []
+    for part in parts:
+        sketch = QuantileSketch()
+        sketch.update(part)
+        sketches.append(sketch)
+    left = sketches[0].merge(sketches[1]).merge(sketches[2])
+    right = sketches[0].merge(sketches[1].merge(sketches[2]))
+    for sketch in (left, right):
+        assert sketch.quantiles(QUANTILES) == whole.quantiles(QUANTILES)
+    with pytest.raises(ValueError):
+        whole.merge(QuantileSketch(relative_accuracy=0.05))
+    with pytest.raises(ValueError):
+        QuantileSketch(relative_accuracy=1.5)
@@ -0,0 +1,57 @@
+# Adaptive runs stop at the first shard where the confidence intervals are narrow enough, the same shard for any
+# number of workers, and the intervals they stop on cover the exact answer
+import numpy as np
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from accumulators import RunningStats, BinomialCounter
+from wh_exact_sim import exact_shooting_round
+from wh_parallel_sim import parallel_shooting_rounds
+
+
+def engagement() -> Engagement:
+    return Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=unit_collection['allarus_custodians'])
+
+
+def test_running_stats_and_binomial_counter():
+    values = np.random.default_rng(0).integers(0, 10, size=1_000)
+    stats = RunningStats()
+    for batch in np.array_split(values, 7):
+        stats.update(batch)
+    merged = RunningStats()
+    merged.update(values[:300])
+    other = RunningStats()
+    other.update(values[300:])
+    for result in (stats, merged.merge(other)):
+        assert result.count == 1_000
+        assert np.isclose(result.mean, values.mean()) and np.isclose(result.variance, values.var(ddof=1))
+
+    counter = BinomialCounter()
+    counter.update(values < 3)
+    low, high = counter.confidence_interval()
+    assert low < counter.proportion < high
+    assert BinomialCounter(0, 50).confidence_interval()[0] == 0.0 # Wilson intervals stay inside [0, 1]
+
+
+def test_stops_once_converged_for_any_number_of_workers():
+    attacker = unit_collection['example_terminator_unit']
+    exact = exact_shooting_round(attacker, engagement())
+    runs = [
+        parallel_shooting_rounds(
+            attacker, engagement(), 200_000, seed=4, max_workers=workers, shard_size=1_000, target_precision=0.05,
+            kill_precision=0.01
+        ) for workers in (1, 2)
+    ]
+    for run in runs:
+        assert run.num_trials < 200_000 and run.num_trials % 1_000 == 0
+        assert run.damage_stats.half_width() <= 0.05 and run.kills.half_width() <= 0.01
+        low, high = run.damage_stats.confidence_interval(0.999)
+        assert low < exact.expected_damage < high
+    assert runs[0].num_trials == runs[1].num_trials
+    assert np.array_equal(runs[0].damage_histogram, runs[1].damage_histogram)
+
+
+def test_without_a_target_every_trial_runs():
+    run = parallel_shooting_rounds(
+        unit_collection['example_terminator_unit'], engagement(), 2_500, seed=1, max_workers=1, shard_size=1_000
+    )
+    assert run.num_trials == run.damage.total == 2_500
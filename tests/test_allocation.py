@@ -0,0 +1,63 @@
+# Wound allocation to attached units: bodyguards first, leaders first for precision attacks, in every engine
+import numpy as np
+from warhammer.datasheets.unit_collection import unit_collection
+from Model import Model
+from Unit import Unit
+from UnitState import UnitState
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round
+from wh_batch_sim import batch_shooting_round
+from wh_compare import unit_variant, weapon_variant
+
+
+def attached_unit() -> Unit:
+    template = unit_collection['example_terminator_unit'].starting_models[0]
+
+    def model(name: str, toughness: int, wounds: int, keywords: set) -> Model:
+        return Model(
+            name, template.movement, toughness, template.save, template.invulnerable_save, wounds,
+            template.leadership, template.objective_control, template.ranged_weapons, template.melee_weapons, [],
+            template.faction, keywords, template.faction_keywords
+        )
+    return Unit(
+        'attached', [model('captain', 5, 5, {'infantry', 'character'})] +
+        [model('guard', 4, 3, {'infantry'}) for _ in range(3)], 100, []
+    )
+
+
+def precise_attackers() -> dict:
+    base = unit_collection['allarus_custodians']
+    name, weapon = next(iter(base.starting_models[0].ranged_weapons.items()))
+    precise = weapon_variant(weapon, name='precise_spear', keywords=set(weapon.keywords) | {'precision'})
+    mixed = unit_variant(base, name, precise)
+    mixed.starting_models[0].ranged_weapons = dict(base.starting_models[0].ranged_weapons)
+    return {'plain': base.spawn(), 'precision': unit_variant(base, name, precise), 'mixed': mixed}
+
+
+def test_state_targets_leaders_only_for_precision():
+    state = UnitState.from_unit(attached_unit(), 2)
+    state.current_wounds[1, 1:] = 0 # bodyguard gone in the second trial
+    assert list(state.allocation_targets()) == [1, 0]
+    assert list(state.allocation_targets(precision=True)) == [0, 0]
+
+
+def test_scalar_precision_goes_to_the_leader():
+    unit = attached_unit()
+    unit.allocate_wounds(1, 1, precision=True)
+    unit.allocate_wounds(1, 1)
+    assert [model.current_wounds for model in unit.models] == [4, 2, 3, 3]
+
+
+def test_exact_and_batch_agree_with_precision():
+    expected_slain = {}
+    for name, attacker in precise_attackers().items():
+        defender = attached_unit()
+        engagement = Engagement(distance=7, line_of_sight=True, in_cover=False, opponent=defender)
+        exact = exact_shooting_round(attacker, engagement)
+        batch = batch_shooting_round(attacker, engagement, 200_000, np.random.default_rng(0))
+        assert abs(exact.damage.sum() - 1) < 1e-9
+        assert abs(batch.damage.mean() - exact.expected_damage) < 0.03, name
+        assert abs(batch.models_slain.mean() - exact.expected_models_slain) < 0.01, name
+        expected_slain[name] = exact.expected_models_slain
+    # Precision wounds go into the tougher leader instead of finishing off the guards
+    assert max(expected_slain['precision'], expected_slain['mixed']) < expected_slain['plain'] - 0.3
@@ -0,0 +1,47 @@
+# The branch and bound search finds the same best list as trying every list within the points limit
+import itertools
+import numpy as np
+from wh_army_list import optimize
+
+
+def brute_force(values, costs, points_limit, weights, metric, max_copies=3) -> float:
+    counts = np.array(list(itertools.product(range(max_copies + 1), repeat=len(costs))))
+    counts = counts[counts @ costs <= points_limit]
+    if metric == 'damage':
+        per_opponent = counts @ values
+    else:
+        per_opponent = 1 - np.exp(counts @ np.log1p(-values))
+    return float((per_opponent @ weights).max())
+
+
+def random_instance(rng: np.random.Generator, metric: str, num_units: int = 6, num_opponents: int = 3):
+    if metric == 'damage':
+        values = rng.uniform(0, 5, (num_units, num_opponents))
+    else:
+        values = rng.uniform(0, 0.4, (num_units, num_opponents)) * (rng.random((num_units, num_opponents)) < 0.7)
+    costs = rng.integers(60, 400, num_units)
+    weights = rng.uniform(0.5, 2, num_opponents)
+    return values, costs, int(rng.integers(300, 1500)), weights
+
+
+def test_optimize_matches_brute_force():
+    rng = np.random.default_rng(0)
+    for metric in ('damage', 'kill'):
+        for _ in range(40):
+            values, costs, points_limit, weights = random_instance(rng, metric)
+            best = brute_force(values, costs, points_limit, weights, metric)
+            counts, value, _ = optimize(values, costs, points_limit, weights, metric, tolerance=0.0)
+            assert counts @ costs <= points_limit and (counts <= 3).all()
+            assert abs(value - best) < 1e-9, metric
+            counts, value, _ = optimize(values, costs, points_limit, weights, metric)
+            assert value >= best * (1 - 1e-4) - 1e-12, metric
+
+
+def test_optimize_respects_max_copies_and_nodes():
+    rng = np.random.default_rng(1)
+    values, costs, points_limit, weights = random_instance(rng, 'damage')
+    counts, value, nodes = optimize(values, costs, 10 * points_limit, weights, max_copies=1)
+    assert (counts <= 1).all()
+    assert abs(value - brute_force(values, costs, 10 * points_limit, weights, 'damage', max_copies=1)) < 1e-9
+    _, _, nodes = optimize(values, costs, points_limit, weights, tolerance=0.0, max_nodes=3)
+    assert nodes <= 3
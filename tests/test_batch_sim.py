@@ -0,0 +1,73 @@
+# Save semantics shared by the scalar and batched engines: AP and cover only modify the armour save, the invulnerable
+# save is taken as is, and cover only helps against shooting
+import numpy as np
+import pytest
+from utility_functions import seeded_rng, find_save_roll_requirement, benefits_from_cover
+from UnitState import UnitState
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+from wh_batch_sim import batch_save_roll
+
+NUM_WOUNDS = 60_000
+
+
+def weapon(armor_piercing: int, weapon_range: int=24, keywords: set=frozenset()) -> Weapon:
+    return Weapon(
+        name='gun', weapon_range=weapon_range, attacks=1, ballistic_skill=3, strength=4, armor_piercing=armor_piercing,
+        damage=1, keywords=set(keywords)
+    )
+
+
+def defender(save: int, invulnerable_save: int | None) -> Unit:
+    model = Model(
+        name='target', movement=6, toughness=4, save=save, invulnerable_save=invulnerable_save, wounds=1,
+        leadership=6, objective_control=1, ranged_weapons={}, melee_weapons={}, abilities=set(), faction=[],
+        keywords={'infantry'}, faction_keywords=[]
+    )
+    return Unit(name='targets', models=model * 5, point_cost=50, in_melee_with=[])
+
+
+@pytest.mark.parametrize('save, invulnerable_save, armor_piercing, cover, requirement', [
+    (3, None, 0, False, 3),
+    (3, None, 2, False, 5),
+    (3, None, 2, True, 4),    # cover is +1 to the armour save
+    (3, 4, 2, False, 4),      # AP pushes the armour save past the invulnerable one
+    (4, 5, 3, True, 5),       # AP doesn't touch the invulnerable save
+    (5, 5, 1, True, 5),       # neither does cover
+    (2, 4, 0, True, 1),       # a 1 still always fails, see Model.save_roll
+])
+def test_save_roll_requirement(save, invulnerable_save, armor_piercing, cover, requirement):
+    assert find_save_roll_requirement(save, invulnerable_save, armor_piercing, cover) == requirement
+
+
+@pytest.mark.parametrize('save, shot, in_cover, expected', [
+    (4, weapon(0), True, True),
+    (3, weapon(0), True, False),    # 3+ or better gets nothing from cover against AP0
+    (3, weapon(1), True, True),
+    (4, weapon(0), False, False),
+    (4, weapon(1, weapon_range=1), True, False),                 # not against melee
+    (4, weapon(1, keywords={'ignores_cover'}), True, False),
+])
+def test_benefits_from_cover(save, shot, in_cover, expected):
+    engagement = Engagement(distance=6, line_of_sight=True, in_cover=in_cover, opponent=None)
+    assert benefits_from_cover(save, shot, engagement) == expected
+
+
+@pytest.mark.parametrize('in_cover, requirement', [(False, 5), (True, 4)])
+def test_scalar_and_batch_saves_fail_as_often_as_the_requirement_says(in_cover, requirement):
+    # 3+ armour and a 5+ invulnerable save against AP2: the invulnerable save out of cover, the armour save in it
+    unit, shot = defender(3, 5), weapon(2)
+    engagement = Engagement(distance=6, line_of_sight=True, in_cover=in_cover, opponent=unit)
+    fail_rate = (requirement - 1) / 6
+    with seeded_rng(np.random.default_rng(0)):
+        scalar = unit.models[0].save_roll(NUM_WOUNDS, 0, shot, engagement) / NUM_WOUNDS
+    num_trials = NUM_WOUNDS // 3
+    batch = batch_save_roll(
+        shot, engagement, np.full(num_trials, 3), np.zeros(num_trials, dtype=int), UnitState.from_unit(unit, num_trials),
+        np.random.default_rng(0)
+    ).sum() / NUM_WOUNDS
+    tolerance = 5 * np.sqrt(fail_rate * (1 - fail_rate) / NUM_WOUNDS)
+    assert abs(scalar - fail_rate) < tolerance
+    assert abs(batch - fail_rate) < tolerance
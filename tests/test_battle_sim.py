@@ -0,0 +1,71 @@
+# Battle engine checks. Run like the benchmarks, with the checkout importable as warhammer and its modules on the
+# path, e.g. PYTHONPATH=..:. python -m pytest tests from inside a checkout named warhammer
+import numpy as np
+from warhammer.datasheets.unit_collection import unit_collection
+from wh_battle_sim import Battle, simulate_battles
+
+
+class RecordingBattle(Battle):
+    # Remembers whose turn it is and which units fought as having charged in every fight step
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.active = None
+        self.fights = []
+
+    def turn(self, side: int):
+        self.active = side
+        super().turn(side)
+
+    def fight(self, side: int, eligible):
+        self.fights.append((side, self.active, int((self.charged[side] & eligible).sum())))
+        super().fight(side, eligible)
+
+
+def test_only_the_active_side_fights_on_the_charge():
+    battle = RecordingBattle(
+        ([unit_collection['allarus_custodians']], [unit_collection['ctan_shard_of_the_nightbringer']]), 2000, 24,
+        rng=np.random.default_rng(0)
+    )
+    for _ in range(5):
+        for side in (0, 1):
+            battle.turn(side)
+    assert any(charged for side, active, charged in battle.fights if side == active)
+    assert all(charged == 0 for side, active, charged in battle.fights if side != active)
+
+
+def test_battles_are_reproducible_and_end_with_one_side_standing():
+    sides = [unit_collection['allarus_custodians']], [unit_collection['ctan_shard_of_the_nightbringer']]
+    first = simulate_battles(*sides, 500, rng=np.random.default_rng(1))
+    second = simulate_battles(*sides, 500, rng=np.random.default_rng(1))
+    assert np.array_equal(first.winner, second.winner)
+    assert np.array_equal(first.remaining_wounds[0][0], second.remaining_wounds[0][0])
+    decided = first.winner >= 0
+    for side in (0, 1):
+        standing = first.remaining_wounds[side][0].sum(axis=1) > 0
+        assert np.array_equal(standing[decided], first.winner[decided] == side)
+
+
+def unit_snapshot(unit) -> tuple:
+    return unit.last_action, list(unit.in_melee_with), [model.current_wounds for model in unit.models]
+
+
+def test_battles_leave_the_units_they_are_given_alone():
+    terminators, custodians = unit_collection['example_terminator_unit'], unit_collection['allarus_custodians']
+    ctan = unit_collection['ctan_shard_of_the_nightbringer']
+    matchups = [([terminators, terminators], [ctan]), ([custodians], [terminators, ctan])]
+    templates = [terminators, custodians, ctan]
+    before = [unit_snapshot(unit) for unit in templates]
+
+    def play(order):
+        return {i: simulate_battles(*matchups[i], 300, rng=np.random.default_rng(i)).winner for i in order}
+
+    forwards, backwards = play((0, 1)), play((1, 0))
+    assert all(np.array_equal(forwards[i], backwards[i]) for i in forwards)
+    assert [unit_snapshot(unit) for unit in templates] == before
+
+    battle = Battle(matchups[1], 300, 24, rng=np.random.default_rng(0))
+    own_units = [unit_snapshot(unit) for side in battle.units for unit in side]
+    for _ in range(3):
+        for side in (0, 1):
+            battle.turn(side)
+    assert [unit_snapshot(unit) for side in battle.units for unit in side] == own_units
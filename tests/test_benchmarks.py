@@ -0,0 +1,25 @@
+# Every combat benchmark runs, on tiny counts, so a pipeline signature change breaks the suite and not only the
+# next benchmark run
+import os
+import sys
+import json
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+import bench_combat
+
+
+@pytest.fixture
+def tiny(monkeypatch):
+    monkeypatch.setattr(bench_combat, 'UNIT_SIZES', (5,))
+    monkeypatch.setattr(bench_combat, 'BATCH_TRIALS', 50)
+
+
+def test_run_and_compare(tiny, tmp_path):
+    output = str(tmp_path / 'current.json')
+    assert bench_combat.main(['run', '--number', '1', '--output', output]) == 0
+    with open(output) as output_file:
+        results = json.load(output_file)['results']
+    assert 'horde_5_vs_elite_5/batch_shooting_round' in results
+    assert 'ctan_vs_allarus/shooting_round' in results
+    assert bench_combat.main(['compare', output, output]) == 0
@@ -0,0 +1,28 @@
+# Distances between the same two weapon range breakpoints are one equivalence class: the representative's result
+# stands for every distance in its class
+import itertools
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round
+from wh_sweep import distance_breakpoints, plan_distances
+
+DISTANCES = list(range(1, 41))
+
+
+def test_breakpoints_are_the_weapon_ranges_and_half_ranges():
+    unit = unit_collection['example_terminator_unit']
+    ranges = {weapon.weapon_range for model in unit.models for weapon in model.ranged_weapons.values()}
+    assert distance_breakpoints(unit) == sorted(ranges | {weapon_range / 2 for weapon_range in ranges})
+
+
+def test_every_distance_gets_its_representatives_result():
+    for attacker, defender in itertools.product(unit_collection, repeat=2):
+        unit = unit_collection[attacker]
+        plan = plan_distances(unit, DISTANCES)
+        assert sorted(i for _, indices in plan for i in indices) == list(range(len(DISTANCES)))
+        assert len(plan) <= len(distance_breakpoints(unit)) + 1
+        for representative, indices in plan:
+            expected = exact_shooting_round(unit, Engagement(representative, True, False, unit_collection[defender]))
+            for i in indices:
+                result = exact_shooting_round(unit, Engagement(DISTANCES[i], True, False, unit_collection[defender]))
+                assert abs(result.expected_damage - expected.expected_damage) < 1e-12, (attacker, defender, DISTANCES[i])
@@ -0,0 +1,36 @@
+# Catalog lookups: units and models are fresh copies of their templates, the parsed JSON cache follows its source
+import os
+import json
+import shutil
+from warhammer.datasheets.catalog import Catalog, CATALOG_DIRECTORY, CACHE_DIRECTORY_NAME
+
+
+def test_lookups_do_not_share_state():
+    catalog = Catalog()
+    first = catalog.units['allarus_custodians']
+    first.allocate_wounds(3, 3)
+    first.in_melee_with.append(catalog.units['example_terminator_unit'])
+    second = catalog.units['allarus_custodians']
+    assert first is not second
+    assert len(second.models) == len(second.starting_models) and second.in_melee_with == []
+    assert all(model.current_wounds == model.starting_wounds for model in second.models)
+    model = catalog.models[second.models[0].name]
+    assert model is not second.models[0] and model.current_wounds == model.starting_wounds
+    weapon_name = next(iter(model.ranged_weapons))
+    assert catalog.weapons[weapon_name] is catalog.weapons[weapon_name] is model.ranged_weapons[weapon_name]
+
+
+def test_cached_entries_follow_the_source_file(tmp_path):
+    for name in ('weapons.json', 'models.json', 'units.json'):
+        shutil.copy(os.path.join(CATALOG_DIRECTORY, name), tmp_path / name)
+    assert 'allarus_custodians' in Catalog(str(tmp_path)).units
+    assert os.path.exists(tmp_path / CACHE_DIRECTORY_NAME / 'units.json.pickle')
+
+    with open(tmp_path / 'units.json') as units_file:
+        units = json.load(units_file)
+    units['renamed_allarus_custodians'] = units.pop('allarus_custodians')
+    with open(tmp_path / 'units.json', 'w') as units_file:
+        json.dump(units, units_file, indent=4) # different size, so the cache is stale even within the mtime resolution
+    reloaded = Catalog(str(tmp_path)).units
+    assert 'allarus_custodians' not in reloaded
+    assert reloaded['renamed_allarus_custodians'].name == 'renamed_allarus_custodians'
@@ -0,0 +1,46 @@
+# Paired comparisons: every variant sees the same dice, so an unchanged variant differs by nothing and a real change
+# is measured far more precisely than by two independent runs
+import numpy as np
+import pytest
+from warhammer.datasheets.unit_collection import unit_collection
+from warhammer.datasheets.weapon_collection import weapon_collection
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round
+from wh_compare import compare_variants, unit_variant, weapon_variant
+
+
+def engagement() -> Engagement:
+    return Engagement(distance=12, line_of_sight=True, in_cover=False, opponent=unit_collection['example_terminator_unit'])
+
+
+def test_unchanged_variant_sees_identical_dice():
+    attacker = unit_collection['allarus_custodians']
+    comparison = compare_variants(
+        {'baseline': attacker, 'copy': attacker.spawn()}, engagement(), 5_000, seed=0, shard_size=2_000
+    )['copy']
+    assert comparison.num_trials == 5_000
+    for metric in ('damage', 'models_slain', 'killed'):
+        assert comparison.difference[metric].variance == 0 and comparison.difference[metric].mean == 0
+    assert comparison.variance_reduction() == float('inf')
+
+
+def test_paired_difference_is_accurate_and_narrow():
+    attacker = unit_collection['allarus_custodians']
+    spear = weapon_collection['guardian_spear']
+    better = unit_variant(attacker, 'guardian_spear', weapon_variant(spear, strength=6, armor_piercing=2))
+    comparison = compare_variants({'baseline': attacker, 'better': better}, engagement(), 20_000, seed=1)['better']
+    exact = exact_shooting_round(better, engagement()).expected_damage - exact_shooting_round(attacker, engagement()).expected_damage
+    low, high = comparison.confidence_interval(confidence=0.999)
+    assert low < exact < high
+    assert comparison.variance_reduction() > 2
+    # The datasheet itself is untouched by the swap
+    assert unit_collection['allarus_custodians'].models[0].ranged_weapons['guardian_spear'] is spear
+
+
+def test_variant_helpers_reject_unknown_names():
+    with pytest.raises(ValueError):
+        weapon_variant(weapon_collection['guardian_spear'], toughness=5)
+    with pytest.raises(ValueError):
+        unit_variant(unit_collection['allarus_custodians'], 'example_rifle', weapon_collection['example_rifle'])
+    with pytest.raises(ValueError):
+        compare_variants({'a': unit_collection['allarus_custodians']}, engagement(), 10, baseline='b')
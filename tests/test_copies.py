@@ -0,0 +1,40 @@
+# Copying units only copies their combat state: models get their own wounds, stats and weapons stay shared
+from copy import copy, deepcopy
+from warhammer.datasheets.unit_collection import unit_collection
+
+
+def test_spawn_shares_datasheet_state_only():
+    template = unit_collection['example_terminator_unit']
+    first, second = template.spawn(), template.spawn()
+    first.allocate_wounds(2, 3)
+    assert len(second.models) == len(template.models)
+    assert all(model.current_wounds == model.starting_wounds for model in second.models)
+    for model, other in zip(first.starting_models, second.starting_models):
+        assert model is not other
+        assert model.ranged_weapons is other.ranged_weapons and model.keywords is other.keywords
+    weapon = next(iter(template.models[0].ranged_weapons.values()))
+    assert copy(weapon) is weapon and deepcopy(weapon) is weapon
+
+
+def test_deepcopy_keeps_combat_state_apart():
+    unit = unit_collection['allarus_custodians']
+    unit.allocate_wounds(1, 2)
+    unit.in_melee_with.append(unit_collection['example_terminator_unit'])
+    clone = deepcopy(unit)
+    assert [model.current_wounds for model in clone.models] == [model.current_wounds for model in unit.models]
+    assert all(model in clone.starting_models for model in clone.models) # the live models are the roster's copies
+    assert clone.in_melee_with == unit.in_melee_with and clone.in_melee_with is not unit.in_melee_with
+
+    clone.allocate_wounds(20, 4)
+    clone.in_melee_with.clear()
+    assert not clone.alive and unit.alive
+    assert len(unit.models) == len(unit.starting_models) and len(unit.in_melee_with) == 1
+
+
+def test_reset_brings_the_roster_back():
+    unit = unit_collection['allarus_custodians']
+    unit.allocate_wounds(20, 4)
+    assert not unit.models
+    unit.reset()
+    assert unit.alive and unit.models == unit.starting_models
+    assert all(model.alive and model.current_wounds == model.starting_wounds for model in unit.models)
@@ -0,0 +1,54 @@
+# Dice expressions: parsing, and scalar rolls, batch samples and exact distributions that agree with each other
+import numpy as np
+import pytest
+from utility_functions import seeded_rng
+from Dice import DiceExpression
+
+NUM_SAMPLES = 100_000
+
+
+@pytest.mark.parametrize('text, expression', [
+    (3, DiceExpression(modifier=3)),
+    ('3', DiceExpression(modifier=3)),
+    ('D3', DiceExpression(num_dice=1, die_sides=3)),
+    ('2d6', DiceExpression(num_dice=2, die_sides=6)),
+    ('D6+3', DiceExpression(num_dice=1, die_sides=6, modifier=3)),
+    ('D6 - 1', DiceExpression(num_dice=1, die_sides=6, modifier=-1)),
+])
+def test_parse_and_format(text, expression):
+    assert DiceExpression.parse(text) == expression
+    assert DiceExpression.parse(str(expression)) == expression
+
+
+@pytest.mark.parametrize('text', ['D', 'D0', '2D6x', 'six', ''])
+def test_parse_rejects_nonsense(text):
+    with pytest.raises(ValueError):
+        DiceExpression.parse(text)
+
+
+@pytest.mark.parametrize('text, minimum, maximum, mean', [
+    ('D3', 1, 3, 2.0), ('2D6', 2, 12, 7.0), ('D6+3', 4, 9, 6.5), ('D3-2', 0, 1, 1 / 3), ('4', 4, 4, 4.0)
+])
+def test_pmf(text, minimum, maximum, mean):
+    expression = DiceExpression.parse(text)
+    pmf = expression.pmf()
+    assert abs(pmf.sum() - 1) < 1e-12
+    assert np.flatnonzero(pmf)[[0, -1]].tolist() == [minimum, maximum] == [expression.minimum, expression.maximum]
+    assert abs(expression.mean - mean) < 1e-12
+    assert np.allclose(expression.pmf(3), np.convolve(np.convolve(pmf, pmf), pmf))
+    assert not expression.pmf(3).flags.writeable # shared through the cache
+
+
+@pytest.mark.parametrize('text', ['D3', '2D6', 'D6+3', 'D3-2'])
+def test_rolls_and_samples_follow_the_pmf(text):
+    expression = DiceExpression.parse(text)
+    with seeded_rng(np.random.default_rng(0)):
+        rolled = expression.roll(NUM_SAMPLES)
+    sampled = expression.sample_each(np.random.default_rng(1), NUM_SAMPLES // 4, 4).ravel()
+    summed = expression.sample(np.random.default_rng(2), NUM_SAMPLES, np.arange(NUM_SAMPLES) % 3)
+    for samples, pmf in ((rolled, expression.pmf()), (sampled, expression.pmf())):
+        assert np.abs(np.bincount(samples, minlength=len(pmf)) / len(samples) - pmf).max() < 0.01
+    for count in range(3):
+        pmf = expression.pmf(count)
+        in_trial = summed[np.arange(NUM_SAMPLES) % 3 == count]
+        assert np.abs(np.bincount(in_trial, minlength=len(pmf))[:len(pmf)] / len(in_trial) - pmf).max() < 0.01
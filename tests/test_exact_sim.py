@@ -0,0 +1,58 @@
+# The exact engine and the batched Monte Carlo engine describe the same shooting round: the sampled damage and
+# models slain follow the exact distributions, for every datasheet pairing at short and long range, in and out of cover
+import itertools
+import numpy as np
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round
+from wh_batch_sim import batch_shooting_round
+from wh_fight_sim import batch_fight_round
+
+NUM_TRIALS = 100_000
+
+
+def sampled_pmf(samples: np.ndarray, length: int) -> np.ndarray:
+    return np.bincount(samples, minlength=length)[:length] / len(samples)
+
+
+def test_batch_samples_follow_the_exact_distributions():
+    rng = np.random.default_rng(0)
+    for attacker, defender in itertools.product(unit_collection, repeat=2):
+        for distance, in_cover in ((6, False), (12, True), (24, False)):
+            engagement = Engagement(
+                distance=distance, line_of_sight=True, in_cover=in_cover, opponent=unit_collection[defender].spawn()
+            )
+            exact = exact_shooting_round(unit_collection[attacker].spawn(), engagement)
+            batch = batch_shooting_round(unit_collection[attacker].spawn(), engagement, NUM_TRIALS, rng)
+            case = f'{attacker} vs {defender} at {distance}" in_cover={in_cover}'
+            assert abs(exact.damage.sum() - 1) < 1e-9 and abs(exact.models_slain.sum() - 1) < 1e-9, case
+            assert batch.damage.max() < len(exact.damage), case
+            # Five standard errors of the sample mean, and about as many on every probability of the pmfs
+            tolerance = 5 * max(batch.damage.std(), 0.1) / np.sqrt(NUM_TRIALS)
+            assert abs(batch.damage.mean() - exact.expected_damage) < tolerance, case
+            assert np.abs(sampled_pmf(batch.damage, len(exact.damage)) - exact.damage).max() < 0.01, case
+            assert np.abs(sampled_pmf(batch.models_slain, len(exact.models_slain)) - exact.models_slain).max() < 0.01, case
+            wounds_tolerance = 5 * max(batch.wounds.std(), 0.1) / np.sqrt(NUM_TRIALS)
+            assert abs(batch.wounds.mean() - exact.mean(exact.wounds)) < wounds_tolerance, case
+
+
+def test_wiped_out_defender_takes_nothing():
+    attacker = unit_collection['example_terminator_unit'].spawn()
+    defender = unit_collection['allarus_custodians'].spawn()
+    for model in list(defender.models):
+        defender.apply_damage(model, model.current_wounds)
+    engagement = Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=defender)
+    exact = exact_shooting_round(attacker, engagement)
+    assert exact.expected_damage == exact.expected_models_slain == 0
+    rng = np.random.default_rng(0)
+    for batch in (batch_shooting_round(attacker, engagement, 10, rng), batch_fight_round(attacker, engagement, 10, rng)):
+        assert batch.num_trials == 10 and not batch.damage.any() and not batch.hazardous_damage.any()
+
+
+def test_no_trials():
+    attacker = unit_collection['example_terminator_unit'].spawn()
+    engagement = Engagement(
+        distance=1, line_of_sight=True, in_cover=False, opponent=unit_collection['allarus_custodians'].spawn()
+    )
+    assert batch_shooting_round(attacker, engagement, 0, np.random.default_rng(0)).num_trials == 0
+    assert batch_fight_round(attacker, engagement, 0, np.random.default_rng(0)).num_trials == 0
@@ -0,0 +1,67 @@
+# Batched fights: melee weapons only, no cover, only models in range fight, and the defender fights back with
+# whatever survived the charge
+import numpy as np
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+from wh_fight_sim import batch_fight_round, batch_fight_phase, models_able_to_fight, select_melee_weapon
+
+NUM_TRIALS = 40_000
+
+
+def melee_weapon(name: str, attacks: int, strength: int, armor_piercing: int, damage: int) -> Weapon:
+    return Weapon(
+        name=name, weapon_range=1, attacks=attacks, ballistic_skill=3, strength=strength,
+        armor_piercing=armor_piercing, damage=damage, keywords=set()
+    )
+
+
+def unit(name: str, size: int, wounds: int, melee_weapons: list, ranged_weapons: list=()) -> Unit:
+    model = Model(
+        name=name, movement=6, toughness=4, save=3, invulnerable_save=None, wounds=wounds, leadership=6,
+        objective_control=1, ranged_weapons={weapon.name: weapon for weapon in ranged_weapons},
+        melee_weapons={weapon.name: weapon for weapon in melee_weapons}, abilities=set(), faction=[],
+        keywords={'infantry'}, faction_keywords=[]
+    )
+    return Unit(name=name, models=model * size, point_cost=100, in_melee_with=[])
+
+
+def test_fight_damage_matches_the_odds():
+    # 2 attacks each, hit on 3+, wound T4 on 4+, the 3+ save becomes 4+ at AP1: 1 damage in 6 attacks
+    rifle = Weapon(name='rifle', weapon_range=24, attacks=10, ballistic_skill=2, strength=10, armor_piercing=4,
+                   damage=3, keywords=set())
+    attacker = unit('fighters', 5, 1, [melee_weapon('blade', 2, 4, 1, 1)], [rifle])
+    defender = unit('targets', 20, 1, [])
+    engagement = Engagement(distance=1, line_of_sight=False, in_cover=True, opponent=defender)
+    result = batch_fight_round(attacker, engagement, NUM_TRIALS, np.random.default_rng(0))
+    assert abs(result.damage.mean() - 10 / 6) < 5 * result.damage.std() / np.sqrt(NUM_TRIALS)
+
+    in_range = batch_fight_round(attacker, engagement, NUM_TRIALS, np.random.default_rng(0), models_in_range=2)
+    assert abs(in_range.damage.mean() - 4 / 6) < 5 * in_range.damage.std() / np.sqrt(NUM_TRIALS)
+
+
+def test_models_able_to_fight():
+    alive = np.array([[True, True, True, True], [False, True, False, True]])
+    assert models_able_to_fight(alive, None) is alive
+    assert models_able_to_fight(alive, 1).tolist() == [[True, False, False, False], [False, True, False, False]]
+    assert models_able_to_fight(alive, np.array([3, 0])).sum(axis=1).tolist() == [3, 0]
+
+
+def test_weapon_choice_depends_on_the_target():
+    sweep, strike = melee_weapon('sweep', 8, 4, 1, 1), melee_weapon('strike', 2, 8, 2, 3)
+    attacker = unit('fighters', 1, 3, [sweep, strike])
+    hordes, elites = unit('hordes', 20, 1, []), unit('elites', 3, 3, [])
+    model = attacker.models[0]
+    assert select_melee_weapon(model, attacker, Engagement(1, True, False, hordes)).name == 'sweep'
+    assert select_melee_weapon(model, attacker, Engagement(1, True, False, elites)).name == 'strike'
+
+
+def test_only_survivors_fight_back():
+    charger = unit('chargers', 10, 3, [melee_weapon('axe', 10, 10, 4, 3)])
+    defender = unit('defenders', 2, 1, [melee_weapon('knife', 3, 4, 0, 1)])
+    charge, fight_back = batch_fight_phase(charger, Engagement(1, True, False, defender), 1_000, np.random.default_rng(0))
+    wiped_out = charge.models_slain == 2
+    assert wiped_out.mean() > 0.99
+    assert not fight_back.damage[wiped_out].any()
+    assert charger.last_action == 'charged'
@@ -0,0 +1,60 @@
+# Identical models shoot as one group with one roll of the dice, which gives the same wounds as model by model
+import numpy as np
+from phase_profiler import profiling
+from utility_functions import seeded_rng
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+
+NUM_ROUNDS = 4_000
+
+
+def model(name: str, gun: Weapon) -> Model:
+    return Model(
+        name=name, movement=6, toughness=4, save=3, invulnerable_save=None, wounds=2, leadership=6,
+        objective_control=1, ranged_weapons={gun.name: gun}, melee_weapons={}, abilities=set(), faction=[],
+        keywords={'infantry'}, faction_keywords=[]
+    )
+
+
+def gun(name: str, keywords: set) -> Weapon:
+    return Weapon(
+        name=name, weapon_range=24, attacks='D3', ballistic_skill=3, strength=5, armor_piercing=1, damage=1,
+        keywords=keywords
+    )
+
+
+def squad() -> Unit:
+    bolter, plasma = gun('bolter', {'sustained_hits_1', 'rapid_fire_1'}), gun('plasma', {'lethal_hits'})
+    return Unit(
+        name='squad', models=model('trooper', bolter) * 5 + [model('gunner', plasma)], point_cost=100, in_melee_with=[]
+    )
+
+
+def engagement() -> Engagement:
+    target = Unit(name='target', models=model('target', gun('pistol', set())) * 10, point_cost=100, in_melee_with=[])
+    return Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=target)
+
+
+def test_one_roll_per_group():
+    attacker = squad()
+    with profiling() as profiler, seeded_rng(np.random.default_rng(0)):
+        wounds = attacker.shoot(engagement())
+    assert profiler.phases['hit'].calls == 2 # the five troopers and the gunner
+    assert set(wounds) <= {'bolter', 'plasma'}
+
+
+def test_fused_wounds_follow_the_model_by_model_distribution():
+    attacker, target = squad(), engagement()
+    fused, separate = np.zeros((NUM_ROUNDS, 2)), np.zeros((NUM_ROUNDS, 2))
+    with seeded_rng(np.random.default_rng(0)):
+        for i in range(NUM_ROUNDS):
+            for counts in attacker.shoot(target).values():
+                fused[i] += counts
+            for model in attacker.models:
+                weapon = next(iter(model.ranged_weapons.values()))
+                separate[i] += weapon.wound_roll(target, model, attacker)
+    for column in range(2): # wounds and critical wounds
+        tolerance = 5 * np.hypot(fused[:, column].std(), separate[:, column].std()) / np.sqrt(NUM_ROUNDS)
+        assert abs(fused[:, column].mean() - separate[:, column].mean()) < tolerance
@@ -0,0 +1,43 @@
+# The scalar attack sequence runs every roll through these modules: debug messages there only get formatted when
+# debug logging is on, i.e. every f-string logger.debug call sits under an isEnabledFor(DEBUG) check or a flag set
+# from one
+import ast
+import os
+import pytest
+
+HOT_MODULES = ('Model.py', 'Unit.py', 'Weapon.py', 'Dice.py', 'UnitState.py', 'utility_functions.py', 'wh_standard_sim.py')
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def guarded(test: ast.expr) -> bool:
+    source = ast.unparse(test)
+    return 'isEnabledFor' in source or source in ('debug', 'self.debug')
+
+
+def unguarded_debug_calls(tree: ast.AST) -> list:
+    found = []
+
+    def visit(node: ast.AST, under_guard: bool):
+        if isinstance(node, ast.If) and guarded(node.test):
+            for child in node.body:
+                visit(child, True)
+            for child in node.orelse:
+                visit(child, under_guard)
+            return
+        if (
+                isinstance(node, ast.Call) and ast.unparse(node.func) == 'logger.debug' and not under_guard
+                and any(isinstance(part, ast.FormattedValue) for arg in node.args for part in ast.walk(arg))
+        ):
+            found.append(node.lineno)
+        for child in ast.iter_child_nodes(node):
+            visit(child, under_guard)
+
+    visit(tree, False)
+    return found
+
+
+@pytest.mark.parametrize('module', HOT_MODULES)
+def test_debug_messages_are_only_formatted_when_enabled(module):
+    with open(os.path.join(ROOT, module)) as source_file:
+        tree = ast.parse(source_file.read())
+    assert unguarded_debug_calls(tree) == []
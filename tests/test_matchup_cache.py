@@ -0,0 +1,36 @@
+# Matchup cache keys: equal datasheets share entries, anything that changes a result gets its own
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_matchup_cache import MatchupCache, cached_exact_shooting_round, matchup_key, melee_state
+
+
+def engagement(opponent) -> Engagement:
+    return Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=opponent)
+
+
+def test_locked_with_the_target_and_with_another_unit_are_different_matchups():
+    cache = MatchupCache(path=None)
+    attacker = unit_collection['example_terminator_unit'].spawn()
+    target, bystander = unit_collection['allarus_custodians'].spawn(), unit_collection['allarus_custodians'].spawn()
+    target.in_melee_with = [attacker]
+
+    attacker.in_melee_with = [target] # pistols may shoot the unit they're fighting
+    with_target = cached_exact_shooting_round(attacker, engagement(target), cache)
+    key_with_target = matchup_key(attacker, engagement(target), melee_state(attacker, engagement(target)))
+    attacker.in_melee_with = [bystander] # nothing may shoot anyone else
+    with_bystander = cached_exact_shooting_round(attacker, engagement(target), cache)
+    key_with_bystander = matchup_key(attacker, engagement(target), melee_state(attacker, engagement(target)))
+
+    assert key_with_target != key_with_bystander
+    assert with_target.expected_damage > 0
+    assert with_bystander.expected_damage == 0
+
+
+def test_equal_datasheets_share_a_key_and_edits_change_it():
+    first = unit_collection['example_terminator_unit'].spawn()
+    second = unit_collection['example_terminator_unit'].spawn()
+    opponent = unit_collection['allarus_custodians'].spawn()
+    assert matchup_key(first, engagement(opponent)) == matchup_key(second, engagement(opponent))
+    second.models[0].current_wounds -= 1
+    assert matchup_key(first, engagement(opponent)) != matchup_key(second, engagement(opponent))
+    assert matchup_key(first, engagement(opponent)) != matchup_key(first, Engagement(7, True, False, opponent))
@@ -0,0 +1,59 @@
+# The phase profiler counts the dice each phase rolls, only while it's active, in the scalar and batch engines alike
+import numpy as np
+import phase_profiler
+from phase_profiler import profiling
+from utility_functions import seeded_rng
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+from wh_batch_sim import batch_shooting_round
+from wh_standard_sim import shooting_round
+
+NUM_TRIALS = 1_000
+
+
+def unit(name: str, keywords: set, size: int=5) -> Unit:
+    gun = Weapon(
+        name=f'{name}_gun', weapon_range=24, attacks=2, ballistic_skill=3, strength=4, armor_piercing=1, damage=1,
+        keywords=keywords
+    )
+    model = Model(
+        name=name, movement=6, toughness=4, save=3, invulnerable_save=None, wounds=2, leadership=6,
+        objective_control=1, ranged_weapons={gun.name: gun}, melee_weapons={}, abilities=set(), faction=[],
+        keywords={'infantry'}, faction_keywords=[]
+    )
+    return Unit(name=name, models=model * size, point_cost=100, in_melee_with=[])
+
+
+def test_batch_dice_counts():
+    attacker, defender = unit('shooters', {'heavy'}), unit('targets', set(), size=20)
+    attacker.last_action = 'remained_stationary'
+    engagement = Engagement(distance=12, line_of_sight=True, in_cover=False, opponent=defender)
+    with profiling() as profiler:
+        result = batch_shooting_round(attacker, engagement, NUM_TRIALS, np.random.default_rng(0))
+    phases = profiler.report()['phases']
+    assert phases['hit']['dice'] == NUM_TRIALS * 5 * 2
+    assert phases['save']['dice'] == result.wounds.sum()
+    assert profiler.keywords['heavy'] == NUM_TRIALS * 5 # once per model and trial
+    assert profiler.keywords['torrent'] == 0
+
+
+def test_scalar_counts_and_restoring_the_previous_profiler():
+    attacker, defender = unit('shooters', {'heavy'}), unit('targets', set(), size=20)
+    attacker.last_action = 'remained_stationary'
+    engagement = Engagement(distance=12, line_of_sight=True, in_cover=False, opponent=defender)
+    outer = phase_profiler.enable()
+    try:
+        with profiling() as inner, seeded_rng(np.random.default_rng(0)):
+            shooting_round(attacker, engagement)
+        assert phase_profiler.active is outer
+    finally:
+        phase_profiler.disable()
+    assert phase_profiler.active is None
+    assert outer.phases['hit'].calls == 0
+    assert inner.phases['hit'].dice == 5 * 2 and inner.keywords['heavy'] == 1 # five identical models roll together
+
+    merged = inner.merge(inner)
+    assert merged.phases['hit'].dice == 2 * inner.phases['hit'].dice
+    assert merged.keywords['heavy'] == 2 and set(merged.keywords) >= set(phase_profiler.KEYWORD_BRANCHES)
@@ -0,0 +1,50 @@
+# Keyword profiles are parsed once per weapon and model, and agree with the keyword string helpers they replace
+import pytest
+from utility_functions import rapid_fire, sustained_hits, melta, anti_keyword
+from warhammer.datasheets.weapon_collection import weapon_collection
+from Weapon import Weapon, WeaponProfile
+from Model import ModelProfile
+
+KEYWORD_SETS = [
+    set(),
+    {'rapid_fire_2', 'sustained_hits_1', 'anti_infantry_4', 'twin-linked', 'devastating_wounds'},
+    {'melta_2', 'heavy', 'blast', 'hazardous'},
+    {'torrent', 'ignores_cover', 'pistol', 'assault', 'lance', 'lethal_hits', 'indirect_fire', 'precision'},
+]
+OPPONENT_KEYWORDS = [set(), {'infantry'}, {'vehicle', 'monster'}]
+
+
+@pytest.mark.parametrize('keywords', KEYWORD_SETS + [set(weapon.keywords) for weapon in weapon_collection.values()])
+def test_profile_agrees_with_the_keyword_helpers(keywords):
+    profile = WeaponProfile.from_keywords(keywords)
+    assert profile.rapid_fire == rapid_fire(24, keywords, 12)
+    assert profile.melta == melta(24, keywords, 12)
+    assert 3 * profile.sustained_hits == sustained_hits(3, keywords)
+    for opponent_keywords in OPPONENT_KEYWORDS:
+        assert profile.crit_wound_boundary(opponent_keywords) == anti_keyword(keywords, opponent_keywords)
+    for flag in ('torrent', 'blast', 'heavy', 'lance', 'lethal_hits', 'devastating_wounds', 'ignores_cover',
+                 'hazardous', 'assault', 'pistol', 'indirect_fire', 'precision'):
+        assert getattr(profile, flag) == (flag in keywords), flag
+    assert profile.twin_linked == ('twin-linked' in keywords)
+
+
+def test_anti_keywords_may_name_several_words():
+    profile = WeaponProfile.from_keywords({'anti_fly_monster_2'})
+    assert profile.crit_wound_boundary({'fly_monster'}) == 2
+    assert profile.crit_wound_boundary({'fly'}) == 6
+
+
+def test_equal_keywords_give_equal_profiles():
+    first = Weapon(name='a', weapon_range=24, attacks=1, ballistic_skill=3, strength=4, armor_piercing=0, damage=1,
+                   keywords={'rapid_fire_1', 'pistol'})
+    second = Weapon(name='b', weapon_range=12, attacks=2, ballistic_skill=4, strength=5, armor_piercing=1, damage=2,
+                    keywords=['pistol', 'rapid_fire_1'])
+    assert first.profile == second.profile and hash(first.profile) == hash(second.profile)
+    with pytest.raises(AttributeError):
+        first.profile.pistol = False
+
+
+def test_model_profile():
+    assert ModelProfile.from_keywords({'feel_no_pain_5', 'deep_strike'}, {'infantry'}) == ModelProfile(feel_no_pain=5)
+    assert ModelProfile.from_keywords(set(), {'vehicle'}).monster_or_vehicle
+    assert ModelProfile.from_keywords(set(), {'infantry'}).feel_no_pain == 0
@@ -0,0 +1,46 @@
+# Importance sampling: tilted dice with likelihood weights estimate probabilities far below what plain sampling of the
+# same size can see, and agree with the exact engine
+import numpy as np
+import pytest
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round
+from wh_rare_event import estimate_probability, rare_event_probability, destroyed, wounds_left, attacker_favoured
+
+NUM_TRIALS = 20_000
+
+
+def matchup():
+    attacker = unit_collection['example_terminator_unit']
+    engagement = Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=unit_collection['example_terminator_unit'])
+    return attacker, engagement
+
+
+@pytest.mark.parametrize('event, wounds_from_the_end', [(destroyed, 0), (wounds_left(1), 1)])
+def test_tilted_estimates_match_the_exact_probability(event, wounds_from_the_end):
+    attacker, engagement = matchup()
+    exact = exact_shooting_round(attacker, engagement).damage
+    probability = exact[len(exact) - 1 - wounds_from_the_end] # 1e-6 to 1e-4
+    estimate = rare_event_probability(attacker, engagement, NUM_TRIALS, event, seed=0)
+    low, high = estimate.confidence_interval(0.999)
+    assert low < probability < high
+    assert estimate.relative_error < 0.2
+    assert estimate.plain_trials_needed() > 100 * NUM_TRIALS
+
+
+def test_without_tilts_every_weight_is_one():
+    attacker, engagement = matchup()
+    event = lambda result: result.damage >= 6
+    estimate = estimate_probability(attacker, engagement, NUM_TRIALS, event, seed=0)
+    assert estimate.effective_sample_size == NUM_TRIALS
+    assert estimate.probability == estimate.hits / NUM_TRIALS
+
+
+def test_weights_are_one_on_average():
+    attacker, engagement = matchup()
+    always = lambda result: np.ones(result.num_trials, dtype=bool)
+    estimate = estimate_probability(attacker, engagement, NUM_TRIALS, always, attacker_favoured(0.5), seed=0)
+    low, high = estimate.weighted.confidence_interval(0.999)
+    assert low < 1 < high
+    with pytest.raises(ValueError):
+        estimate_probability(attacker, engagement, 10, tilts={'morale': 1.0})
@@ -0,0 +1,51 @@
+# A stored run that is interrupted and resumed ends up with the same rows as one that never was
+import numpy as np
+import pytest
+import wh_parallel_sim
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_parallel_sim import stored_shooting_rounds
+from result_store import ResultStore
+
+
+def run(path: str, **kwargs):
+    engagement = Engagement(
+        distance=7, line_of_sight=True, in_cover=False, opponent=unit_collection['example_terminator_unit'].spawn()
+    )
+    return stored_shooting_rounds(
+        unit_collection['allarus_custodians'], engagement, 5_000, path, max_workers=1, shard_size=1_000, **kwargs
+    )
+
+
+def test_interrupted_run_resumes_to_the_same_rows(tmp_path, monkeypatch):
+    complete = run(str(tmp_path / 'complete'), seed=3)
+
+    # Crash in the third shard, after half of its first column made it to disk but before the manifest did
+    run_shard_outcomes = wh_parallel_sim.run_shard_outcomes
+    calls = []
+
+    def crashing_shard(*args):
+        calls.append(args)
+        if len(calls) == 3:
+            with open(tmp_path / 'interrupted' / 'damage.bin', 'ab') as column_file:
+                column_file.write(b'torn write')
+            raise KeyboardInterrupt
+        return run_shard_outcomes(*args)
+
+    monkeypatch.setattr(wh_parallel_sim, 'run_shard_outcomes', crashing_shard)
+    with pytest.raises(KeyboardInterrupt):
+        run(str(tmp_path / 'interrupted'), seed=3)
+    monkeypatch.undo()
+    assert len(ResultStore.open(str(tmp_path / 'interrupted')).chunks) == 2
+
+    resumed = run(str(tmp_path / 'interrupted')) # the seed is read back from the store
+    assert resumed.rows == complete.rows == 5_000
+    assert len(resumed.chunks) == 5
+    for name in complete.columns:
+        assert np.array_equal(resumed.column(name), complete.column(name)), name
+
+
+def test_resume_refuses_a_different_run(tmp_path):
+    run(str(tmp_path / 'store'), seed=3)
+    with pytest.raises(ValueError):
+        run(str(tmp_path / 'store'), seed=4)
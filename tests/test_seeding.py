@@ -0,0 +1,37 @@
+# Runs that seed their own dice give the caller's module level generator back when they're done, also when their
+# shards run in the caller's process
+import numpy as np
+import utility_functions
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_parallel_sim import parallel_shooting_rounds, stored_shooting_rounds
+from wh_compare import compare_variants
+from wh_rare_event import estimate_probability, destroyed
+
+
+def engagement() -> Engagement:
+    return Engagement(
+        distance=7, line_of_sight=True, in_cover=False, opponent=unit_collection['example_terminator_unit'].spawn()
+    )
+
+
+def test_in_process_runs_restore_the_generator(tmp_path):
+    attacker = unit_collection['allarus_custodians']
+    caller = np.random.default_rng(0)
+    utility_functions.set_rng(caller)
+    parallel_shooting_rounds(attacker, engagement(), 2_000, seed=1, max_workers=1, shard_size=1_000)
+    stored_shooting_rounds(attacker, engagement(), 2_000, str(tmp_path / 'store'), seed=1, max_workers=1, shard_size=1_000)
+    compare_variants({'a': attacker.spawn(), 'b': attacker.spawn()}, engagement(), 2_000, seed=1, shard_size=1_000)
+    estimate_probability(attacker, engagement(), 2_000, destroyed, seed=1, shard_size=1_000)
+    assert utility_functions.rng is caller
+
+
+def test_seeded_rng_restores_on_error():
+    caller = np.random.default_rng(0)
+    utility_functions.set_rng(caller)
+    try:
+        with utility_functions.seeded_rng(np.random.default_rng(1)):
+            raise RuntimeError
+    except RuntimeError:
+        pass
+    assert utility_functions.rng is caller
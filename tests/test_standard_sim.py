@@ -0,0 +1,45 @@
+# The scalar shooting round stops resolving once the defender is wiped out, instead of asking a unit with no models
+# left for its toughness or its next model's save
+import numpy as np
+from utility_functions import seeded_rng
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+from wh_standard_sim import shooting_round
+
+
+def unit(name: str, weapons: list, wounds: int=1) -> Unit:
+    models = [
+        Model(
+            name=f'{name}_{weapon.name}', movement=6, toughness=3, save=6, invulnerable_save=None, wounds=wounds,
+            leadership=7, objective_control=1, ranged_weapons={weapon.name: weapon}, melee_weapons={}, abilities=set(),
+            faction=[], keywords={'infantry'}, faction_keywords=[]
+        )
+        for weapon in weapons
+    ]
+    return Unit(name=name, models=models, point_cost=10 * len(models), in_melee_with=[])
+
+
+def gun(name: str) -> Weapon:
+    return Weapon(
+        name=name, weapon_range=24, attacks=20, ballistic_skill=2, strength=10, armor_piercing=3, damage=1,
+        keywords=set()
+    )
+
+
+def test_weapons_after_the_defender_is_wiped_out_are_not_resolved():
+    defender = unit('target', [gun('pistol')])
+    attacker = unit('firing_line', [gun('first_gun'), gun('second_gun')])
+    engagement = Engagement(distance=12, line_of_sight=True, in_cover=False, opponent=defender)
+    with seeded_rng(np.random.default_rng(0)):
+        shooting_round(attacker, engagement)
+        assert not defender.alive and not defender.models
+        shooting_round(attacker, engagement) # nothing left to shoot at
+    assert not attacker.shoot(engagement)
+
+
+def test_a_unit_killed_outside_wound_allocation_is_dead():
+    defender = unit('target', [gun('pistol')], wounds=2)
+    defender.apply_damage(defender.models[0], 2)
+    assert not defender.alive
@@ -0,0 +1,41 @@
+# Every cell of a sweep is the exact shooting round of its own engagement, however many cells share sub-problems
+import json
+import itertools
+import numpy as np
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement, LastAction
+from wh_exact_sim import exact_shooting_round
+from wh_sweep import sweep, parse_distances, main
+
+NAMES = ['example_terminator_unit', 'allarus_custodians', 'ctan_shard_of_the_nightbringer']
+LAST_ACTIONS = (None, LastAction.remained_stationary)
+
+
+def test_cells_match_the_exact_engine():
+    units = {name: unit_collection[name] for name in NAMES}
+    distances = [1, 6, 12, 13, 24, 30]
+    result = sweep(units, units, distances, (True, False), (False, True), LAST_ACTIONS)
+    assert result.expected_damage.shape == (3, 3, 6, 2, 2, 2)
+    for (a, attacker), (d, defender) in itertools.product(enumerate(NAMES), repeat=2):
+        for (i, distance), (j, line_of_sight), (k, in_cover), (l, action) in itertools.product(
+                enumerate(distances), enumerate((True, False)), enumerate((False, True)), enumerate(LAST_ACTIONS)
+        ):
+            unit = unit_collection[attacker]
+            unit.last_action = action
+            engagement = Engagement(distance, line_of_sight, in_cover, unit_collection[defender])
+            exact = exact_shooting_round(unit, engagement)
+            cell = a, d, i, j, k, l
+            assert np.isclose(result.expected_damage[cell], exact.expected_damage), cell
+            assert np.isclose(result.kill_probability[cell], exact.kill_probability), cell
+            assert np.isclose(result.damage_per_point[cell], exact.expected_damage / unit.point_cost), cell
+
+
+def test_cli_writes_one_record_per_cell(tmp_path):
+    output = str(tmp_path / 'sweep.json')
+    main(['--attackers', *NAMES[:2], '--defenders', NAMES[2], '--distances', '3', '10-12', '--in-cover', 'no', 'yes',
+          '--output', output])
+    with open(output) as output_file:
+        records = json.load(output_file)
+    assert len(records) == 2 * 1 * 4 * 1 * 2 * 1
+    assert {record['distance'] for record in records} == {3, 10, 11, 12}
+    assert parse_distances(['1-3', '8']) == [1, 2, 3, 8]
@@ -0,0 +1,42 @@
+# The trace recorder keeps full detail of 1 in every sample_every trials, counting trials across scalar rounds and
+# batches alike, within a fixed size buffer
+import json
+import numpy as np
+import pytest
+import trace_recorder
+from trace_recorder import TraceRecorder, tracing
+from utility_functions import seeded_rng
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement
+from wh_batch_sim import batch_shooting_round
+from wh_standard_sim import shooting_round
+
+
+def engagement() -> Engagement:
+    return Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=unit_collection['allarus_custodians'])
+
+
+def test_batch_rows_are_sampled_across_batches():
+    attacker = unit_collection['example_terminator_unit']
+    with tracing(TraceRecorder(sample_every=300)) as recorder:
+        for num_trials in (500, 500):
+            batch = batch_shooting_round(attacker, engagement(), num_trials, np.random.default_rng(0))
+    assert trace_recorder.active is None
+    traced = recorder.trials()
+    assert sorted(traced) == [0, 300, 600, 900]
+    last = [event for event in traced[900] if event.phase == 'allocation'][-1]
+    assert last.detail['remaining_wounds'] == batch.remaining_wounds[400].tolist() # trial 900 is row 400 of batch 2
+    json.dumps([event.detail for events in traced.values() for event in events]) # plain values only
+
+
+def test_scalar_rounds_and_the_ring_buffer():
+    attacker = unit_collection['example_terminator_unit']
+    with tracing(TraceRecorder(sample_every=2, capacity=5)) as recorder, seeded_rng(np.random.default_rng(0)):
+        for _ in range(10):
+            shooting_round(attacker, engagement())
+    assert recorder.trials_seen == 10
+    assert len(recorder.events) == 5
+    assert {event.trial for event in recorder.events} <= {0, 2, 4, 6, 8}
+    assert recorder.events[-1].trial == 8
+    with pytest.raises(ValueError):
+        TraceRecorder(sample_every=0)
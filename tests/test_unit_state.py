@@ -0,0 +1,48 @@
+# UnitState keeps every trial's wounds in one array and allocates like the scalar Unit does
+import numpy as np
+import pytest
+from warhammer.datasheets.unit_collection import unit_collection
+from Dice import DiceExpression
+from UnitState import UnitState
+
+NAMES = ['example_terminator_unit', 'allarus_custodians'] # no feel no pain, so fixed damage is deterministic
+
+
+@pytest.mark.parametrize('name', NAMES)
+@pytest.mark.parametrize('damage', [1, 2, 3])
+def test_fixed_damage_lands_where_the_scalar_unit_puts_it(name, damage):
+    # Trial k takes k wounds, the same as a fresh unit taking them one call at a time
+    unit = unit_collection[name]
+    max_wounds = sum(model.starting_wounds for model in unit.models) + 1
+    state = UnitState.from_unit(unit, max_wounds + 1)
+    state.allocate_wounds(np.arange(max_wounds + 1), damage, np.random.default_rng(0))
+    for num_wounds in range(max_wounds + 1):
+        scalar = unit.spawn()
+        scalar.allocate_wounds(num_wounds, damage)
+        expected = [model.current_wounds if model in scalar.models else 0 for model in scalar.starting_models]
+        assert state.current_wounds[num_wounds].tolist() == expected, num_wounds
+
+
+def test_fixed_damage_shortcut_matches_wound_by_wound():
+    unit = unit_collection['example_terminator_unit']
+    num_wounds = np.random.default_rng(1).integers(0, 20, size=200)
+    shortcut, one_by_one = UnitState.from_unit(unit, 200), UnitState.from_unit(unit, 200)
+    shortcut.allocate_wounds(num_wounds, 2, np.random.default_rng(0))
+    one_by_one.allocate_wounds_one_by_one(num_wounds, DiceExpression.parse(2), np.random.default_rng(0))
+    assert np.array_equal(shortcut.current_wounds, one_by_one.current_wounds)
+
+
+def test_aggregates_subset_and_merge():
+    unit = unit_collection['example_terminator_unit']
+    state = UnitState.from_unit(unit, 4)
+    state.current_wounds[1, :2] = 0
+    state.current_wounds[3] = 0
+    assert state.models_remaining.tolist() == [len(unit.models), len(unit.models) - 2, len(unit.models), 0]
+    assert state.unit_alive.tolist() == [True, True, True, False]
+    assert state.total_objective_control[1] == sum(model.objective_control for model in unit.models[2:])
+
+    part = state.subset(np.array([0, 2]))
+    part.current_wounds[:, 0] = 1
+    assert state.current_wounds[0, 0] == unit.models[0].starting_wounds # a subset is a copy
+    state.merge(np.array([0, 2]), part)
+    assert state.current_wounds[:, 0].tolist() == [1, 0, 1, 0]
@@ -0,0 +1,47 @@
+# Expected damage lookup table and weapon choice
+from warhammer.datasheets.unit_collection import unit_collection
+from Weapon import Weapon
+from Engagement import Engagement
+from weapon_selection import ExpectedDamageTable, expected_damage
+
+
+def weapon(name: str, weapon_range: int) -> Weapon:
+    return Weapon(
+        name=name, weapon_range=weapon_range, attacks=2, ballistic_skill=3, strength=5, armor_piercing=1, damage=1,
+        keywords=set()
+    )
+
+
+def test_melee_and_ranged_profiles_with_the_same_stats_keep_separate_entries():
+    table = ExpectedDamageTable()
+    attacker = unit_collection['example_terminator_unit'].spawn()
+    defender = unit_collection['allarus_custodians'].spawn()
+    engagement = Engagement(distance=1, line_of_sight=True, in_cover=True, opponent=defender)
+    gun, sword = weapon('gun', 24), weapon('sword', 1)
+    # Cover only works against the gun, whichever of the two is looked up first
+    sword_damage = table.lookup(sword, attacker, engagement, defender.target())
+    gun_damage = table.lookup(gun, attacker, engagement, defender.target())
+    assert gun_damage < sword_damage
+    assert gun_damage == expected_damage(gun, attacker, engagement, defender.target())
+    assert sword_damage == expected_damage(sword, attacker, engagement, defender.target())
+
+
+def test_table_keeps_only_the_most_recently_used_entries():
+    table = ExpectedDamageTable(max_entries=3)
+    attacker = unit_collection['example_terminator_unit'].spawn()
+    defender = unit_collection['allarus_custodians'].spawn()
+    gun = weapon('gun', 24)
+    engagement = Engagement(distance=6, line_of_sight=True, in_cover=False, opponent=defender)
+    model = defender.target()
+    for wounds in range(model.starting_wounds, 0, -1): # every damage state is a new defender key
+        model.current_wounds = wounds
+        table.lookup(gun, attacker, engagement, model)
+    assert len(table) == 3
+
+
+def test_best_weapon_picks_by_range():
+    attacker = unit_collection['example_terminator_unit'].spawn()
+    defender = unit_collection['example_terminator_unit'].spawn()
+    model = attacker.models[0]
+    far = Engagement(distance=20, line_of_sight=True, in_cover=False, opponent=defender)
+    assert attacker.select_weapon(model, far).name == 'example_rifle'
@@ -0,0 +1,91 @@
+# Sampled structured tracing - full detail (rolls, requirements, results) of every phase for 1 in every sample_every
+# trials, kept in a fixed size ring buffer so tracing can stay on during large runs. Like phase_profiler, the hot
+# paths only check `trace_recorder.active`, and unsampled trials cost one more attribute check per phase
+import numpy as np
+from numpy.typing import NDArray
+from collections import deque
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Any, Dict, Iterator, List
+
+
+@dataclass(frozen=True, slots=True)
+class TraceEvent:
+    trial: int
+    phase: str
+    detail: Dict[str, Any]
+
+
+class TraceRecorder:
+    def __init__(self, sample_every: int=10_000, capacity: int=4096):
+        if sample_every < 1:
+            raise ValueError('sample_every must be a positive integer')
+        self.sample_every = sample_every
+        self.events = deque(maxlen=capacity) # oldest events drop out once the buffer is full
+        self.trials_seen = 0
+        self.current_trial = None # trial being traced on the model-by-model path, None while unsampled
+        self.sampled_rows = np.array([], dtype=int) # rows of the current batch being traced
+        self.sampled_trials = np.array([], dtype=int)
+
+    @property
+    def recording(self) -> bool:
+        return self.current_trial is not None or len(self.sampled_rows) > 0
+
+    def start_trial(self):
+        # Model-by-model path: one call per simulated round
+        trial = self.trials_seen
+        self.trials_seen += 1
+        self.current_trial = trial if trial % self.sample_every == 0 else None
+        self.sampled_rows = self.sampled_trials = np.array([], dtype=int)
+
+    def start_batch(self, num_trials: int):
+        # Batch path: trial ids continue across batches, row t of the batch is trial trials_seen + t
+        first_row = -self.trials_seen % self.sample_every
+        self.sampled_rows = np.arange(first_row, num_trials, self.sample_every)
+        self.sampled_trials = self.sampled_rows + self.trials_seen
+        self.trials_seen += num_trials
+        self.current_trial = None
+
+    def record(self, phase: str, **detail: Any):
+        self.events.append(TraceEvent(self.current_trial, phase, {key: as_plain(value) for key, value in detail.items()}))
+
+    def record_rows(self, phase: str, **detail: Any):
+        # One event per sampled row of the current batch. Arrays are indexed by trial in their first dimension,
+        # anything else (weapon names, boundaries) is shared by every row
+        for row, trial in zip(self.sampled_rows, self.sampled_trials):
+            self.events.append(TraceEvent(int(trial), phase, {
+                key: as_plain(value[row] if isinstance(value, np.ndarray) else value) for key, value in detail.items()
+            }))
+
+    def trials(self) -> Dict[int, List[TraceEvent]]:
+        traced = {}
+        for event in self.events:
+            traced.setdefault(event.trial, []).append(event)
+        return traced
+
+    def clear(self):
+        self.events.clear()
+
+
+def as_plain(value: Any) -> Any:
+    # Events hold plain Python values, so they can be dumped as JSON and don't keep whole arrays alive
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+active: TraceRecorder | None = None
+
+
+@contextmanager
+def tracing(recorder: TraceRecorder | None = None) -> Iterator[TraceRecorder]:
+    """Trace everything run inside the with block, then restore whatever was active before"""
+    global active
+    previous = active
+    active = recorder if recorder is not None else TraceRecorder()
+    try:
+        yield active
+    finally:
+        active = previous
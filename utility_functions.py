@@ -1,8 +1,10 @@
 import numpy as np
 from numpy.typing import NDArray
+from collections import Counter
+from contextlib import contextmanager
 import logging
 logger = logging.getLogger(__name__)
-from typing import Tuple, Set, TYPE_CHECKING
+from typing import Dict, Tuple, Set, TYPE_CHECKING
 if TYPE_CHECKING:
     from Weapon import Weapon
     from Engagement import Engagement
@@ -10,9 +12,153 @@ if TYPE_CHECKING:
     from Unit import Unit
 
 
+# Module level generator instead of the global np.random state, so each process can be given its own stream
+rng = np.random.default_rng()
+
+
+def set_rng(generator: np.random.Generator):
+    global rng
+    rng = generator
+
+
+@contextmanager
+def seeded_rng(generator: np.random.Generator):
+    # set_rng for the duration of a block, the caller's generator comes back afterwards even when shards run in the
+    # caller's own process
+    global rng
+    previous, rng = rng, generator
+    try:
+        yield generator
+    finally:
+        rng = previous
+
+
 def roll(num_rolls: int, die_sides: int=6) -> NDArray[np.integer]:
     # return np.random.randint(1, 7, num_rolls)
-    return np.random.randint(1, die_sides+1, num_rolls)
+    return rng.integers(1, die_sides+1, num_rolls)
+
+
+def roll_batch(
+        rng: np.random.Generator, num_trials: int, width: int, die_sides: int=6,
+        boundary: int | NDArray[np.integer] | None = None
+) -> NDArray[np.integer]:
+    # boundary is the roll needed to succeed, for all trials or per trial as a column. Only importance sampling uses it
+    if boundary is not None and isinstance(rng, TiltedStream):
+        return rng.integers(1, die_sides+1, size=(num_trials, width), boundary=boundary)
+    return rng.integers(1, die_sides+1, size=(num_trials, width))
+
+
+# Phases of the dice sequence that get their own stream under common random numbers
+DICE_STREAMS = ('attacks', 'hit', 'wound', 'wound_reroll', 'hazardous', 'save', 'damage', 'feel_no_pain', 'charge')
+
+
+class CommonStream:
+    # Stands in for a Generator. Dice are drawn with the trial axis last, so die j of trial t only depends on j and
+    # t: a variant rolling more dice gets the same first dice plus new ones, instead of a reshuffled stream
+    def __init__(self, generator: np.random.Generator):
+        self.generator = generator
+
+    def integers(self, low: int, high: int, size: Tuple[int, ...]) -> NDArray[np.integer]:
+        num_trials, *rest = size
+        return np.moveaxis(self.generator.integers(low, high, size=(*rest, num_trials)), -1, 0)
+
+
+class CommonRandomNumbers:
+    # Common random numbers for paired comparisons of variants. Each phase draws from its own streams and the n-th
+    # call of a phase always gets the same stream, so variants that change one phase (e.g. BS, or twin-linked adding
+    # re-rolls) still see identical dice in every other phase. Call restart() before running the next variant
+    def __init__(self, seed_sequence: np.random.SeedSequence):
+        self.seed_sequence = seed_sequence
+        self.calls = Counter()
+
+    def restart(self):
+        self.calls.clear()
+
+    def stream(self, phase: str) -> CommonStream:
+        call = self.calls[phase]
+        self.calls[phase] += 1
+        spawn_key = (*self.seed_sequence.spawn_key, DICE_STREAMS.index(phase), call)
+        return CommonStream(np.random.default_rng(np.random.SeedSequence(self.seed_sequence.entropy, spawn_key=spawn_key)))
+
+
+class TiltedStream:
+    # Importance sampling. With a boundary (the roll needed to succeed), the odds of succeeding are multiplied by
+    # exp(tilt) and faces stay uniform within successes and within fails, so only the number of successes is skewed.
+    # Without one, faces are drawn with probability proportional to exp(tilt * face). The log likelihood ratios of
+    # the last draw are kept until the caller says which of the dice made a difference
+    def __init__(self, generator: np.random.Generator, tilt: float, log_weights: NDArray[np.floating]):
+        self.generator = generator
+        self.tilt = tilt
+        self.log_weights = log_weights # per trial, shared by every stream of the same TiltedDice
+        self.log_ratios = np.zeros(0)
+
+    def integers(
+            self, low: int, high: int, size: Tuple[int, ...], boundary: int | NDArray[np.integer] | None = None
+    ) -> NDArray[np.integer]:
+        sides = high - low
+        if boundary is not None:
+            return self.integers_from_boundary(low, sides, size, boundary)
+        tilted = np.exp(self.tilt * np.arange(sides))
+        tilted /= tilted.sum()
+        faces = np.minimum(np.searchsorted(np.cumsum(tilted), self.generator.random(size), side='right'), sides - 1)
+        self.log_ratios = (-np.log(sides) - np.log(tilted))[faces]
+        return faces + low
+
+    def integers_from_boundary(
+            self, low: int, sides: int, size: Tuple[int, ...], boundary: int | NDArray[np.integer]
+    ) -> NDArray[np.integer]:
+        num_fails = np.clip(np.asarray(boundary) - low, 0, sides)
+        success = (sides - num_fails) / sides
+        tilted = success * np.exp(self.tilt) / (success * np.exp(self.tilt) + 1 - success)
+        succeeded = self.generator.random(size) < tilted
+        uniform = self.generator.random(size)
+        faces = np.where(succeeded, num_fails + uniform * (sides - num_fails), uniform * num_fails).astype(int)
+        with np.errstate(divide='ignore', invalid='ignore'): # a class that can't happen is never drawn or used
+            self.log_ratios = np.where(
+                succeeded, np.log(success) - np.log(tilted), np.log(1 - success) - np.log(1 - tilted)
+            )
+        return np.minimum(faces, sides - 1) + low
+
+    def weigh(self, used: NDArray[np.bool_]):
+        # used covers the leading axes of the last draw, e.g. (trials x wounds) for (trials x wounds x dice)
+        used = used.reshape(used.shape + (1,) * (self.log_ratios.ndim - used.ndim))
+        self.log_weights += (self.log_ratios * used).reshape(len(self.log_weights), -1).sum(axis=1)
+
+
+class TiltedDice:
+    # Dice for rare event estimates, see wh_rare_event. Phases with a tilt draw from a TiltedStream, the others
+    # from the plain generator. Each trial's likelihood weight is exp(log_weights)
+    def __init__(self, generator: np.random.Generator, num_trials: int, tilts: Dict[str, float]):
+        self.generator = generator
+        self.log_weights = np.zeros(num_trials)
+        self.streams = {
+            phase: TiltedStream(generator, tilt, self.log_weights) for phase, tilt in tilts.items() if tilt != 0
+        }
+
+    def stream(self, phase: str) -> 'np.random.Generator | TiltedStream':
+        return self.streams.get(phase, self.generator)
+
+    @property
+    def weights(self) -> NDArray[np.floating]:
+        return np.exp(self.log_weights)
+
+
+def dice_stream(
+        rng: 'np.random.Generator | CommonRandomNumbers | TiltedDice', phase: str
+) -> 'np.random.Generator | CommonStream | TiltedStream':
+    # Batch engines ask for the generator of each phase, a plain Generator is simply used for everything
+    return rng.stream(phase) if isinstance(rng, (CommonRandomNumbers, TiltedDice)) else rng
+
+
+def weigh_dice(stream: 'np.random.Generator | CommonStream | TiltedStream', used: NDArray[np.bool_]):
+    # Called after every draw with the dice that counted for each trial, only tilted streams do anything with it
+    if isinstance(stream, TiltedStream):
+        stream.weigh(used)
+
+
+def dice_mask(counts: NDArray[np.integer], width: int) -> NDArray[np.bool_]:
+    # Row t has its first counts[t] dice in play, the rest of the row is padding
+    return np.arange(width) < counts[:, None]
 
 
 def re_roll_fails(rolls: NDArray[np.integer], success_boundary: int) -> NDArray[np.integer]:
@@ -27,17 +173,18 @@ def re_roll_ones(rolls: NDArray[np.integer]) -> NDArray[np.integer]:
 
 
 def handle_crits(rolls: NDArray[np.integer], fail_boundary: int, success_boundary: int) -> Tuple[int, NDArray[np.integer]]:
-    logger.debug(
-        f'Rolls: {rolls}. Critical fail boundary: {fail_boundary}, critical success boundary: {success_boundary}.'
-    )
     crit_fails = (rolls <= fail_boundary)
     crit_successes = (rolls >= success_boundary)
     all_crits = crit_fails | crit_successes
-    logger.debug(
-        f'Crit fails: {crit_fails} ({crit_fails.sum()}), Crit successes: {crit_successes} ({crit_successes.sum()}).'
-    )
     reminder = rolls[~all_crits]
-    logger.debug(f'Reminder: {reminder}')
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f'Rolls: {rolls}. Critical fail boundary: {fail_boundary}, critical success boundary: {success_boundary}.'
+        )
+        logger.debug(
+            f'Crit fails: {crit_fails} ({crit_fails.sum()}), Crit successes: {crit_successes} ({crit_successes.sum()}).'
+        )
+        logger.debug(f'Reminder: {reminder}')
     return crit_successes.sum(), reminder
 
 
@@ -53,9 +200,25 @@ def find_wound_roll_requirement(strength: int, toughness: int) -> int:
     return 4 # implied that strength == toughness
 
 
+def find_save_roll_requirement(save: int, invulnerable_save: int | None, armor_piercing: int, cover: bool) -> int:
+    # Cover and AP only modify the armour save, the invulnerable save is taken as is
+    armor_save = save + armor_piercing - int(cover)
+    if invulnerable_save is not None and invulnerable_save < armor_save:
+        return invulnerable_save
+    return armor_save
+
+
+def benefits_from_cover(save: int, weapon: 'Weapon', engagement: 'Engagement') -> bool:
+    # Cover only works vs shooting, and models with a 3+ save or better get nothing from it vs AP0
+    if not engagement.in_cover or weapon.profile.ignores_cover or weapon.weapon_range <= 1:
+        return False
+    return save >= 4 or weapon.armor_piercing > 0
+
+
 def calculate_damage(num_wounds_taken: int, weapon: 'Weapon', engagement: 'Engagement') -> int:
-    damage = num_wounds_taken * (weapon.damage + melta(weapon.weapon_range, weapon.keywords, engagement.distance))
-    logger.debug(f'{num_wounds_taken} wounds at {weapon.damage} damage each deal a total of {damage} damage.')
+    damage = weapon.damage.roll(num_wounds_taken).sum() + num_wounds_taken * melta(weapon.weapon_range, weapon.keywords, engagement.distance)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(f'{num_wounds_taken} wounds at {weapon.damage} damage each deal a total of {damage} damage.')
     return damage
 
 
@@ -79,7 +242,10 @@ def get_keyword_x_value(keyword: str | None) -> int:
 
 
 def check_keyword(target_keyword: str, keywords: Set[str]) -> str | None:
-    occurrences = [keyword for keyword in keywords if target_keyword in keyword]
+    # Either the exact keyword ('lance') or the keyword followed by its values ('anti_infantry_4')
+    occurrences = [
+        keyword for keyword in keywords if keyword == target_keyword or keyword.startswith(target_keyword + '_')
+    ]
     if occurrences:
         return occurrences[0]
     return None # if target keyword not present
@@ -92,21 +258,23 @@ def sustained_hits(num_crit_hits: int, keywords: Set[str]) -> int:
     if sustained_hits_keyword_present:
         sustained_hits_value = get_keyword_x_value(sustained_hits_keyword_present)
         added_hits = num_crit_hits * sustained_hits_value
-        logger.debug(
-            f'Adding {sustained_hits_value} extra hits due to the weapon having {sustained_hits_keyword_present} '
-            f'and scoring {num_crit_hits} critical hits (+{sustained_hits_value} extra hits per critical hit).'
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f'Adding {sustained_hits_value} extra hits due to the weapon having {sustained_hits_keyword_present} '
+                f'and scoring {num_crit_hits} critical hits (+{sustained_hits_value} extra hits per critical hit).'
+            )
         return added_hits
     return 0
 
 
 def twin_linked(rolls: NDArray[np.integer], wound_roll_requirement: int) -> NDArray[np.integer]:
     re_rolls = re_roll_fails(rolls, wound_roll_requirement)
-    logger.debug(
-        f'Using twin-linked. Rolls: {rolls} with requirement {wound_roll_requirement}.'
-        f'Unsuccessful: {(rolls < wound_roll_requirement).sum()}, Successful: {(rolls >= wound_roll_requirement).sum()}'
-        f'Re-rolls: {re_rolls} for a total of {(rolls >= wound_roll_requirement).sum()} successful rolls.'
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f'Using twin-linked. Rolls: {rolls} with requirement {wound_roll_requirement}.'
+            f'Unsuccessful: {(rolls < wound_roll_requirement).sum()}, Successful: {(rolls >= wound_roll_requirement).sum()}'
+            f'Re-rolls: {re_rolls} for a total of {(rolls >= wound_roll_requirement).sum()} successful rolls.'
+        )
     return re_rolls
 
 
@@ -116,10 +284,11 @@ def rapid_fire(weapon_range: int, keywords: Set[str], distance: float) -> int:
     rapid_fire_keyword_present = check_keyword('rapid_fire', keywords)
     if rapid_fire_keyword_present:
         rapid_fire_value = get_keyword_x_value(rapid_fire_keyword_present)
-        logger.debug(
-            f'Adding {rapid_fire_value} attacks due to distance to opponent ({distance}) being less than half of '
-            f'the weapon\'s range ({weapon_range}) and the weapon having the {rapid_fire_keyword_present} keyword.'
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f'Adding {rapid_fire_value} attacks due to distance to opponent ({distance}) being less than half of '
+                f'the weapon\'s range ({weapon_range}) and the weapon having the {rapid_fire_keyword_present} keyword.'
+            )
         return rapid_fire_value
     return 0
 
@@ -127,20 +296,22 @@ def rapid_fire(weapon_range: int, keywords: Set[str], distance: float) -> int:
 def lethal_hits(num_hits: int, num_crit_hits: int) -> Tuple[int, int]:
     wounds = num_crit_hits
     num_hits -= num_crit_hits
-    logger.debug(
-        f'All {num_crit_hits} critical hits automatically become wounds because of the weapon\'s "lethal hits" '
-        f'keyword. Only {num_hits} need to be rolled for.'
-    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(
+            f'All {num_crit_hits} critical hits automatically become wounds because of the weapon\'s "lethal hits" '
+            f'keyword. Only {num_hits} need to be rolled for.'
+        )
     return wounds, num_hits
 
 
 def lance(rolls: NDArray[np.integer], wielder_unit: 'Unit') -> NDArray[np.integer]:
     if wielder_unit.last_action == 'charged':
         upgraded_rolls = rolls + 1
-        logger.debug(
-            f'Rolls get upgraded due to the wielder having charged and the weapon having the "lance" keyword. '
-            f'Previous rolls: {rolls}, upgraded rolls: {upgraded_rolls}'
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f'Rolls get upgraded due to the wielder having charged and the weapon having the "lance" keyword. '
+                f'Previous rolls: {rolls}, upgraded rolls: {upgraded_rolls}'
+            )
         return upgraded_rolls
     return rolls
 
@@ -148,10 +319,11 @@ def lance(rolls: NDArray[np.integer], wielder_unit: 'Unit') -> NDArray[np.intege
 def heavy(rolls: NDArray[np.integer], wielder_unit: 'Unit') -> NDArray[np.integer]:
     if wielder_unit.last_action == 'remained_stationary':
         upgraded_rolls = rolls + 1
-        logger.debug(
-            f'Rolls get upgraded due to the wielder having remained stationary and the weapon having the "heavy" keyword. '
-            f'Previous rolls: {rolls}, upgraded rolls: {upgraded_rolls}'
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f'Rolls get upgraded due to the wielder having remained stationary and the weapon having the "heavy" keyword. '
+                f'Previous rolls: {rolls}, upgraded rolls: {upgraded_rolls}'
+            )
         return upgraded_rolls
     return rolls
 
@@ -166,10 +338,11 @@ def melta(weapon_range: int, keywords: Set[str], distance: float) -> int:
     melta_keyword_present = check_keyword('melta', keywords)
     if melta_keyword_present:
         melta_value = get_keyword_x_value(melta_keyword_present)
-        logger.debug(
-            f'Adding {melta_value} damage due to distance to opponent ({distance}) being less than half of '
-            f'the weapon\'s range ({weapon_range}) and the weapon having the {melta_keyword_present} keyword.'
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f'Adding {melta_value} damage due to distance to opponent ({distance}) being less than half of '
+                f'the weapon\'s range ({weapon_range}) and the weapon having the {melta_keyword_present} keyword.'
+            )
         return melta_value
     return 0
 
@@ -180,10 +353,11 @@ def anti_keyword(keywords: Set[str], opponent_keywords: Set[str]) -> int:
         target = anti_keyword_full.split('_')[1]
         if target in opponent_keywords:
             new_crit_success_threshold = get_keyword_x_value(anti_keyword_full)
-            logger.debug(
-                f'Due to the fact that the weapon has the {anti_keyword_full} keyword and the target has the {target} '
-                f'keyword, unmodified wound rolls now crit on {new_crit_success_threshold}+.'
-            )
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(
+                    f'Due to the fact that the weapon has the {anti_keyword_full} keyword and the target has the {target} '
+                    f'keyword, unmodified wound rolls now crit on {new_crit_success_threshold}+.'
+                )
             return new_crit_success_threshold
     return 6
 
@@ -202,17 +376,18 @@ def feel_no_pain(damage_taken: int, keywords: Set[str]) -> int:
         rolls = roll(damage_taken)
         fnp_boundary = get_keyword_x_value(feel_no_pain_full)
         damage_ignored = (rolls >= fnp_boundary).sum()
-        logger.debug(
-            f'Ignoring {damage_ignored} out of {damage_taken} damage due to the "Feel No Pain" rule. '
-            f'FNP boundary: {fnp_boundary} and rolls: {rolls}'
-        )
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                f'Ignoring {damage_ignored} out of {damage_taken} damage due to the "Feel No Pain" rule. '
+                f'FNP boundary: {fnp_boundary} and rolls: {rolls}'
+            )
     return damage_ignored
 
 
-def hazardous(wielder: 'Model'):
+def hazardous(wielder: 'Model', wielder_unit: 'Unit'):
     if 6 in roll(1):
         logger.debug('Weapon exploding because it\'s hazardous and rolled a 6.')
-        wielder.take_damage(3)
+        wielder_unit.apply_damage(wielder, 3) # through the unit, so a model it kills leaves the unit
 
 
 def deadly_demise(keywords: Set[str]) -> int:
@@ -220,6 +395,7 @@ def deadly_demise(keywords: Set[str]) -> int:
     if deadly_demise_full:
         if 6 in roll(1):
             explosion_damage = get_keyword_x_value(deadly_demise_full)
-            logger.debug(f'Exploding for {explosion_damage} damage in a 6-inch radius!')
+            if logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f'Exploding for {explosion_damage} damage in a 6-inch radius!')
             return explosion_damage
     return 0
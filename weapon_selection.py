@@ -0,0 +1,105 @@
+# Weapon selection - the expected damage of every weapon profile against every defender profile and engagement
+# band, kept in one lookup table. Equal profiles share an entry, and an entry is computed exactly once on its first
+# read, then kept while it's among the most recently used. Picking a weapon in the hot loop is then a few dict reads
+# rather than a simulation
+import weakref
+from collections import OrderedDict
+import numpy as np
+from wh_exact_sim import ExactResult, attack_count_pmf, wound_probabilities, unsaved_wounds_pmf, damage_per_wound_pmf
+import logging
+logger = logging.getLogger(__name__)
+from typing import Iterable, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Weapon import Weapon
+    from Model import Model
+    from Unit import Unit
+    from Engagement import Engagement
+
+
+def expected_damage(weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement', target: 'Model') -> float:
+    # Expected wounds one model's attacks take off target, damage beyond the target's wounds is wasted
+    normal_wound, crit_wound = wound_probabilities(weapon, attacker, engagement, target)
+    unsaved = unsaved_wounds_pmf(
+        weapon, attacker, engagement, target, attack_count_pmf(weapon, 1, engagement), normal_wound, crit_wound
+    )
+    damage_pmf = damage_per_wound_pmf(weapon, engagement, target)
+    return ExactResult.mean(unsaved) * float(damage_pmf @ np.minimum(np.arange(len(damage_pmf)), target.current_wounds))
+
+
+def weapon_key(weapon: 'Weapon') -> tuple:
+    # Everything about a weapon that changes its expected damage, the name and raw range are left out. Whether it is
+    # a melee weapon stays in, cover only works against shooting
+    return (
+        weapon.attacks, weapon.ballistic_skill, weapon.strength, weapon.armor_piercing, weapon.damage, weapon.profile,
+        weapon.weapon_range > 1
+    )
+
+
+def defender_key(model: 'Model') -> tuple:
+    # Wounds left are part of the profile, damage beyond them is wasted
+    return model.toughness, model.save, model.invulnerable_save, model.profile.feel_no_pain, model.current_wounds
+
+
+def engagement_band(weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement') -> tuple:
+    # The parts of an engagement that change what weapon does, every distance within the same half of its range
+    # is one band
+    profile = weapon.profile
+    return (
+        engagement.distance <= weapon.weapon_range / 2, engagement.line_of_sight, engagement.in_cover,
+        profile.heavy and attacker.last_action == 'remained_stationary',
+        profile.lance and attacker.last_action == 'charged',
+        len(engagement.opponent.models) // 5 if profile.blast else 0,
+        profile.crit_wound_boundary(engagement.opponent.get_all_models_keywords())
+    )
+
+
+class ExpectedDamageTable:
+    # values[(weapon key, defender key, band)] is the expected damage one model's attacks do. Defender keys include
+    # the wounds left, so every damage state seen adds entries: the least recently used ones go past max_entries
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        # Weapons are shared, never copied, so the instance stands for its key until it's gone
+        self.weapon_keys: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+        self.values: OrderedDict[tuple, float] = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def weapon_key(self, weapon: 'Weapon') -> tuple:
+        key = self.weapon_keys.get(weapon)
+        if key is None:
+            key = self.weapon_keys[weapon] = weapon_key(weapon)
+        return key
+
+    def lookup(self, weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement', target: 'Model') -> float:
+        """Expected damage of one model firing weapon at target, computed on the first lookup of its profiles"""
+        key = self.weapon_key(weapon), defender_key(target), engagement_band(weapon, attacker, engagement)
+        value = self.values.get(key)
+        if value is None:
+            value = self.values[key] = float(expected_damage(weapon, attacker, engagement, target))
+            if len(self.values) > self.max_entries:
+                self.values.popitem(last=False)
+        else:
+            self.values.move_to_end(key)
+        return value
+
+    def best_weapon(
+            self, weapons: Iterable['Weapon'], model: 'Model', attacker: 'Unit', engagement: 'Engagement',
+            check_eligibility: bool=True
+    ) -> 'Weapon | None':
+        # The weapon with the most expected damage against whoever its wounds go to, ties go to the first one.
+        # Weapons model can't fire in this engagement only get picked when none can fire
+        weapons = list(weapons)
+        if len(weapons) < 2 or not engagement.opponent.models:
+            return weapons[0] if weapons else None
+        best, best_value = weapons[0], -1.0
+        for weapon in weapons:
+            if check_eligibility and not model.can_shoot(weapon, engagement, attacker):
+                continue
+            value = self.lookup(weapon, attacker, engagement, engagement.opponent.target(weapon.profile.precision))
+            if value > best_value:
+                best, best_value = weapon, value
+        return best
+
+
+table = ExpectedDamageTable()
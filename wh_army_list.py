@@ -0,0 +1,286 @@
+# Army list optimizer - the combination of units within a points limit that does the most against a meta of
+# opponent units. Every candidate's efficiency against every opponent is computed once with the exact engine
+# (through the matchup cache when one is given), then a branch and bound search over those vectors picks the list.
+# Nothing is simulated inside the search, so catalogs of hundreds of units take seconds
+import argparse
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round
+from wh_matchup_cache import MatchupCache, cached_exact_shooting_round
+from warhammer.datasheets.unit_collection import unit_collection
+import logging
+logger = logging.getLogger(__name__)
+from typing import Dict, List, Sequence, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+
+METRICS = ('damage', 'kill')
+
+
+@dataclass
+class ArmyList:
+    units: Dict[str, int]          # name -> number of copies taken
+    points: int
+    value: float                   # weighted objective over the meta
+    per_opponent: Dict[str, float] # expected damage, or probability some unit kills it, per opponent
+    nodes: int                     # search nodes explored
+
+
+def efficiency_vectors(
+        candidates: Dict[str, 'Unit'],
+        meta: Dict[str, 'Unit'],
+        metric: str = 'damage',
+        distance: int = 12,
+        line_of_sight: bool = True,
+        in_cover: bool = False,
+        cache: MatchupCache | None = None
+) -> NDArray[np.floating]:
+    """(candidates x opponents) expected damage or kill probability of one shooting round of each unit on its own"""
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric {metric!r}, expected one of {", ".join(METRICS)}')
+    sub_problems = {} # shared by every matchup, like in a sweep
+    values = np.zeros((len(candidates), len(meta)))
+    for a, attacker_template in enumerate(candidates.values()):
+        attacker = attacker_template.spawn()
+        for o, opponent in enumerate(meta.values()):
+            engagement = Engagement(
+                distance=distance, line_of_sight=line_of_sight, in_cover=in_cover, opponent=opponent.spawn()
+            )
+            if cache is not None:
+                result = cached_exact_shooting_round(attacker, engagement, cache)
+            else:
+                result = exact_shooting_round(attacker, engagement, sub_problems)
+            values[a, o] = result.expected_damage if metric == 'damage' else result.kill_probability
+    return values
+
+
+class ListObjective:
+    # The state of a partial list is one number per opponent: total expected damage, or for kills the probability
+    # that no unit of the list kills that opponent on its own. Adding a unit never gains more than it would on a
+    # smaller list, which is what makes the sum of single unit gains an upper bound
+    def __init__(self, values: NDArray[np.floating], weights: NDArray[np.floating], metric: str):
+        self.values = values
+        self.weights = weights
+        self.metric = metric
+        # -log of the chance each unit fails to kill each opponent, these add up where the chances multiply
+        self.log_survival = -np.log1p(-np.minimum(values, 1 - 1e-12)) if metric == 'kill' else None
+
+    def empty(self) -> NDArray[np.floating]:
+        return np.zeros(len(self.weights)) if self.metric == 'damage' else np.ones(len(self.weights))
+
+    def add(self, state: NDArray[np.floating], unit: int, copies: int) -> NDArray[np.floating]:
+        if self.metric == 'damage':
+            return state + copies * self.values[unit]
+        return state * (1 - self.values[unit]) ** copies
+
+    def per_opponent(self, state: NDArray[np.floating]) -> NDArray[np.floating]:
+        return state if self.metric == 'damage' else 1 - state
+
+    def value(self, state: NDArray[np.floating]) -> float:
+        return float(self.per_opponent(state) @ self.weights)
+
+    def gains(self, state: NDArray[np.floating]) -> NDArray[np.floating]:
+        # What one more copy of each unit adds to the list
+        if self.metric == 'damage':
+            return self.values @ self.weights
+        return (self.values * state) @ self.weights
+
+    def bound(
+            self, state: NDArray[np.floating], units: NDArray[np.integer], gains: NDArray[np.floating],
+            costs: NDArray[np.integer], copies: int, budget: int, enough: float = -np.inf, iterations: int = 30
+    ) -> float:
+        # Most that units, with their gains and costs, could still add within budget. Refining stops once the bound
+        # is down to enough, the node gets pruned either way
+        bound = fractional_bound(gains, costs, copies, budget)
+        if self.metric == 'damage' or bound <= enough:
+            return bound
+        # Kill chances overlap, so summed gains are loose. Letting copies be fractions, the probability that an
+        # opponent survives is exp(-x @ log_survival), a concave objective over the knapsack constraint. Frank-Wolfe
+        # steps approach its maximum, and at every step the value plus the duality gap bounds it from above
+        log_survival = self.log_survival[units]
+        mass = self.weights * state
+        amounts = np.zeros(len(costs))
+        for step in range(iterations):
+            left = mass * np.exp(-amounts @ log_survival)
+            gradient = log_survival @ left
+            direction = fractional_fill(gradient, costs, copies, budget)
+            bound = min(bound, float(mass.sum() - left.sum() + gradient @ (direction - amounts)))
+            if bound <= enough:
+                break
+            amounts += 2 / (step + 2) * (direction - amounts)
+        return bound
+
+
+def greedy_list(
+        objective: ListObjective, costs: NDArray[np.integer], points_limit: int, max_copies: int
+) -> Tuple[NDArray[np.integer], NDArray[np.floating]]:
+    # Keep adding the copy with the most gain per point that still fits, a good first list for the search to beat
+    counts = np.zeros(len(costs), dtype=int)
+    state = objective.empty()
+    spent = 0
+    while True:
+        gains = objective.gains(state) / costs
+        gains[(counts >= max_copies) | (costs > points_limit - spent)] = 0
+        unit = int(np.argmax(gains))
+        if gains[unit] <= 0:
+            return counts, state
+        counts[unit] += 1
+        spent += costs[unit]
+        state = objective.add(state, unit, 1)
+
+
+def fractional_fill(gains: NDArray[np.floating], costs: NDArray[np.integer], copies: int, budget: int) -> NDArray[np.floating]:
+    # Copies of each unit that get the most gain if they could be taken in fractions: fill by gain per point
+    order = np.argsort(-gains / costs, kind='stable')
+    order = order[gains[order] > 0]
+    spent = np.cumsum(costs[order] * copies)
+    whole = np.searchsorted(spent, budget, side='right')
+    amounts = np.zeros(len(gains))
+    amounts[order[:whole]] = copies
+    if whole < len(order):
+        amounts[order[whole]] = (budget - (spent[whole - 1] if whole else 0)) / costs[order[whole]]
+    return amounts
+
+
+def fractional_bound(gains: NDArray[np.floating], costs: NDArray[np.integer], copies: int, budget: int) -> float:
+    return float(gains @ fractional_fill(gains, costs, copies, budget))
+
+
+def optimize(
+        values: NDArray[np.floating],
+        costs: Sequence[int],
+        points_limit: int,
+        weights: Sequence[float] | None = None,
+        metric: str = 'damage',
+        max_copies: int = 3,
+        tolerance: float = 1e-4,
+        max_nodes: int | None = None
+) -> Tuple[NDArray[np.integer], float, int]:
+    """Branch and bound over efficiency vectors: copies of each unit, objective value and nodes explored"""
+    # The list found is within a factor of tolerance of the best one. Kill chances leave many lists within a hair
+    # of each other, and proving which one is best down to the last digit costs most of the search. With max_nodes
+    # the search stops early and returns the best list found so far
+    if metric not in METRICS:
+        raise ValueError(f'Unknown metric {metric!r}, expected one of {", ".join(METRICS)}')
+    costs = np.asarray(costs, dtype=int)
+    if (costs <= 0).any():
+        raise ValueError('Every unit needs a positive point cost')
+    weights = np.ones(values.shape[1]) if weights is None else np.asarray(weights, dtype=float)
+    objective = ListObjective(values, weights, metric)
+    counts = np.zeros(len(costs), dtype=int)
+    useful = (costs <= points_limit) & (objective.gains(objective.empty()) > 0)
+    if not useful.any():
+        return counts, 0.0, 0
+    best_counts, best_state = greedy_list(objective, costs, points_limit, max_copies)
+    best_value = objective.value(best_state)
+
+    nodes = 0
+    # Depth first: (state, points spent, copies so far, units not decided yet). Each node branches on the undecided
+    # unit with the most gain per point on top of the list so far. Children are pushed fewest copies first, so the
+    # most copies are tried first and good lists turn up early
+    stack = [(objective.empty(), 0, counts, useful)]
+    while stack:
+        if max_nodes is not None and nodes >= max_nodes:
+            logger.warning(f'Stopped after {nodes} nodes, the list found may not be the best one')
+            break
+        state, spent, taken, undecided = stack.pop()
+        nodes += 1
+        value = objective.value(state)
+        if value > best_value:
+            best_value, best_counts = value, taken
+        budget = points_limit - spent
+        units = np.flatnonzero(undecided & (costs <= budget))
+        if not len(units):
+            continue
+        enough = best_value * (1 + tolerance) + 1e-12 - value
+        gains = objective.gains(state)[units]
+        if objective.bound(state, units, gains, costs[units], max_copies, budget, enough) <= enough:
+            continue
+        unit = units[np.argmax(gains / costs[units])]
+        rest = undecided.copy()
+        rest[unit] = False
+        for copies in range(min(max_copies, budget // costs[unit]) + 1):
+            child = taken.copy()
+            child[unit] = copies
+            stack.append((objective.add(state, unit, copies), spent + copies * costs[unit], child, rest))
+
+    logger.debug(f'Explored {nodes} nodes over {useful.sum()} useful units')
+    return best_counts, best_value, nodes
+
+
+def build_army_list(
+        candidates: Dict[str, 'Unit'],
+        meta: Dict[str, 'Unit'],
+        points_limit: int,
+        metric: str = 'damage',
+        meta_weights: Dict[str, float] | None = None,
+        max_copies: int = 3,
+        distance: int = 12,
+        cache: MatchupCache | None = None
+) -> ArmyList:
+    """The list of candidates within points_limit with the most expected damage, or kills, against the meta"""
+    # meta_weights are how often each opponent is expected, opponents left out count once
+    if not meta:
+        raise ValueError('Need at least one opponent in the meta')
+    values = efficiency_vectors(candidates, meta, metric, distance, cache=cache)
+    weights = [(meta_weights or {}).get(name, 1.0) for name in meta]
+    costs = [unit.point_cost for unit in candidates.values()]
+    counts, value, nodes = optimize(values, costs, points_limit, weights, metric, max_copies)
+    objective = ListObjective(values, np.asarray(weights), metric)
+    state = objective.empty()
+    for unit, copies in enumerate(counts):
+        state = objective.add(state, unit, copies)
+    return ArmyList(
+        units={name: int(copies) for name, copies in zip(candidates, counts) if copies},
+        points=int(counts @ np.asarray(costs)),
+        value=value,
+        per_opponent=dict(zip(meta, objective.per_opponent(state).tolist())),
+        nodes=nodes
+    )
+
+
+def parse_meta(values: List[str]) -> Dict[str, float]:
+    # Opponents with optional weights: ctan_shard_of_the_nightbringer=2 allarus_custodians
+    meta = {}
+    for value in values:
+        name, _, weight = value.partition('=')
+        meta[name] = float(weight) if weight else 1.0
+    return meta
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description='Find the army list within a points limit that does best against a meta.')
+    parser.add_argument('--points', type=int, default=1000)
+    parser.add_argument('--candidates', nargs='+', default=list(unit_collection), help='unit_collection entries')
+    parser.add_argument('--meta', nargs='+', default=list(unit_collection), help='opponents, optionally name=weight')
+    parser.add_argument('--metric', choices=METRICS, default='damage')
+    parser.add_argument('--max-copies', type=int, default=3)
+    parser.add_argument('--distance', type=int, default=12)
+    parser.add_argument('--cache', action='store_true', help='read and store matchups in the matchup cache')
+    args = parser.parse_args(argv)
+
+    meta_weights = parse_meta(args.meta)
+    cache = MatchupCache() if args.cache else None
+    army_list = build_army_list(
+        candidates={name: unit_collection[name] for name in args.candidates},
+        meta={name: unit_collection[name] for name in meta_weights},
+        points_limit=args.points,
+        metric=args.metric,
+        meta_weights=meta_weights,
+        max_copies=args.max_copies,
+        distance=args.distance,
+        cache=cache
+    )
+    if cache is not None:
+        cache.close()
+    print(f'{army_list.points}/{args.points} points, {args.metric} {army_list.value:.3f} ({army_list.nodes} nodes)')
+    for name, copies in army_list.units.items():
+        print(f'  {copies}x {name}')
+    for name, value in army_list.per_opponent.items():
+        print(f'  vs {name}: {value:.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,286 @@
+# Batched Monte Carlo engine - every phase of a shooting round is resolved for all trials at once,
+# with dice held in (trials x dice) arrays instead of being rolled one model at a time
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from utility_functions import (
+    roll_batch, dice_mask, dice_stream, weigh_dice, find_wound_roll_requirement, find_save_roll_requirement,
+    benefits_from_cover, CommonRandomNumbers
+)
+from UnitState import UnitState
+import phase_profiler
+import trace_recorder
+from time import perf_counter
+import logging
+logger = logging.getLogger(__name__)
+from typing import Dict, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Weapon import Weapon
+    from Unit import Unit
+    from Engagement import Engagement
+
+
+@dataclass
+class BatchResult:
+    wounds: NDArray[np.integer]             # successful wound rolls per trial (crits included)
+    unsaved_wounds: NDArray[np.integer]     # wounds that got through saves per trial
+    damage: NDArray[np.integer]             # wounds actually lost by the defender per trial (after FNP, no overkill)
+    models_slain: NDArray[np.integer]       # defending models killed per trial
+    remaining_wounds: NDArray[np.integer]   # (trials x models) wounds left on each defending model
+    hazardous_damage: NDArray[np.integer]   # mortal wounds the attacker suffered from hazardous weapons
+
+    @property
+    def num_trials(self) -> int:
+        return len(self.damage)
+
+    @property
+    def kill_probability(self) -> float:
+        return float((self.remaining_wounds.sum(axis=1) == 0).mean())
+
+    def damage_distribution(self) -> NDArray[np.floating]:
+        return np.bincount(self.damage) / self.num_trials
+
+    def models_slain_distribution(self) -> NDArray[np.floating]:
+        return np.bincount(self.models_slain) / self.num_trials
+
+
+def no_attacks(defender_state: UnitState) -> BatchResult:
+    # A defender with no models left takes nothing: no rolls are made, so no hazardous tests either
+    nothing = np.zeros(defender_state.num_trials, dtype=int)
+    return BatchResult(
+        wounds=nothing, unsaved_wounds=nothing, damage=nothing, models_slain=nothing,
+        remaining_wounds=defender_state.current_wounds, hazardous_damage=nothing
+    )
+
+
+def group_weapon_columns(attacker: 'Unit', engagement: 'Engagement') -> Dict[str, Tuple['Weapon', List[int]]]:
+    # Eligibility has no dice involved, so it is checked once per model rather than once per trial. Columns are the
+    # positions of the models firing each weapon in attacker.models, which are also their columns in a UnitState
+    weapon_groups = {}
+    for i, model in enumerate(attacker.models):
+        weapon = attacker.select_weapon(model, engagement)
+        if model.can_shoot(weapon, engagement, attacker):
+            weapon_groups.setdefault(weapon.name, (weapon, []))[1].append(i)
+    return weapon_groups
+
+
+def group_weapons(attacker: 'Unit', engagement: 'Engagement') -> Dict[str, Tuple['Weapon', int]]:
+    return {
+        name: (weapon, len(columns)) for name, (weapon, columns) in group_weapon_columns(attacker, engagement).items()
+    }
+
+
+def batch_hit_roll(
+        weapon: 'Weapon', num_models: int | NDArray[np.integer], attacker: 'Unit', engagement: 'Engagement',
+        alive_defenders: NDArray[np.integer], rng: np.random.Generator
+) -> Tuple[NDArray[np.integer], NDArray[np.integer]]:
+    # num_models is the number of models attacking with weapon, the same in every trial or given per trial
+    profiler = phase_profiler.active
+    start = perf_counter() if profiler is not None else 0.0
+    num_trials = len(alive_defenders)
+    models_per_trial = np.broadcast_to(num_models, (num_trials,))
+    num_attacks = weapon.attacks.sample(dice_stream(rng, 'attacks'), num_trials, models_per_trial)
+    if engagement.distance <= weapon.weapon_range / 2:
+        num_attacks += num_models * weapon.profile.rapid_fire
+    if weapon.profile.blast:
+        num_attacks += num_models * (alive_defenders // 5)
+    if profiler is not None:
+        profiler.record('attacks', start, dice=models_per_trial.sum() * weapon.attacks.num_dice)
+        start = perf_counter()
+    if weapon.profile.torrent:
+        if profiler is not None:
+            profiler.count('torrent', models_per_trial.sum())
+            profiler.record('hit', start)
+        return num_attacks, np.zeros(num_trials, dtype=int)
+
+    heavy_bonus = int(weapon.profile.heavy and attacker.last_action == 'remained_stationary')
+    boundary = weapon.ballistic_skill - heavy_bonus # unmodified roll that hits, aims importance sampling
+    if not engagement.line_of_sight:
+        boundary = max(boundary + 1, 4)
+    hit_stream = dice_stream(rng, 'hit')
+    rolls = roll_batch(hit_stream, num_trials, num_attacks.max(initial=0), boundary=min(boundary, 6))
+    hit_dice = rolls
+    in_play = dice_mask(num_attacks, rolls.shape[1])
+    weigh_dice(hit_stream, in_play)
+    crits = in_play & (rolls >= 6)
+    remainder = in_play & (rolls > 1) & ~crits
+    if not engagement.line_of_sight: # indirect fire: unmodified 1-3 always fail, then -1 to hit
+        remainder &= rolls > 3
+        rolls = rolls - 1
+    if heavy_bonus:
+        if profiler is not None:
+            profiler.count('heavy', models_per_trial.sum())
+        rolls = rolls + 1
+
+    num_crit_hits = crits.sum(axis=1)
+    num_hits = (remainder & (rolls >= weapon.ballistic_skill)).sum(axis=1) + num_crit_hits
+    num_hits += num_crit_hits * weapon.profile.sustained_hits
+    tracer = trace_recorder.active
+    if tracer is not None and tracer.recording:
+        tracer.record_rows(
+            'hit', weapon=weapon.name, rolls=np.where(in_play, hit_dice, 0), requirement=weapon.ballistic_skill,
+            hits=num_hits, crit_hits=num_crit_hits
+        )
+    if profiler is not None:
+        profiler.record('hit', start, dice=num_attacks.sum())
+    return num_hits, num_crit_hits
+
+
+def batch_wound_roll(
+        weapon: 'Weapon', num_models: int | NDArray[np.integer], attacker: 'Unit', engagement: 'Engagement',
+        defender_state: UnitState, rng: np.random.Generator
+) -> Tuple[NDArray[np.integer], NDArray[np.integer], NDArray[np.integer]]:
+    num_trials = defender_state.num_trials
+    models_per_trial = np.broadcast_to(num_models, (num_trials,))
+    num_hits, num_crit_hits = batch_hit_roll(
+        weapon, num_models, attacker, engagement, defender_state.models_remaining, rng
+    )
+    profiler = phase_profiler.active
+    start = perf_counter() if profiler is not None else 0.0
+
+    num_wounds = np.zeros(num_trials, dtype=int)
+    if weapon.profile.lethal_hits: # crit hits automatically become wounds
+        num_wounds += num_crit_hits
+        num_hits = num_hits - num_crit_hits
+
+    requirement = np.array([
+        find_wound_roll_requirement(weapon.strength, toughness) for toughness in defender_state.toughness
+    ])[defender_state.allocation_targets()][:, None]
+    crit_boundary = weapon.profile.crit_wound_boundary(engagement.opponent.get_all_models_keywords())
+    lance_bonus = int(weapon.profile.lance and attacker.last_action == 'charged')
+    boundary = np.minimum(requirement - lance_bonus, crit_boundary)
+    wound_stream = dice_stream(rng, 'wound')
+    rolls = roll_batch(wound_stream, num_trials, num_hits.max(initial=0), boundary=boundary)
+    in_play = dice_mask(num_hits, rolls.shape[1])
+    weigh_dice(wound_stream, in_play)
+    num_dice = num_hits.sum()
+    if weapon.profile.twin_linked:
+        if profiler is not None:
+            profiler.count('twin_linked', models_per_trial.sum())
+            num_dice += (in_play & (rolls < requirement)).sum()
+        reroll_stream = dice_stream(rng, 'wound_reroll')
+        re_rolls = roll_batch(reroll_stream, num_trials, rolls.shape[1], boundary=boundary)
+        weigh_dice(reroll_stream, in_play & (rolls < requirement))
+        rolls = np.where(rolls < requirement, re_rolls, rolls)
+
+    crits = in_play & (rolls >= crit_boundary)
+    remainder = in_play & (rolls > 1) & ~crits
+    wound_dice = rolls
+    if lance_bonus:
+        if profiler is not None:
+            profiler.count('lance', models_per_trial.sum())
+        rolls = rolls + 1
+
+    num_crit_wounds = crits.sum(axis=1)
+    num_wounds += (remainder & (rolls >= requirement)).sum(axis=1) + num_crit_wounds
+    tracer = trace_recorder.active
+    if tracer is not None and tracer.recording:
+        tracer.record_rows(
+            'wound', weapon=weapon.name, rolls=np.where(in_play, wound_dice, 0), requirement=requirement[:, 0],
+            crit_boundary=crit_boundary, wounds=num_wounds, crit_wounds=num_crit_wounds
+        )
+
+    hazardous_damage = np.zeros(num_trials, dtype=int)
+    if weapon.profile.hazardous:
+        if profiler is not None:
+            profiler.count('hazardous', models_per_trial.sum())
+            num_dice += models_per_trial.sum()
+        hazard_stream = dice_stream(rng, 'hazardous')
+        hazard_rolls = roll_batch(hazard_stream, num_trials, models_per_trial.max(initial=0))
+        rolled = dice_mask(models_per_trial, hazard_rolls.shape[1])
+        weigh_dice(hazard_stream, rolled)
+        hazardous_damage = 3 * (rolled & (hazard_rolls == 6)).sum(axis=1)
+    if profiler is not None:
+        profiler.record('wound', start, dice=num_dice)
+    return num_wounds, num_crit_wounds, hazardous_damage
+
+
+def batch_save_roll(
+        weapon: 'Weapon', engagement: 'Engagement', num_wounds: NDArray[np.integer],
+        num_crit_wounds: NDArray[np.integer], defender_state: UnitState, rng: np.random.Generator
+) -> NDArray[np.integer]:
+    # Saves are taken by the current allocation target of each trial, a leader for precision attacks
+    profiler = phase_profiler.active
+    start = perf_counter() if profiler is not None else 0.0
+    wounds_taken = np.zeros(len(num_wounds), dtype=int)
+    if weapon.profile.devastating_wounds: # crit wounds are mortal wounds, no save allowed
+        if profiler is not None:
+            profiler.count('devastating_wounds', (num_wounds > 0).sum())
+        wounds_taken += num_crit_wounds
+        num_wounds = num_wounds - num_crit_wounds
+
+    requirement = np.array([
+        find_save_roll_requirement(
+            save, invulnerable_save, weapon.armor_piercing, benefits_from_cover(save, weapon, engagement)
+        ) for save, invulnerable_save in zip(defender_state.save, defender_state.invulnerable_save)
+    ])[defender_state.allocation_targets(weapon.profile.precision)][:, None]
+    save_stream = dice_stream(rng, 'save')
+    rolls = roll_batch(save_stream, len(num_wounds), num_wounds.max(initial=0), boundary=requirement)
+    in_play = dice_mask(num_wounds, rolls.shape[1])
+    weigh_dice(save_stream, in_play)
+    wounds_taken += (in_play & ((rolls == 1) | (rolls < requirement))).sum(axis=1)
+    tracer = trace_recorder.active
+    if tracer is not None and tracer.recording:
+        tracer.record_rows(
+            'save', weapon=weapon.name, rolls=np.where(in_play, rolls, 0), requirement=requirement[:, 0],
+            wounds_taken=wounds_taken
+        )
+    if profiler is not None:
+        profiler.record('save', start, dice=num_wounds.sum())
+    return wounds_taken
+
+
+def batch_shooting_round(
+        attacker: 'Unit', engagement: 'Engagement', num_trials: int,
+        rng: 'np.random.Generator | CommonRandomNumbers | None' = None,
+        attacker_state: UnitState | None = None,
+        defender_state: UnitState | None = None
+) -> BatchResult:
+    """Simulate num_trials independent shooting rounds of attacker vs engagement.opponent"""
+    # rng can be a CommonRandomNumbers to replay the same dice for several variants, see wh_compare.
+    # attacker_state/defender_state carry casualties over from earlier phases, as in batch_fight_round: only the
+    # attacker's models still alive in a trial shoot. defender_state is updated in place
+    rng = rng if rng is not None else np.random.default_rng()
+    tracer = trace_recorder.active
+    if tracer is not None:
+        tracer.start_batch(num_trials)
+    if defender_state is None:
+        defender_state = UnitState.from_unit(engagement.opponent, num_trials)
+    initial_wounds = defender_state.total_wounds
+    initial_models = defender_state.models_remaining
+    if defender_state.current_wounds.shape[1] == 0:
+        return no_attacks(defender_state)
+
+    # All models shoot first against the starting state of the defender, then each weapon's wounds get resolved
+    weapon_groups = group_weapon_columns(attacker, engagement)
+    wound_rolls = {}
+    for weapon_name, (weapon, columns) in weapon_groups.items():
+        num_models = len(columns) if attacker_state is None else attacker_state.alive[:, columns].sum(axis=1)
+        logger.debug(f'Rolling {num_trials} trials for {len(columns)}x {weapon_name}')
+        wound_rolls[weapon_name] = batch_wound_roll(weapon, num_models, attacker, engagement, defender_state, rng)
+
+    total_wounds = np.zeros(num_trials, dtype=int)
+    total_unsaved = np.zeros(num_trials, dtype=int)
+    hazardous_damage = np.zeros(num_trials, dtype=int)
+    for weapon_name, (weapon, _) in weapon_groups.items():
+        num_wounds, num_crit_wounds, hazardous = wound_rolls[weapon_name]
+        unsaved = batch_save_roll(weapon, engagement, num_wounds, num_crit_wounds, defender_state, rng)
+        melta_bonus = weapon.profile.melta if engagement.distance <= weapon.weapon_range / 2 else 0
+        defender_state.allocate_wounds(unsaved, weapon.damage, rng, melta_bonus, weapon.profile.precision)
+        if tracer is not None and tracer.recording:
+            tracer.record_rows(
+                'allocation', damage_per_wound=str(weapon.damage), bonus_damage=melta_bonus,
+                remaining_wounds=defender_state.current_wounds
+            )
+        total_wounds += num_wounds
+        total_unsaved += unsaved
+        hazardous_damage += hazardous
+
+    return BatchResult(
+        wounds=total_wounds,
+        unsaved_wounds=total_unsaved,
+        damage=initial_wounds - defender_state.total_wounds,
+        models_slain=initial_models - defender_state.models_remaining,
+        remaining_wounds=defender_state.current_wounds,
+        hazardous_damage=hazardous_damage
+    )
@@ -0,0 +1,365 @@
+# Batched battles - two sides of several units each play a number of battle rounds, thousands of battles in
+# lockstep. Every phase runs for all battles at once: battles where a unit faces the same situation (target, distance
+# band, last action, who is locked in combat) are grouped, and each group goes through the batch dice kernels in one
+# call. Python loops over units and situations, never over battles. The battlefield is a line, each side starts at
+# one end and moves towards the other, and the distance between two units is the gap between their positions
+import argparse
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from utility_functions import roll_batch, dice_stream, weigh_dice
+from Dice import DiceExpression
+from UnitState import UnitState
+from Engagement import Engagement, LastAction
+from wh_batch_sim import BatchResult, batch_shooting_round
+from wh_fight_sim import batch_fight_round, melee_engagement, select_melee_weapon
+from wh_exact_sim import exact_shooting_round
+from wh_sweep import distance_breakpoints, plan_distances
+import weapon_selection
+from warhammer.datasheets.unit_collection import unit_collection
+import logging
+logger = logging.getLogger(__name__)
+from typing import List, Sequence, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+
+ACTIONS = (None, *LastAction) # last actions are kept per battle as indices into this
+CHARGE_RANGE = 12
+DIRECTIONS = (1, -1)          # side 0 starts at 0 and moves up, side 1 starts at the far end and moves down
+MORTAL_WOUND = DiceExpression(modifier=1)
+
+
+@dataclass
+class BattleResult:
+    sides: Tuple[List[str], List[str]]
+    winner: NDArray[np.integer]          # per battle the side left standing, -1 when both or neither are
+    battle_rounds: NDArray[np.integer]   # rounds played, fewer than asked when a side was wiped out early
+    remaining_wounds: Tuple[List[NDArray[np.integer]], List[NDArray[np.integer]]] # per side and unit, battles x models
+
+    @property
+    def num_battles(self) -> int:
+        return len(self.winner)
+
+    def win_probability(self, side: int) -> float:
+        return float((self.winner == side).mean())
+
+    @property
+    def draw_probability(self) -> float:
+        return float((self.winner == -1).mean())
+
+    def survival_probability(self, side: int, unit: int) -> float:
+        return float((self.remaining_wounds[side][unit].sum(axis=1) > 0).mean())
+
+
+class Battle:
+    # The state of num_battles battles, one row per battle in every array. Unit objects are only templates for the
+    # kernels: their own spawned copies of the sides, never changed after setup. The situation of the group being
+    # resolved (last action, in combat or not) goes on fresh copies made for that group, see situation
+    def __init__(
+            self, sides: Tuple[Sequence['Unit'], Sequence['Unit']], num_battles: int, distance: int,
+            in_cover: bool = False, rng: np.random.Generator | None = None
+    ):
+        if not sides[0] or not sides[1]:
+            raise ValueError('Each side needs at least one unit')
+        self.units = tuple([unit.spawn() for unit in side] for side in sides)
+        self.num_battles = num_battles
+        self.max_distance = distance
+        self.in_cover = in_cover
+        self.rng = rng if rng is not None else np.random.default_rng()
+        self.states = tuple([UnitState.from_unit(unit, num_battles) for unit in side] for side in self.units)
+        self.positions = (
+            np.zeros((num_battles, len(self.units[0])), dtype=int),
+            np.full((num_battles, len(self.units[1])), distance, dtype=int)
+        )
+        self.last_action = tuple(np.zeros((num_battles, len(side)), dtype=int) for side in self.units)
+        self.charged = tuple(np.zeros((num_battles, len(side)), dtype=bool) for side in self.units) # this turn
+        # locked[b, i, j]: in battle b, unit i of side 0 and unit j of side 1 are locked in combat
+        self.locked = np.zeros((num_battles, len(self.units[0]), len(self.units[1])), dtype=bool)
+        self.movement = tuple(np.array([min(model.movement for model in unit.models) for unit in side]) for side in self.units)
+        self.breakpoints = tuple([distance_breakpoints(unit) for unit in side] for side in self.units)
+        self.big = tuple(np.array([
+            bool({'monster', 'vehicle'} & unit.get_all_models_keywords()) for unit in side
+        ]) for side in self.units)
+        self.shooting_value = tuple(self.expected_shooting(side) for side in (0, 1))
+        self.melee_value = tuple(self.expected_melee(side) for side in (0, 1))
+
+    def expected_shooting(self, side: int) -> NDArray[np.floating]:
+        # [unit, enemy, distance] exact expected damage of a shooting round against a fresh enemy, evaluated once
+        # per breakpoint interval of the unit's weapons. Drives target selection, so no dice are involved
+        values = np.zeros((len(self.units[side]), len(self.units[1 - side]), self.max_distance + 1))
+        distances = list(range(1, self.max_distance + 1))
+        cache = {}
+        for i, unit in enumerate(self.units[side]):
+            plan = plan_distances(unit, distances)
+            for j, enemy in enumerate(self.units[1 - side]):
+                for distance, indices in plan:
+                    engagement = Engagement(distance=distance, line_of_sight=True, in_cover=self.in_cover, opponent=enemy)
+                    values[i, j, np.array(indices) + 1] = exact_shooting_round(unit, engagement, cache).expected_damage
+        return values
+
+    def expected_melee(self, side: int) -> NDArray[np.floating]:
+        # [unit, enemy] expected damage of every model fighting with its best melee weapon, from the lookup table
+        values = np.zeros((len(self.units[side]), len(self.units[1 - side])))
+        for i, unit in enumerate(self.units[side]):
+            for j, enemy in enumerate(self.units[1 - side]):
+                engagement = melee_engagement(Engagement(distance=1, line_of_sight=True, in_cover=False, opponent=enemy))
+                for model in unit.models:
+                    weapon = select_melee_weapon(model, unit, engagement)
+                    if weapon is not None:
+                        values[i, j] += weapon_selection.table.lookup(
+                            weapon, unit, engagement, enemy.target(weapon.profile.precision)
+                        )
+        return values
+
+    def alive(self, side: int) -> NDArray[np.bool_]:
+        return np.stack([state.unit_alive for state in self.states[side]], axis=1)
+
+    def ongoing(self) -> NDArray[np.bool_]:
+        return self.alive(0).any(axis=1) & self.alive(1).any(axis=1)
+
+    def locked_with(self, side: int) -> NDArray[np.bool_]:
+        # [battle, unit of side, unit of the other side]
+        return self.locked if side == 0 else self.locked.transpose(0, 2, 1)
+
+    def distances(self, side: int) -> NDArray[np.integer]:
+        gaps = np.abs(self.positions[side][:, :, None] - self.positions[1 - side][:, None, :])
+        return np.clip(gaps, 1, self.max_distance)
+
+    def shooting_options(self, side: int) -> NDArray[np.floating]:
+        # [battle, unit, enemy] expected damage of shooting that enemy from where the unit is now. Enemies that are
+        # dead, or locked in combat with this side and too small to shoot into it, are worth nothing
+        other = 1 - side
+        distances = self.distances(side)
+        enemies = np.arange(len(self.units[other]))
+        options = np.stack([
+            self.shooting_value[side][unit][enemies, distances[:, unit]] for unit in range(len(self.units[side]))
+        ], axis=1)
+        targetable = self.alive(other) & (~self.locked_with(other).any(axis=2) | self.big[other])
+        return np.where(targetable[:, None, :], options, 0.0)
+
+    def release_dead(self):
+        self.locked &= self.alive(0)[:, :, None] & self.alive(1)[:, None, :]
+
+    def take_mortal_wounds(
+            self, side: int, unit: int, rows: NDArray[np.integer], state: UnitState, mortal_wounds: NDArray[np.integer]
+    ):
+        # Hazardous weapons hurt their own wielders
+        if mortal_wounds.any():
+            state.allocate_wounds(mortal_wounds, MORTAL_WOUND, self.rng)
+        self.states[side][unit].merge(rows, state)
+
+    def turn(self, side: int):
+        ongoing = self.ongoing()
+        for charged in self.charged: # only the side whose turn it is can have charged, the other fights back
+            charged[:] = False
+        self.movement_phase(side, ongoing)
+        self.shooting_phase(side, ongoing)
+        self.charge_phase(side, ongoing)
+        self.fight_phase(side)
+
+    def movement_phase(self, side: int, ongoing: NDArray[np.bool_]):
+        # Units out of combat move towards the enemy, unless they already have something to shoot and would rather
+        # shoot than fight, then they remain stationary. A move ends 1" short of the nearest enemy, getting into
+        # combat takes a charge
+        other = 1 - side
+        alive, enemy_alive = self.alive(side), self.alive(other)
+        engaged = self.locked_with(side).any(axis=2)
+        best_shot = self.shooting_options(side).max(axis=2)
+        best_melee = np.where(enemy_alive[:, None, :], self.melee_value[side][None], 0.0).max(axis=2)
+        moving = alive & ~engaged & ongoing[:, None] & ((best_shot == 0) | (best_melee > best_shot))
+
+        direction = DIRECTIONS[side]
+        far = 2 * self.max_distance + 1
+        if direction > 0:
+            nearest = np.where(enemy_alive, self.positions[other], far).min(axis=1)[:, None]
+            destination = np.minimum(self.positions[side] + self.movement[side], np.maximum(nearest - 1, self.positions[side]))
+        else:
+            nearest = np.where(enemy_alive, self.positions[other], -far).max(axis=1)[:, None]
+            destination = np.maximum(self.positions[side] - self.movement[side], np.minimum(nearest + 1, self.positions[side]))
+        self.positions[side][:] = np.where(moving, destination, self.positions[side])
+        self.last_action[side][:] = np.where(
+            moving, ACTIONS.index(LastAction.moved), ACTIONS.index(LastAction.remained_stationary)
+        )
+
+    def shooting_phase(self, side: int, ongoing: NDArray[np.bool_]):
+        # Each unit shoots the enemy it expects to do the most damage to. A unit in combat can only shoot the enemy
+        # it's fighting, which only pistols, monsters and vehicles can do
+        other = 1 - side
+        distances = self.distances(side)
+        engaged = self.locked_with(side).any(axis=2)
+        for unit in range(len(self.units[side])):
+            enemy_alive = self.alive(other)
+            locked = self.locked_with(side)[:, unit] & enemy_alive
+            options = self.shooting_options(side)[:, unit]
+            target = np.where(engaged[:, unit], locked.argmax(axis=1), options.argmax(axis=1))
+            shooting = ongoing & self.alive(side)[:, unit] & np.where(
+                engaged[:, unit], locked.any(axis=1), options.max(axis=1) > 0
+            )
+            rows = np.flatnonzero(shooting)
+            if not len(rows):
+                continue
+            targets = target[rows]
+            situations, group = np.unique(np.stack([
+                targets,
+                np.searchsorted(self.breakpoints[side][unit], distances[rows, unit, targets]), # same band, same result
+                self.last_action[side][rows, unit],
+                engaged[rows, unit],
+                self.locked_with(other)[rows, targets].any(axis=1)
+            ], axis=1), axis=0, return_inverse=True)
+            for situation, (target_index, _, action, in_combat, target_in_combat) in enumerate(situations):
+                group_rows = rows[group.reshape(-1) == situation]
+                # Eligibility only asks whether the target is in combat, not with whom
+                attacker, defender = self.situation(side, unit, target_index, ACTIONS[action], in_combat, target_in_combat)
+                engagement = Engagement(
+                    distance=int(distances[group_rows[0], unit, target_index]), line_of_sight=True,
+                    in_cover=self.in_cover, opponent=defender
+                )
+                self.resolve(
+                    batch_shooting_round, side, unit, target_index, group_rows, attacker, engagement
+                )
+            logger.debug(f'Side {side} unit {unit} shot in {len(rows)} battles, {len(situations)} situations')
+
+    def charge_phase(self, side: int, ongoing: NDArray[np.bool_]):
+        # Units out of combat that would rather fight than shoot charge the enemy within 12" they'd do the most damage
+        # to in combat. The charge is made on 2D6 >= distance, as in utility_functions.charge without re-rolls
+        other = 1 - side
+        distances = self.distances(side)
+        engaged = self.locked_with(side).any(axis=2)
+        best_shot = self.shooting_options(side).max(axis=2)
+        in_reach = self.alive(other)[:, None, :] & (distances <= CHARGE_RANGE)
+        melee = np.where(in_reach, self.melee_value[side][None], 0.0)
+        charging = self.alive(side) & ~engaged & ongoing[:, None] & (melee.max(axis=2) > best_shot)
+        rows, units = np.nonzero(charging)
+        if not len(rows):
+            return
+        targets = melee[rows, units].argmax(axis=1)
+        charge_stream = dice_stream(self.rng, 'charge')
+        rolls = roll_batch(charge_stream, len(rows), 2)
+        weigh_dice(charge_stream, np.ones(rolls.shape, dtype=bool))
+        made = rolls.sum(axis=1) >= distances[rows, units, targets]
+        rows, units, targets = rows[made], units[made], targets[made]
+        if side == 0:
+            self.locked[rows, units, targets] = True
+        else:
+            self.locked[rows, targets, units] = True
+        self.positions[side][rows, units] = self.positions[other][rows, targets] - DIRECTIONS[side]
+        self.last_action[side][rows, units] = ACTIONS.index(LastAction.charged)
+        self.charged[side][rows, units] = True
+        logger.debug(f'Side {side} made {made.sum()} of {len(made)} charges')
+
+    def fight_phase(self, side: int):
+        # Units that charged this turn fight first, then the other side, then the rest of this side
+        self.fight(side, self.charged[side])
+        self.fight(1 - side, np.ones_like(self.charged[1 - side]))
+        self.fight(side, ~self.charged[side])
+
+    def fight(self, side: int, eligible: NDArray[np.bool_]):
+        # Each unit fights the first enemy it is locked in combat with
+        other = 1 - side
+        self.release_dead()
+        for unit in range(len(self.units[side])):
+            locked = self.locked_with(side)[:, unit] & self.alive(other)
+            rows = np.flatnonzero(eligible[:, unit] & self.alive(side)[:, unit] & locked.any(axis=1))
+            if not len(rows):
+                continue
+            situations, group = np.unique(
+                np.stack([locked[rows].argmax(axis=1), self.charged[side][rows, unit]], axis=1), axis=0,
+                return_inverse=True
+            )
+            for situation, (target_index, has_charged) in enumerate(situations):
+                group_rows = rows[group.reshape(-1) == situation]
+                attacker, defender = self.situation(
+                    side, unit, target_index, LastAction.charged if has_charged else LastAction.remained_stationary,
+                    True, True
+                )
+                engagement = Engagement(distance=1, line_of_sight=True, in_cover=False, opponent=defender)
+                self.resolve(batch_fight_round, side, unit, target_index, group_rows, attacker, engagement)
+        self.release_dead()
+
+    def situation(
+            self, side: int, unit: int, target: int, last_action: LastAction | None, engaged: bool, target_engaged: bool
+    ) -> Tuple['Unit', 'Unit']:
+        # Fresh copies of a unit and its target, set up as in the group being resolved. Wounds live in the states,
+        # so full strength copies are all the kernels need
+        attacker, defender = self.units[side][unit].spawn(), self.units[1 - side][target].spawn()
+        attacker.last_action = last_action
+        attacker.in_melee_with = [defender] if engaged else []
+        defender.in_melee_with = [attacker] if target_engaged else []
+        return attacker, defender
+
+    def resolve(
+            self, round_function, side: int, unit: int, target: int, rows: NDArray[np.integer], attacker: 'Unit',
+            engagement: Engagement
+    ) -> BatchResult:
+        # One batch kernel call for the battles in rows, with both units' wounds carried in and written back
+        attacker_state = self.states[side][unit].subset(rows)
+        defender_state = self.states[1 - side][target].subset(rows)
+        result = round_function(
+            attacker, engagement, len(rows), self.rng, attacker_state=attacker_state, defender_state=defender_state
+        )
+        self.states[1 - side][target].merge(rows, defender_state)
+        self.take_mortal_wounds(side, unit, rows, attacker_state, result.hazardous_damage)
+        return result
+
+    def result(self, battle_rounds: NDArray[np.integer]) -> BattleResult:
+        standing = [self.alive(side).any(axis=1) for side in (0, 1)]
+        return BattleResult(
+            sides=tuple([unit.name for unit in side] for side in self.units),
+            winner=np.where(standing[0] & ~standing[1], 0, np.where(standing[1] & ~standing[0], 1, -1)),
+            battle_rounds=battle_rounds,
+            remaining_wounds=tuple([state.current_wounds for state in side] for side in self.states)
+        )
+
+
+def simulate_battles(
+        side_a: Sequence['Unit'],
+        side_b: Sequence['Unit'],
+        num_battles: int,
+        distance: int = 24,
+        battle_rounds: int = 5,
+        in_cover: bool = False,
+        first: int = 0,
+        rng: np.random.Generator | None = None
+) -> BattleResult:
+    """Play num_battles battles of side_a vs side_b in lockstep, the side first going first in every battle round"""
+    if num_battles < 1:
+        raise ValueError('Need at least one battle to play')
+    battle = Battle((side_a, side_b), num_battles, distance, in_cover, rng)
+    rounds_played = np.zeros(num_battles, dtype=int)
+    for battle_round in range(battle_rounds):
+        ongoing = battle.ongoing()
+        if not ongoing.any():
+            break
+        rounds_played += ongoing
+        for side in (first, 1 - first):
+            battle.turn(side)
+        logger.debug(f'Battle round {battle_round + 1}: {battle.ongoing().sum()} of {num_battles} battles still going')
+    return battle.result(rounds_played)
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description='Play many battles between two sides at once.')
+    parser.add_argument('--side-a', nargs='+', default=['allarus_custodians'], help='unit_collection entries')
+    parser.add_argument('--side-b', nargs='+', default=['ctan_shard_of_the_nightbringer'], help='unit_collection entries')
+    parser.add_argument('--battles', type=int, default=10_000)
+    parser.add_argument('--distance', type=int, default=24)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--in-cover', action='store_true')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    result = simulate_battles(
+        [unit_collection[name] for name in args.side_a], [unit_collection[name] for name in args.side_b],
+        args.battles, args.distance, args.rounds, args.in_cover, rng=np.random.default_rng(args.seed)
+    )
+    print(
+        f'{args.battles} battles: side A wins {result.win_probability(0):.1%}, side B wins {result.win_probability(1):.1%}, '
+        f'neither {result.draw_probability:.1%}, {result.battle_rounds.mean():.2f} battle rounds on average'
+    )
+    for side, names in enumerate(result.sides):
+        for unit, name in enumerate(names):
+            print(f'  side {"AB"[side]} {name} survives {result.survival_probability(side, unit):.1%}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,193 @@
+# Paired A/B comparison of datasheet variants with common random numbers. Every variant is run against the same
+# dice, so trial t of the baseline and trial t of a variant only differ by what the change itself does, and the
+# confidence interval on the difference is much narrower than the one from two independent runs of the same size
+import argparse
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+import utility_functions
+from utility_functions import CommonRandomNumbers
+from accumulators import RunningStats, QuantileSketch
+from Weapon import Weapon
+from Engagement import Engagement
+from wh_batch_sim import BatchResult, batch_shooting_round
+from wh_parallel_sim import shard_sizes
+from warhammer.datasheets.unit_collection import unit_collection
+from warhammer.datasheets.weapon_collection import weapon_collection
+import logging
+logger = logging.getLogger(__name__)
+from typing import Callable, Dict, List, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+
+METRICS = ('damage', 'models_slain', 'killed')
+
+
+@dataclass
+class VariantComparison:
+    name: str
+    baseline: str
+    value: Dict[str, RunningStats]          # per metric, the variant's own outcomes
+    baseline_value: Dict[str, RunningStats]
+    difference: Dict[str, RunningStats]     # per metric, variant minus baseline trial by trial
+    damage_difference: QuantileSketch       # spread of the per trial damage difference, e.g. how often it's worse
+
+    @property
+    def num_trials(self) -> int:
+        return self.difference['damage'].count
+
+    def confidence_interval(self, metric: str='damage', confidence: float=0.95) -> tuple[float, float]:
+        return self.difference[metric].confidence_interval(confidence)
+
+    def variance_reduction(self, metric: str='damage') -> float:
+        # How many times more trials two independent runs would need for the same interval on the difference
+        paired = self.difference[metric].variance
+        independent = self.value[metric].variance + self.baseline_value[metric].variance
+        return independent / paired if paired else float('inf')
+
+
+def outcomes(result: BatchResult) -> Dict[str, NDArray[np.number]]:
+    return {
+        'damage': result.damage,
+        'models_slain': result.models_slain,
+        'killed': (result.remaining_wounds.sum(axis=1) == 0).astype(float)
+    }
+
+
+def compare_variants(
+        variants: Dict[str, 'Unit'],
+        engagement: Engagement,
+        num_trials: int,
+        seed: int | None = None,
+        baseline: str | None = None,
+        engagements: Dict[str, Engagement] | None = None,
+        shard_size: int = 10_000,
+        round_function: Callable[..., BatchResult] = batch_shooting_round
+) -> Dict[str, VariantComparison]:
+    """Run every attacker variant on the same dice and compare each one with the baseline, trial by trial"""
+    # baseline defaults to the first variant. engagements can override the engagement of single variants, e.g. the
+    # target in cover or a different defender. round_function is batch_shooting_round or batch_fight_round
+    if not variants:
+        raise ValueError('Need at least one variant to compare')
+    if num_trials < 1:
+        raise ValueError('Need at least one trial to run')
+    baseline = baseline if baseline is not None else next(iter(variants))
+    if baseline not in variants:
+        raise ValueError(f'Baseline {baseline!r} is not one of the variants')
+    engagements = engagements or {}
+    value = {name: {metric: RunningStats() for metric in METRICS} for name in variants}
+    difference = {name: {metric: RunningStats() for metric in METRICS} for name in variants if name != baseline}
+    sketches = {name: QuantileSketch() for name in difference}
+
+    # Shards keep memory flat, each shard gets its own common random numbers spawned from the seed
+    sizes = shard_sizes(num_trials, shard_size)
+    for size, seed_sequence in zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))):
+        common = CommonRandomNumbers(seed_sequence)
+        shard_outcomes = {}
+        # Anything still calling roll() stays seeded, with the caller's generator back after the shard
+        with utility_functions.seeded_rng(np.random.default_rng(seed_sequence)):
+            for name, attacker in variants.items():
+                common.restart()
+                shard_outcomes[name] = outcomes(round_function(attacker, engagements.get(name, engagement), size, common))
+        for name in variants:
+            for metric in METRICS:
+                value[name][metric].update(shard_outcomes[name][metric])
+        for name in difference:
+            for metric in METRICS:
+                difference[name][metric].update(shard_outcomes[name][metric] - shard_outcomes[baseline][metric])
+            sketches[name].update(shard_outcomes[name]['damage'] - shard_outcomes[baseline]['damage'])
+        logger.debug(f'Compared {len(variants)} variants over {size} trials')
+
+    return {
+        name: VariantComparison(name, baseline, value[name], value[baseline], difference[name], sketches[name])
+        for name in difference
+    }
+
+
+def weapon_variant(weapon: Weapon, **changes) -> Weapon:
+    """Copy of weapon with some characteristics changed, e.g. weapon_variant(weapon, ballistic_skill=3)"""
+    characteristics = {
+        'name': weapon.name,
+        'weapon_range': weapon.weapon_range,
+        'attacks': weapon.attacks,
+        'ballistic_skill': weapon.ballistic_skill,
+        'strength': weapon.strength,
+        'armor_piercing': weapon.armor_piercing,
+        'damage': weapon.damage,
+        'keywords': set(weapon.keywords)
+    }
+    unknown = set(changes) - set(characteristics)
+    if unknown:
+        raise ValueError(f'Unknown weapon characteristics: {", ".join(sorted(unknown))}')
+    return Weapon(**{**characteristics, **changes})
+
+
+def unit_variant(unit: 'Unit', weapon_name: str, replacement: Weapon) -> 'Unit':
+    """Fresh copy of unit with weapon_name swapped for replacement on every model carrying it"""
+    variant = unit.spawn()
+    found = False
+    for model in variant.starting_models:
+        # Copies share their weapon dicts with the datasheet model, so the swap goes into new dicts
+        for attribute in ('ranged_weapons', 'melee_weapons'):
+            weapons = getattr(model, attribute)
+            if weapon_name in weapons:
+                found = True
+                setattr(model, attribute, {
+                    replacement.name if name == weapon_name else name: replacement if name == weapon_name else weapon
+                    for name, weapon in weapons.items()
+                })
+    if not found:
+        raise ValueError(f'No model in {unit.name} carries {weapon_name}')
+    return variant
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description='Compare variants of an attacker against the same dice.')
+    parser.add_argument('--attacker', default='ctan_shard_of_the_nightbringer', help='unit_collection entry')
+    parser.add_argument('--defender', default='allarus_custodians', help='unit_collection entry')
+    parser.add_argument('--weapon', help='weapon to vary, defaults to the first ranged weapon of the first model')
+    parser.add_argument('--ballistic-skill', nargs='*', type=int, default=[])
+    parser.add_argument('--armor-piercing', nargs='*', type=int, default=[])
+    parser.add_argument('--add-keyword', nargs='*', default=[], help='e.g. twin-linked lethal_hits sustained_hits_1')
+    parser.add_argument('--wargear', nargs='*', default=[], help='weapon_collection entries to swap in')
+    parser.add_argument('--distance', type=int, default=7)
+    parser.add_argument('--in-cover', action='store_true')
+    parser.add_argument('--trials', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    attacker = unit_collection[args.attacker]
+    weapons = {
+        name: weapon for model in attacker.starting_models
+        for name, weapon in {**model.ranged_weapons, **model.melee_weapons}.items()
+    }
+    weapon_name = args.weapon or next(iter(attacker.starting_models[0].ranged_weapons))
+    weapon = weapons[weapon_name]
+    variants = {'baseline': attacker.spawn()}
+    for ballistic_skill in args.ballistic_skill:
+        variants[f'BS {ballistic_skill}+'] = unit_variant(attacker, weapon_name, weapon_variant(weapon, ballistic_skill=ballistic_skill))
+    for armor_piercing in args.armor_piercing:
+        variants[f'AP {armor_piercing}'] = unit_variant(attacker, weapon_name, weapon_variant(weapon, armor_piercing=armor_piercing))
+    for keyword in args.add_keyword:
+        variants[f'+{keyword}'] = unit_variant(attacker, weapon_name, weapon_variant(weapon, keywords=set(weapon.keywords) | {keyword}))
+    for wargear in args.wargear:
+        variants[wargear] = unit_variant(attacker, weapon_name, weapon_collection[wargear])
+
+    engagement = Engagement(
+        distance=args.distance, line_of_sight=True, in_cover=args.in_cover, opponent=unit_collection[args.defender].spawn()
+    )
+    comparisons = compare_variants(variants, engagement, args.trials, seed=args.seed)
+    print(f'{args.attacker} ({weapon_name}) vs {args.defender}, {args.trials} paired trials')
+    for name, comparison in comparisons.items():
+        low, high = comparison.confidence_interval('damage')
+        kill_low, kill_high = comparison.confidence_interval('killed')
+        print(
+            f'{name:<20} damage {comparison.value["damage"].mean:.3f} '
+            f'({comparison.difference["damage"].mean:+.3f}, 95% CI {low:+.3f} to {high:+.3f}), '
+            f'kill probability {comparison.difference["killed"].mean:+.3f} ({kill_low:+.3f} to {kill_high:+.3f}), '
+            f'{comparison.variance_reduction("damage"):.1f}x fewer trials than independent runs'
+        )
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,341 @@
+# Exact engine - instead of sampling, every die is described by the probability of each of its outcomes and the
+# per-die distributions are convolved into the full distribution of wounds, damage and models slain
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from utility_functions import find_wound_roll_requirement, find_save_roll_requirement, benefits_from_cover
+from wh_batch_sim import group_weapons
+from phase_profiler import timed
+import logging
+logger = logging.getLogger(__name__)
+from typing import Any, Callable, Dict, List, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Weapon import Weapon
+    from Model import Model
+    from Unit import Unit
+    from Engagement import Engagement
+
+FACES = np.arange(1, 7)
+FAIR_DIE = np.full(6, 1 / 6)
+
+
+@dataclass
+class ExactResult:
+    wounds: NDArray[np.floating]         # pmf of successful wound rolls
+    damage: NDArray[np.floating]         # pmf of wounds lost by the defender (after FNP, no overkill)
+    models_slain: NDArray[np.floating]   # pmf of defending models killed
+
+    @staticmethod
+    def mean(pmf: NDArray[np.floating]) -> float:
+        return float(np.arange(len(pmf)) @ pmf)
+
+    @property
+    def expected_damage(self) -> float:
+        return self.mean(self.damage)
+
+    @property
+    def expected_models_slain(self) -> float:
+        return self.mean(self.models_slain)
+
+    @property
+    def kill_probability(self) -> float:
+        return float(self.models_slain[-1])
+
+
+def convolve_power(pmf: NDArray[np.floating], n: int) -> NDArray[np.floating]:
+    # Distribution of the sum of n independent draws from pmf, by repeated squaring
+    result = np.array([1.0])
+    while n:
+        if n & 1:
+            result = np.convolve(result, pmf)
+        pmf = np.convolve(pmf, pmf)
+        n >>= 1
+    return result
+
+
+def shift(pmf: NDArray[np.floating], offset: int) -> NDArray[np.floating]:
+    return np.concatenate([np.zeros(offset), pmf])
+
+
+def binomial(n: int, p: float) -> NDArray[np.floating]:
+    return convolve_power(np.array([1 - p, p]), n)
+
+
+def compound(count_pmf: NDArray[np.floating], per_item_pmf: NDArray[np.floating]) -> NDArray[np.floating]:
+    # Sum over n of P(count = n) * per_item_pmf convolved n times
+    result = np.zeros(1)
+    power = np.array([1.0])
+    for probability in count_pmf:
+        if probability > 0:
+            result = add(result, probability * power)
+        power = np.convolve(power, per_item_pmf)
+    return result
+
+
+def add(first: NDArray[np.floating], second: NDArray[np.floating]) -> NDArray[np.floating]:
+    size = max(len(first), len(second))
+    return np.pad(first, (0, size - len(first))) + np.pad(second, (0, size - len(second)))
+
+
+@timed('hit')
+def hit_probabilities(weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement') -> tuple[float, float]:
+    # (normal hit, critical hit) probabilities of a single attack, as in Weapon.hit_roll
+    if weapon.profile.torrent:
+        return 1.0, 0.0
+    modified = FACES.copy()
+    eligible = (FACES > 1) & (FACES < 6)
+    if not engagement.line_of_sight:
+        eligible &= FACES > 3
+        modified -= 1
+    if weapon.profile.heavy and attacker.last_action == 'remained_stationary':
+        modified += 1
+    return FAIR_DIE[eligible & (modified >= weapon.ballistic_skill)].sum(), FAIR_DIE[5]
+
+
+@timed('wound')
+def wound_probabilities(weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement', target: 'Model') -> tuple[float, float]:
+    # (normal wound, critical wound) probabilities of a single wound roll, as in Weapon.wound_roll
+    requirement = find_wound_roll_requirement(weapon.strength, target.toughness)
+    faces = FAIR_DIE.copy()
+    if weapon.profile.twin_linked: # failed rolls get re-rolled once
+        failed = FACES < requirement
+        faces = np.where(failed, 0, faces) + faces[failed].sum() * FAIR_DIE
+
+    crit_boundary = weapon.profile.crit_wound_boundary(engagement.opponent.get_all_models_keywords())
+    crits = FACES >= crit_boundary
+    modified = FACES + int(weapon.profile.lance and attacker.last_action == 'charged')
+    normal = (FACES > 1) & ~crits & (modified >= requirement)
+    return faces[normal].sum(), faces[crits].sum()
+
+
+@timed('save')
+def failed_save_probability(weapon: 'Weapon', engagement: 'Engagement', target: 'Model') -> float:
+    requirement = find_save_roll_requirement(
+        target.save, target.invulnerable_save, weapon.armor_piercing, benefits_from_cover(target.save, weapon, engagement)
+    )
+    return FAIR_DIE[(FACES == 1) | (FACES < requirement)].sum()
+
+
+@timed('attacks')
+def attack_count_pmf(weapon: 'Weapon', num_models: int, engagement: 'Engagement') -> NDArray[np.floating]:
+    pmf = weapon.attacks.pmf(num_models)
+    extra_attacks = 0
+    if engagement.distance <= weapon.weapon_range / 2:
+        extra_attacks += weapon.profile.rapid_fire
+    if weapon.profile.blast:
+        extra_attacks += len(engagement.opponent.models) // 5
+    return shift(pmf, num_models * extra_attacks)
+
+
+def successes_per_attack(
+        weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement', per_wound_roll: float, per_lethal_hit: float
+) -> NDArray[np.floating]:
+    # pmf of the successes a single attack produces, when every wound roll succeeds with per_wound_roll and every
+    # lethal hit (auto wound) with per_lethal_hit. Crit hits also bring their sustained hits along
+    normal_hit, crit_hit = hit_probabilities(weapon, attacker, engagement)
+    extra_hits = weapon.profile.sustained_hits
+    if weapon.profile.lethal_hits:
+        crit_outcome = np.convolve(binomial(1, per_lethal_hit), binomial(extra_hits, per_wound_roll))
+    else:
+        crit_outcome = binomial(1 + extra_hits, per_wound_roll)
+    pmf = add(np.array([1 - normal_hit - crit_hit]), normal_hit * binomial(1, per_wound_roll))
+    return add(pmf, crit_hit * crit_outcome)
+
+
+@timed('damage')
+def damage_per_wound_pmf(weapon: 'Weapon', engagement: 'Engagement', target: 'Model') -> NDArray[np.floating]:
+    # Damage rolled per unsaved wound, plus melta, then every point of it runs through feel no pain
+    pmf = weapon.damage.pmf()
+    if engagement.distance <= weapon.weapon_range / 2:
+        pmf = shift(pmf, weapon.profile.melta)
+    if not target.profile.feel_no_pain:
+        return pmf
+    damage_sticks = FAIR_DIE[FACES < target.profile.feel_no_pain].sum()
+    return compound(pmf, np.array([1 - damage_sticks, damage_sticks]))
+
+
+def wound_target(state_cell: Tuple[int, int], groups: Tuple[List['Model'], List['Model']], precision: bool) -> int:
+    # Which group the next wound goes to with b bodyguards and l leaders slain: 0 the bodyguard while any of it is
+    # left, 1 the leaders, who come first for precision attacks. -1 when the unit is wiped out
+    slain_bodyguards, slain_leaders = state_cell
+    bodyguards_left, leaders_left = slain_bodyguards < len(groups[0]), slain_leaders < len(groups[1])
+    if leaders_left and (precision or not bodyguards_left):
+        return 1
+    return 0 if bodyguards_left else -1
+
+
+@timed('allocation')
+def apply_wound(
+        state: NDArray[np.floating], damage_pmfs: Tuple[List[NDArray[np.floating]], List[NDArray[np.floating]]],
+        groups: Tuple[List['Model'], List['Model']], precision: bool
+) -> NDArray[np.floating]:
+    # state[b, w, l, v] is the probability that b bodyguards are slain and the next one in line has w wounds left,
+    # and l leaders are slain and the next one has v left. Within a group models are slain in order
+    new_state = np.zeros_like(state)
+    for slain_bodyguards in range(state.shape[0]):
+        for slain_leaders in range(state.shape[2]):
+            cell = state[slain_bodyguards, :, slain_leaders]
+            if not cell.any():
+                continue
+            group = wound_target((slain_bodyguards, slain_leaders), groups, precision)
+            if group < 0: # unit already wiped out
+                new_state[slain_bodyguards, :, slain_leaders] += cell
+                continue
+            # Views with the wounds of the group taking the wound on the first axis
+            if group == 0:
+                slain, source = slain_bodyguards, cell
+                destination = lambda k: new_state[k, :, slain_leaders]
+            else:
+                slain, source = slain_leaders, cell.T
+                destination = lambda k: new_state[slain_bodyguards, :, k].T
+            order = groups[group]
+            next_wounds = order[slain + 1].current_wounds if slain + 1 < len(order) else 0
+            for damage, probability in enumerate(damage_pmfs[group][slain]):
+                if probability == 0:
+                    continue
+                if damage == 0:
+                    destination(slain)[:] += probability * source
+                    continue
+                if damage + 1 < len(source):
+                    destination(slain)[1:len(source) - damage] += probability * source[damage + 1:]
+                destination(slain + 1)[next_wounds] += probability * source[1:damage + 1].sum(axis=0)
+    return new_state
+
+
+def attack_key(weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement') -> tuple:
+    # Everything about an attack that changes its outcome. Names and raw distances are left out on purpose, so
+    # identical profiles and equivalent engagements share their cached results
+    profile = weapon.profile
+    return (
+        weapon.attacks, weapon.ballistic_skill, weapon.strength, weapon.armor_piercing, weapon.damage, profile,
+        engagement.distance <= weapon.weapon_range / 2, engagement.line_of_sight,
+        profile.heavy and attacker.last_action == 'remained_stationary',
+        profile.lance and attacker.last_action == 'charged',
+        len(engagement.opponent.models) // 5 if profile.blast else 0
+    )
+
+
+def target_key(weapon: 'Weapon', engagement: 'Engagement', model: 'Model') -> tuple:
+    # Everything about the defending model that changes how an attack from weapon resolves against it
+    return (
+        model.toughness, model.save, model.invulnerable_save, model.profile.feel_no_pain,
+        benefits_from_cover(model.save, weapon, engagement),
+        weapon.profile.crit_wound_boundary(engagement.opponent.get_all_models_keywords())
+    )
+
+
+def memoize(cache: Dict | None, key: tuple, compute: Callable[[], Any]) -> Any:
+    if cache is None:
+        return compute()
+    if key not in cache:
+        cache[key] = compute()
+    return cache[key]
+
+
+def exact_shooting_round(attacker: 'Unit', engagement: 'Engagement', cache: Dict | None = None) -> ExactResult:
+    """Exact distributions of one shooting round of attacker vs engagement.opponent"""
+    # With a cache, both the whole round and its sub-problems (one weapon profile vs one defensive profile) are
+    # reused by any later call that is equivalent, e.g. the same round at a different distance within half range
+    groups = engagement.opponent.allocation_groups()
+    order = groups[0] + groups[1]
+    if not order:
+        # Nothing left to shoot at: no damage and no models slain, for certain
+        return ExactResult(wounds=np.array([1.0]), damage=np.array([1.0]), models_slain=np.array([1.0]))
+    weapon_groups = [
+        (weapon, num_models, attack_key(weapon, attacker, engagement),
+         [target_key(weapon, engagement, model) for model in order])
+        for weapon, num_models in group_weapons(attacker, engagement).values()
+    ]
+    round_key = (
+        'round', tuple((key, num_models, tuple(targets)) for _, num_models, key, targets in weapon_groups),
+        tuple(tuple(model.current_wounds for model in group) for group in groups)
+    )
+    return memoize(cache, round_key, lambda: resolve_shooting_round(attacker, engagement, groups, weapon_groups, cache))
+
+
+def resolve_shooting_round(
+        attacker: 'Unit', engagement: 'Engagement', groups: Tuple[List['Model'], List['Model']],
+        weapon_groups: List[tuple], cache: Dict | None
+) -> ExactResult:
+    # state[b, w, l, v]: b bodyguards slain and the next one has w wounds left, l leaders slain and the next one has v
+    # left. A group that is wiped out has 0 wounds left
+    bodyguards, leaders = groups
+    order = bodyguards + leaders
+    max_wounds = max(model.current_wounds for model in order)
+    state = np.zeros((len(bodyguards) + 1, max_wounds + 1, len(leaders) + 1, max_wounds + 1))
+    state[0, bodyguards[0].current_wounds if bodyguards else 0, 0, leaders[0].current_wounds if leaders else 0] = 1.0
+
+    wounds_pmf = np.array([1.0])
+    for weapon, num_models, key, targets in weapon_groups:
+        logger.debug(f'Evaluating {num_models}x {weapon.name}')
+        # All models shoot against the starting state of the defender, so the wound roll uses the first target
+        normal_wound, crit_wound = memoize(
+            cache, ('wound', key, targets[0]), lambda: wound_probabilities(weapon, attacker, engagement, order[0])
+        )
+        attacks = memoize(cache, ('attacks', key, num_models), lambda: attack_count_pmf(weapon, num_models, engagement))
+        wounds_pmf = np.convolve(wounds_pmf, memoize(
+            cache, ('wounds', key, num_models, targets[0]),
+            lambda: compound(attacks, successes_per_attack(weapon, attacker, engagement, normal_wound + crit_wound, 1.0))
+        ))
+
+        # Target keys of each group's models, in the same order as the group
+        group_targets = targets[:len(bodyguards)], targets[len(bodyguards):]
+        damage_pmfs = tuple([
+            memoize(cache, ('damage', key, target), lambda: damage_per_wound_pmf(weapon, engagement, model))
+            for model, target in zip(group, group_target)
+        ] for group, group_target in zip(groups, group_targets))
+        # Saves are taken by whichever model is next in line when this weapon's wounds get resolved
+        new_state = np.zeros_like(state)
+        for slain_bodyguards in range(len(bodyguards) + 1):
+            for slain_leaders in range(len(leaders) + 1):
+                cell = state[slain_bodyguards, :, slain_leaders]
+                if cell.sum() == 0:
+                    continue
+                group = wound_target((slain_bodyguards, slain_leaders), groups, weapon.profile.precision)
+                if group < 0:
+                    new_state[slain_bodyguards, :, slain_leaders] += cell
+                    continue
+                slain = (slain_bodyguards, slain_leaders)[group]
+                model, target = groups[group][slain], group_targets[group][slain]
+                unsaved = memoize(
+                    cache, ('unsaved', key, num_models, targets[0], target),
+                    lambda: unsaved_wounds_pmf(weapon, attacker, engagement, model, attacks, normal_wound, crit_wound)
+                )
+                partial = np.zeros_like(state)
+                partial[slain_bodyguards, :, slain_leaders] = cell
+                for probability in unsaved:
+                    new_state += probability * partial
+                    partial = apply_wound(partial, damage_pmfs, groups, weapon.profile.precision)
+        state = new_state
+
+    # Wounds a group has left with k of its models slain and w on the next one, for every k and w
+    wounds_left = []
+    for group in groups:
+        behind = np.cumsum([0] + [model.current_wounds for model in group[::-1]])[::-1] # wounds of models k+1 onwards
+        left = np.arange(max_wounds + 1)[None, :] + np.append(behind[1:], 0)[:, None]
+        left[-1] = 0
+        wounds_left.append(left)
+    starting_wounds = sum(model.current_wounds for model in order)
+    damage = starting_wounds - (wounds_left[0][:, :, None, None] + wounds_left[1][None, None, :, :])
+    slain = np.arange(len(bodyguards) + 1)[:, None, None, None] + np.arange(len(leaders) + 1)[None, None, :, None]
+    in_state = state > 0
+    damage_pmf = np.bincount(damage[in_state], weights=state[in_state], minlength=starting_wounds + 1)
+    models_slain = np.bincount(
+        np.broadcast_to(slain, state.shape)[in_state], weights=state[in_state], minlength=len(order) + 1
+    )
+
+    return ExactResult(
+        wounds=wounds_pmf,
+        damage=damage_pmf,
+        models_slain=models_slain
+    )
+
+
+def unsaved_wounds_pmf(
+        weapon: 'Weapon', attacker: 'Unit', engagement: 'Engagement', target: 'Model', attacks: NDArray[np.floating],
+        normal_wound: float, crit_wound: float
+) -> NDArray[np.floating]:
+    failed_save = failed_save_probability(weapon, engagement, target)
+    per_wound_roll = normal_wound * failed_save
+    per_wound_roll += crit_wound * (1.0 if weapon.profile.devastating_wounds else failed_save)
+    return compound(attacks, successes_per_attack(weapon, attacker, engagement, per_wound_roll, failed_save))
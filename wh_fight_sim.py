@@ -0,0 +1,134 @@
+# Batched fight phase - melee attacks resolved for all trials at once with the same dice kernels as shooting.
+# Range, line of sight and cover don't apply in melee. Which models get to fight (casualties, pile-in) can differ
+# per trial, so weapon groups carry a per-trial model count instead of a single number
+import numpy as np
+from numpy.typing import NDArray
+from utility_functions import CommonRandomNumbers
+from UnitState import UnitState
+from Engagement import Engagement, LastAction
+from wh_batch_sim import BatchResult, batch_wound_roll, batch_save_roll, no_attacks
+import weapon_selection
+import logging
+logger = logging.getLogger(__name__)
+from typing import Dict, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Weapon import Weapon
+    from Model import Model
+    from Unit import Unit
+
+
+def melee_engagement(engagement: Engagement) -> Engagement:
+    # Units in combat always see each other and get nothing from cover
+    return Engagement(distance=engagement.distance, line_of_sight=True, in_cover=False, opponent=engagement.opponent)
+
+
+def select_melee_weapon(model: 'Model', attacker: 'Unit', engagement: Engagement) -> 'Weapon | None':
+    # The profile that does the most damage to whoever is first in line, e.g. sweep vs hordes, strike vs elites
+    return weapon_selection.table.best_weapon(
+        model.melee_weapons.values(), model, attacker, engagement, check_eligibility=False
+    )
+
+
+def models_able_to_fight(
+        fighters: NDArray[np.bool_], models_in_range: int | NDArray[np.integer] | None
+) -> NDArray[np.bool_]:
+    # fighters: (trials, models) models still alive. After piling in, only the first models_in_range of them (in
+    # unit order, per trial or for all trials) are within engagement range and fight
+    if models_in_range is None:
+        return fighters
+    in_range = np.broadcast_to(models_in_range, (len(fighters),))
+    return fighters & (np.cumsum(fighters, axis=1) <= in_range[:, None])
+
+
+def group_melee_weapons(
+        attacker: 'Unit', engagement: Engagement, fighting: NDArray[np.bool_]
+) -> Dict[str, Tuple['Weapon', NDArray[np.integer]]]:
+    # The weapon choice doesn't depend on dice, so it is made once per loadout and models with the same weapon are
+    # counted per trial with one column sum
+    choices = {}
+    columns = {}
+    weapons = {}
+    for i, model in enumerate(attacker.models):
+        loadout = tuple(model.melee_weapons)
+        if loadout not in choices:
+            choices[loadout] = select_melee_weapon(model, attacker, engagement)
+        weapon = choices[loadout]
+        if weapon is not None:
+            weapons[weapon.name] = weapon
+            columns.setdefault(weapon.name, []).append(i)
+    return {name: (weapons[name], fighting[:, columns[name]].sum(axis=1)) for name in weapons}
+
+
+def batch_fight_round(
+        attacker: 'Unit',
+        engagement: Engagement,
+        num_trials: int,
+        rng: 'np.random.Generator | CommonRandomNumbers | None' = None,
+        attacker_state: UnitState | None = None,
+        defender_state: UnitState | None = None,
+        models_in_range: int | NDArray[np.integer] | None = None
+) -> BatchResult:
+    """Simulate num_trials fights of attacker vs engagement.opponent"""
+    # attacker_state/defender_state carry casualties over from an earlier step (e.g. the other side fighting
+    # first), they default to both units as they are now. defender_state is updated in place
+    rng = rng if rng is not None else np.random.default_rng()
+    engagement = melee_engagement(engagement)
+    if attacker_state is None:
+        attacker_state = UnitState.from_unit(attacker, num_trials)
+    if defender_state is None:
+        defender_state = UnitState.from_unit(engagement.opponent, num_trials)
+    initial_wounds = defender_state.total_wounds
+    initial_models = defender_state.models_remaining
+    if defender_state.current_wounds.shape[1] == 0:
+        return no_attacks(defender_state)
+
+    fighting = models_able_to_fight(attacker_state.alive, models_in_range)
+    weapon_groups = group_melee_weapons(attacker, engagement, fighting)
+    wound_rolls = {}
+    for weapon_name, (weapon, num_models) in weapon_groups.items():
+        logger.debug(f'Rolling {num_trials} trials for up to {num_models.max(initial=0)}x {weapon_name}')
+        wound_rolls[weapon_name] = batch_wound_roll(weapon, num_models, attacker, engagement, defender_state, rng)
+
+    total_wounds = np.zeros(num_trials, dtype=int)
+    total_unsaved = np.zeros(num_trials, dtype=int)
+    hazardous_damage = np.zeros(num_trials, dtype=int)
+    for weapon_name, (weapon, _) in weapon_groups.items():
+        num_wounds, num_crit_wounds, hazardous = wound_rolls[weapon_name]
+        unsaved = batch_save_roll(weapon, engagement, num_wounds, num_crit_wounds, defender_state, rng)
+        defender_state.allocate_wounds(unsaved, weapon.damage, rng, precision=weapon.profile.precision)
+        total_wounds += num_wounds
+        total_unsaved += unsaved
+        hazardous_damage += hazardous
+
+    return BatchResult(
+        wounds=total_wounds,
+        unsaved_wounds=total_unsaved,
+        damage=initial_wounds - defender_state.total_wounds,
+        models_slain=initial_models - defender_state.models_remaining,
+        remaining_wounds=defender_state.current_wounds,
+        hazardous_damage=hazardous_damage
+    )
+
+
+def batch_fight_phase(
+        charger: 'Unit',
+        engagement: Engagement,
+        num_trials: int,
+        rng: np.random.Generator | None = None,
+        models_in_range: int | NDArray[np.integer] | None = None,
+        defender_models_in_range: int | NDArray[np.integer] | None = None
+) -> Tuple[BatchResult, BatchResult]:
+    """The charging unit fights first, then engagement.opponent fights back with whatever survived, per trial"""
+    rng = rng if rng is not None else np.random.default_rng()
+    charger.last_action = LastAction.charged # lance and other on-the-charge rules key off this
+    defender = engagement.opponent
+    charger_state = UnitState.from_unit(charger, num_trials)
+    defender_state = UnitState.from_unit(defender, num_trials)
+    charge_result = batch_fight_round(
+        charger, engagement, num_trials, rng, charger_state, defender_state, models_in_range
+    )
+    fight_back = Engagement(distance=engagement.distance, line_of_sight=True, in_cover=False, opponent=charger)
+    fight_back_result = batch_fight_round(
+        defender, fight_back, num_trials, rng, defender_state, charger_state, defender_models_in_range
+    )
+    return charge_result, fight_back_result
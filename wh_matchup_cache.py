@@ -0,0 +1,153 @@
+# Matchup cache - results are keyed by a hash of the datasheet contents (weapon, model and unit stats), the
+# engagement and the run parameters, and kept in an in-memory LRU in front of a sqlite file. Editing a datasheet
+# changes the hash, so stale results are never served and nothing has to be invalidated by hand
+import os
+import json
+import pickle
+import sqlite3
+import hashlib
+import dataclasses
+from enum import Enum
+from collections import OrderedDict
+from Weapon import Weapon
+from Model import Model
+from Unit import Unit
+from Engagement import Engagement
+from wh_exact_sim import exact_shooting_round, ExactResult
+from wh_parallel_sim import parallel_shooting_rounds, SimulationSummary
+import logging
+logger = logging.getLogger(__name__)
+from typing import Any, Callable
+
+CACHE_VERSION = 7 # bump when engine changes alter results, so old entries stop matching
+DEFAULT_CACHE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.matchup_cache.sqlite')
+
+
+def canonical(item: Any) -> Any:
+    # JSON-able form that only depends on what can change a result: stats and keywords, not names or identities
+    if isinstance(item, Weapon):
+        return {
+            'range': item.weapon_range, 'attacks': canonical(item.attacks), 'skill': item.ballistic_skill,
+            'strength': item.strength, 'ap': item.armor_piercing, 'damage': canonical(item.damage),
+            'keywords': canonical(item.keywords)
+        }
+    if isinstance(item, Model):
+        return {
+            'toughness': item.toughness, 'save': item.save, 'invulnerable_save': item.invulnerable_save,
+            'wounds': [item.current_wounds, item.starting_wounds], 'abilities': canonical(item.abilities),
+            'keywords': canonical(item.keywords), 'ranged_weapons': canonical(list(item.ranged_weapons.values())),
+            'melee_weapons': canonical(list(item.melee_weapons.values()))
+        }
+    if isinstance(item, Unit):
+        return {
+            'models': canonical(item.models), 'last_action': canonical(item.last_action),
+            'in_melee': bool(item.in_melee_with)
+        }
+    if isinstance(item, Engagement):
+        return {
+            'distance': item.distance, 'line_of_sight': item.line_of_sight, 'in_cover': item.in_cover,
+            'opponent': canonical(item.opponent)
+        }
+    if dataclasses.is_dataclass(item):
+        return canonical(dataclasses.asdict(item))
+    if isinstance(item, Enum):
+        return item.value
+    if isinstance(item, dict):
+        return {str(key): canonical(value) for key, value in item.items()}
+    if isinstance(item, (set, frozenset)):
+        return sorted(canonical(value) for value in item if value != '')
+    if isinstance(item, (list, tuple)):
+        return [canonical(value) for value in item]
+    return item
+
+
+def melee_state(attacker: Unit, engagement: Engagement) -> dict:
+    # Who is locked in combat with whom changes what may shoot: locked with the target pistols still can, locked with
+    # another unit nothing can. canonical sees one unit at a time, so the relation gets its own part of the key
+    return {
+        'attacker_engaged': bool(attacker.in_melee_with),
+        'engaged_with_target': any(unit is engagement.opponent for unit in attacker.in_melee_with),
+        'target_engaged': bool(engagement.opponent.in_melee_with)
+    }
+
+
+def matchup_key(*parts: Any) -> str:
+    payload = json.dumps([CACHE_VERSION, canonical(list(parts))], sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class MatchupCache:
+    def __init__(self, path: str | None = DEFAULT_CACHE_PATH, max_entries: int = 1024):
+        # path=None keeps the cache in memory only
+        self.max_entries = max_entries
+        self.memory = OrderedDict()
+        self.connection = None
+        if path is not None:
+            self.connection = sqlite3.connect(path)
+            self.connection.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, value BLOB)')
+            self.connection.commit()
+
+    def remember(self, key: str, value: Any):
+        self.memory[key] = value
+        self.memory.move_to_end(key)
+        if len(self.memory) > self.max_entries:
+            self.memory.popitem(last=False)
+
+    def get(self, key: str) -> Any | None:
+        if key in self.memory:
+            self.memory.move_to_end(key)
+            return self.memory[key]
+        if self.connection is None:
+            return None
+        row = self.connection.execute('SELECT value FROM results WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value = pickle.loads(row[0])
+        self.remember(key, value)
+        return value
+
+    def put(self, key: str, value: Any):
+        self.remember(key, value)
+        if self.connection is not None:
+            self.connection.execute(
+                'INSERT OR REPLACE INTO results (key, value) VALUES (?, ?)', (key, pickle.dumps(value))
+            )
+            self.connection.commit()
+
+    def get_or_compute(self, key: str, compute: Callable[[], Any]) -> Any:
+        value = self.get(key)
+        if value is None:
+            logger.debug(f'Cache miss for {key}')
+            value = compute()
+            self.put(key, value)
+        return value
+
+    def clear(self):
+        self.memory.clear()
+        if self.connection is not None:
+            self.connection.execute('DELETE FROM results')
+            self.connection.commit()
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def cached_exact_shooting_round(attacker: Unit, engagement: Engagement, cache: MatchupCache) -> ExactResult:
+    key = matchup_key('exact_shooting_round', attacker, engagement, melee_state(attacker, engagement))
+    return cache.get_or_compute(key, lambda: exact_shooting_round(attacker, engagement))
+
+
+def cached_parallel_shooting_rounds(
+        attacker: Unit, engagement: Engagement, num_trials: int, seed: int | None, cache: MatchupCache, **kwargs
+) -> SimulationSummary:
+    # Without a seed every run is a fresh sample, so there is nothing to reuse
+    if seed is None:
+        return parallel_shooting_rounds(attacker, engagement, num_trials, seed, **kwargs)
+    key = matchup_key(
+        'parallel_shooting_rounds', attacker, engagement, melee_state(attacker, engagement), num_trials, seed,
+        kwargs.get('shard_size', 10_000),
+        kwargs.get('target_precision'), kwargs.get('kill_precision'), kwargs.get('confidence', 0.95)
+    )
+    return cache.get_or_compute(key, lambda: parallel_shooting_rounds(attacker, engagement, num_trials, seed, **kwargs))
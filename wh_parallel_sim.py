@@ -0,0 +1,184 @@
+# Parallel runner - trials are cut into fixed size shards, each shard gets its own generator spawned from one root
+# SeedSequence, and the per-shard histograms are merged in shard order. Since the shards don't depend on the number
+# of workers, a fixed seed gives the same result on 1 core or 32
+import os
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from contextlib import nullcontext
+from concurrent.futures import ProcessPoolExecutor
+import utility_functions
+from accumulators import RunningStats, BinomialCounter, IntegerHistogram
+from wh_batch_sim import BatchResult, batch_shooting_round
+from result_store import ResultStore, outcome_columns, batch_outcomes
+import logging
+logger = logging.getLogger(__name__)
+from typing import Dict, List, Sequence, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+    from Engagement import Engagement
+
+
+@dataclass
+class SimulationSummary:
+    num_trials: int
+    damage: IntegerHistogram
+    models_slain: IntegerHistogram
+    damage_stats: RunningStats
+    kills: BinomialCounter
+
+    @classmethod
+    def from_result(cls, result: BatchResult) -> 'SimulationSummary':
+        damage = IntegerHistogram()
+        damage.update(result.damage)
+        models_slain = IntegerHistogram()
+        models_slain.update(result.models_slain)
+        kills = BinomialCounter()
+        kills.update(result.remaining_wounds.sum(axis=1) == 0)
+        return cls(result.num_trials, damage, models_slain, damage.stats(), kills)
+
+    def merge(self, other: 'SimulationSummary') -> 'SimulationSummary':
+        return SimulationSummary(
+            num_trials=self.num_trials + other.num_trials,
+            damage=self.damage.merge(other.damage),
+            models_slain=self.models_slain.merge(other.models_slain),
+            damage_stats=self.damage_stats.merge(other.damage_stats),
+            kills=self.kills.merge(other.kills)
+        )
+
+    def converged(self, target_precision: float | None, kill_precision: float | None, confidence: float) -> bool:
+        # Both targets are confidence interval half widths: on expected damage and on kill probability
+        if target_precision is None and kill_precision is None:
+            return False
+        if target_precision is not None and self.damage_stats.half_width(confidence) > target_precision:
+            return False
+        if kill_precision is not None and self.kills.half_width(confidence) > kill_precision:
+            return False
+        return True
+
+    @property
+    def damage_histogram(self) -> NDArray[np.integer]:
+        return self.damage.counts
+
+    @property
+    def models_slain_histogram(self) -> NDArray[np.integer]:
+        return self.models_slain.counts
+
+    @property
+    def expected_damage(self) -> float:
+        return self.damage.mean
+
+    @property
+    def expected_models_slain(self) -> float:
+        return self.models_slain.mean
+
+    @property
+    def kill_probability(self) -> float:
+        return self.kills.proportion
+
+    def damage_quantiles(self, quantiles: Sequence[float] = (0.1, 0.5, 0.9)) -> NDArray[np.integer]:
+        return self.damage.quantiles(quantiles)
+
+    def damage_distribution(self) -> NDArray[np.floating]:
+        return self.damage.distribution()
+
+    def models_slain_distribution(self) -> NDArray[np.floating]:
+        return self.models_slain.distribution()
+
+
+def run_shard(
+        attacker: 'Unit', engagement: 'Engagement', num_trials: int, seed_sequence: np.random.SeedSequence
+) -> SimulationSummary:
+    # Anything still calling roll() while the shard runs draws from the shard's stream
+    with utility_functions.seeded_rng(np.random.default_rng(seed_sequence)) as rng:
+        return SimulationSummary.from_result(batch_shooting_round(attacker, engagement, num_trials, rng))
+
+
+def shard_sizes(num_trials: int, shard_size: int) -> List[int]:
+    return [min(shard_size, num_trials - start) for start in range(0, num_trials, shard_size)]
+
+
+def parallel_shooting_rounds(
+        attacker: 'Unit', engagement: 'Engagement', num_trials: int, seed: int | None = None,
+        max_workers: int | None = None, shard_size: int = 10_000, target_precision: float | None = None,
+        kill_precision: float | None = None, confidence: float = 0.95
+) -> SimulationSummary:
+    """Run num_trials batched shooting rounds spread over a process pool"""
+    # With a target precision num_trials becomes the upper limit: shards go out in waves, are merged in shard order
+    # and the run stops at the first shard where the confidence intervals are narrow enough. Stopping is decided
+    # shard by shard, so the result still doesn't depend on the number of workers
+    if num_trials < 1:
+        raise ValueError('Need at least one trial to run')
+    sizes = shard_sizes(num_trials, shard_size)
+    root_sequence = np.random.SeedSequence(seed)
+    adaptive = target_precision is not None or kill_precision is not None
+    wave_size = (max_workers or os.cpu_count() or 1) if adaptive else len(sizes)
+    logger.debug(f'Running up to {num_trials} trials in {len(sizes)} shards of up to {shard_size}')
+
+    summary = None
+    with nullcontext() if max_workers == 1 else ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(0, len(sizes), wave_size):
+            wave = sizes[start:start + wave_size]
+            arguments = ([attacker] * len(wave), [engagement] * len(wave), wave, root_sequence.spawn(len(wave)))
+            shard_summaries = map(run_shard, *arguments) if executor is None else executor.map(run_shard, *arguments)
+            for shard_summary in shard_summaries:
+                summary = shard_summary if summary is None else summary.merge(shard_summary)
+                if summary.converged(target_precision, kill_precision, confidence):
+                    logger.debug(f'Converged after {summary.num_trials} trials')
+                    return summary
+    return summary
+
+
+def run_shard_outcomes(
+        attacker: 'Unit', engagement: 'Engagement', num_trials: int, seed_sequence: np.random.SeedSequence
+) -> Dict[str, NDArray[np.integer]]:
+    # Same seeding as run_shard, so a stored run and a summarised run of the same seed see the same dice
+    with utility_functions.seeded_rng(np.random.default_rng(seed_sequence)) as rng:
+        return batch_outcomes(batch_shooting_round(attacker, engagement, num_trials, rng))
+
+
+def stored_shooting_rounds(
+        attacker: 'Unit', engagement: 'Engagement', num_trials: int, path: str, seed: int | None = None,
+        max_workers: int | None = None, shard_size: int = 100_000
+) -> ResultStore:
+    """Run num_trials batched shooting rounds and write every trial's outcomes to a result store at path"""
+    # Each shard is one chunk of the store, appended in shard order. If path already holds a store from an earlier,
+    # interrupted call with the same arguments, the shards it committed are skipped and the run picks up from there.
+    # Only one wave of shards is held in memory at a time
+    if num_trials < 1:
+        raise ValueError('Need at least one trial to run')
+    run = {
+        'attacker': attacker.name, 'defender': engagement.opponent.name, 'distance': engagement.distance,
+        'line_of_sight': engagement.line_of_sight, 'in_cover': engagement.in_cover, 'num_trials': num_trials,
+        'shard_size': shard_size
+    }
+    if os.path.exists(os.path.join(path, 'manifest.json')):
+        store = ResultStore.open(path)
+        stored_run = {key: value for key, value in store.metadata.items() if key != 'entropy'}
+        if stored_run != run:
+            raise ValueError(f'{path} holds a different run: {stored_run}')
+        if seed is not None and store.metadata['entropy'] != seed:
+            raise ValueError(f'{path} was run with seed {store.metadata["entropy"]}, not {seed}')
+        logger.debug(f'Resuming after {len(store.chunks)} stored shards')
+    else:
+        # Without a seed the entropy is drawn here and kept, so an interrupted run can still be resumed exactly
+        entropy = seed if seed is not None else np.random.SeedSequence().entropy
+        store = ResultStore.create(path, outcome_columns(len(engagement.opponent.models)), {**run, 'entropy': entropy})
+
+    sizes = shard_sizes(num_trials, shard_size)
+    seed_sequences = np.random.SeedSequence(store.metadata['entropy']).spawn(len(sizes))
+    done = len(store.chunks)
+    wave_size = max_workers or os.cpu_count() or 1
+    with nullcontext() if max_workers == 1 else ProcessPoolExecutor(max_workers=max_workers) as executor:
+        for start in range(done, len(sizes), wave_size):
+            wave = range(start, min(start + wave_size, len(sizes)))
+            arguments = (
+                [attacker] * len(wave), [engagement] * len(wave), [sizes[i] for i in wave],
+                [seed_sequences[i] for i in wave]
+            )
+            shard_outcomes = (
+                map(run_shard_outcomes, *arguments) if executor is None else executor.map(run_shard_outcomes, *arguments)
+            )
+            for shard, outcomes in zip(wave, shard_outcomes):
+                store.append(outcomes, shard=shard)
+    return store
@@ -0,0 +1,185 @@
+# Rare event estimates - tail probabilities such as a one round kill, by importance sampling. The batch engine runs
+# on tilted dice that make the outcome of interest common, and each trial is weighted by how much more likely its
+# dice were under the tilt than under fair dice. The weighted mean is an unbiased estimate of the probability with
+# fair dice, with a far smaller error than plain sampling gives for the same number of trials
+import argparse
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+import utility_functions
+from utility_functions import TiltedDice
+from accumulators import RunningStats
+from Engagement import Engagement
+from wh_batch_sim import BatchResult, batch_shooting_round
+from wh_parallel_sim import shard_sizes
+from warhammer.datasheets.unit_collection import unit_collection
+import logging
+logger = logging.getLogger(__name__)
+from typing import Callable, Dict, List, Sequence, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+
+TILT_STRENGTHS = (0.0, 0.25, 0.5, 0.75, 1.0, 1.5, 2.0, 3.0, 4.0)
+
+
+def destroyed(result: BatchResult) -> NDArray[np.bool_]:
+    return result.remaining_wounds.sum(axis=1) == 0
+
+
+def wounds_left(wounds: int) -> Callable[[BatchResult], NDArray[np.bool_]]:
+    # e.g. wounds_left(1): the defender survives on exactly one wound
+    return lambda result: result.remaining_wounds.sum(axis=1) == wounds
+
+
+EVENTS = {'destroyed': destroyed, 'one_wound_left': wounds_left(1)}
+
+
+def attacker_favoured(strength: float) -> Dict[str, float]:
+    # More hits, wounds, failed saves and failed feel no pain rolls, plus more attacks and damage. Rolls with a
+    # boundary shift the odds of succeeding by exp(strength), attacks and damage tilt every face, so less strongly
+    return {
+        'hit': strength, 'wound': strength, 'wound_reroll': strength, 'save': -strength, 'feel_no_pain': -strength,
+        'attacks': strength / 4, 'damage': strength / 4
+    }
+
+
+@dataclass
+class RareEventEstimate:
+    num_trials: int
+    weighted: RunningStats  # event indicator times likelihood weight, its mean is the probability
+    hits: int               # trials where the event happened under the tilted dice
+    effective_sample_size: float
+    event_sample_size: float    # effective sample size of the trials that hit the event, small means heavy tailed weights
+
+    @property
+    def probability(self) -> float:
+        return self.weighted.mean
+
+    @property
+    def standard_error(self) -> float:
+        return self.weighted.standard_error
+
+    @property
+    def relative_error(self) -> float:
+        return self.standard_error / self.probability if self.probability else float('inf')
+
+    def confidence_interval(self, confidence: float=0.95) -> tuple[float, float]:
+        low, high = self.weighted.confidence_interval(confidence)
+        return max(low, 0.0), min(high, 1.0)
+
+    def plain_trials_needed(self) -> float:
+        # Plain sampling trials for the same confidence interval, p(1 - p) / se^2
+        p = self.probability
+        return p * (1 - p) / self.standard_error ** 2 if self.standard_error else float('inf')
+
+
+def estimate_probability(
+        attacker: 'Unit',
+        engagement: Engagement,
+        num_trials: int,
+        event: Callable[[BatchResult], NDArray[np.bool_]] = destroyed,
+        tilts: Dict[str, float] | None = None,
+        seed: int | np.random.SeedSequence | None = None,
+        shard_size: int = 10_000,
+        round_function: Callable[..., BatchResult] = batch_shooting_round
+) -> RareEventEstimate:
+    """Importance sampling estimate of the probability of event, e.g. attacker destroying the defender in one round"""
+    # tilts maps dice phases (see utility_functions.DICE_STREAMS) to tilt strengths, positive favours high faces.
+    # With no tilts this is plain Monte Carlo
+    if num_trials < 1:
+        raise ValueError('Need at least one trial to run')
+    tilts = tilts or {}
+    unknown = set(tilts) - set(utility_functions.DICE_STREAMS)
+    if unknown:
+        raise ValueError(f'Unknown dice phases: {", ".join(sorted(unknown))}')
+    root_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    weighted = RunningStats()
+    hits = 0
+    weight_sum = weight_square_sum = event_weight_sum = event_weight_square_sum = 0.0
+    sizes = shard_sizes(num_trials, shard_size)
+    for size, seed_sequence in zip(sizes, root_sequence.spawn(len(sizes))):
+        with utility_functions.seeded_rng(np.random.default_rng(seed_sequence)) as rng:
+            dice = TiltedDice(rng, size, tilts)
+            happened = event(round_function(attacker, engagement, size, dice))
+        weights = dice.weights
+        weighted.update(np.where(happened, weights, 0.0))
+        hits += int(happened.sum())
+        weight_sum += float(weights.sum())
+        weight_square_sum += float((weights ** 2).sum())
+        event_weight_sum += float(weights[happened].sum())
+        event_weight_square_sum += float((weights[happened] ** 2).sum())
+    effective_sample_size = weight_sum ** 2 / weight_square_sum if weight_square_sum else 0.0
+    event_sample_size = event_weight_sum ** 2 / event_weight_square_sum if event_weight_square_sum else 0.0
+    logger.debug(f'{hits} of {num_trials} tilted trials hit the event, effective sample size {event_sample_size:.0f}')
+    return RareEventEstimate(num_trials, weighted, hits, effective_sample_size, event_sample_size)
+
+
+def choose_tilt(
+        attacker: 'Unit',
+        engagement: Engagement,
+        event: Callable[[BatchResult], NDArray[np.bool_]] = destroyed,
+        direction: Callable[[float], Dict[str, float]] = attacker_favoured,
+        strengths: Sequence[float] = TILT_STRENGTHS,
+        pilot_trials: int = 5_000,
+        seed: int | np.random.SeedSequence | None = None,
+        round_function: Callable[..., BatchResult] = batch_shooting_round,
+        min_event_sample_size: float = 50
+) -> Dict[str, float]:
+    """Pick the tilt with the smallest relative error from short pilot runs"""
+    # Pilot runs use their own seeds and are thrown away, so the choice doesn't bias the final estimate. Too strong
+    # a tilt leaves a few huge weights, and then the pilot's own error estimate can't be trusted, so tilts need
+    # min_event_sample_size effective event trials to be considered
+    root_sequence = seed if isinstance(seed, np.random.SeedSequence) else np.random.SeedSequence(seed)
+    best_tilts, best_error = {}, float('inf')
+    for strength, seed_sequence in zip(strengths, root_sequence.spawn(len(strengths))):
+        tilts = direction(strength)
+        pilot = estimate_probability(
+            attacker, engagement, pilot_trials, event, tilts, seed_sequence, pilot_trials, round_function
+        )
+        logger.debug(f'Tilt {strength}: p={pilot.probability:.3g}, relative error {pilot.relative_error:.3g}')
+        if pilot.event_sample_size >= min_event_sample_size and pilot.relative_error < best_error:
+            best_tilts, best_error = tilts, pilot.relative_error
+    return best_tilts
+
+
+def rare_event_probability(
+        attacker: 'Unit',
+        engagement: Engagement,
+        num_trials: int,
+        event: Callable[[BatchResult], NDArray[np.bool_]] = destroyed,
+        direction: Callable[[float], Dict[str, float]] = attacker_favoured,
+        seed: int | None = None,
+        round_function: Callable[..., BatchResult] = batch_shooting_round
+) -> RareEventEstimate:
+    """Choose a tilt with pilot runs, then estimate the probability of event with num_trials tilted trials"""
+    pilot_seed, main_seed = np.random.SeedSequence(seed).spawn(2)
+    tilts = choose_tilt(attacker, engagement, event, direction, seed=pilot_seed, round_function=round_function)
+    return estimate_probability(attacker, engagement, num_trials, event, tilts, main_seed, round_function=round_function)
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description='Estimate the probability of a rare outcome of one shooting round.')
+    parser.add_argument('--attacker', default='allarus_custodians', help='unit_collection entry')
+    parser.add_argument('--defender', default='ctan_shard_of_the_nightbringer', help='unit_collection entry')
+    parser.add_argument('--event', choices=list(EVENTS), default='destroyed')
+    parser.add_argument('--distance', type=int, default=7)
+    parser.add_argument('--in-cover', action='store_true')
+    parser.add_argument('--trials', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    engagement = Engagement(
+        distance=args.distance, line_of_sight=True, in_cover=args.in_cover, opponent=unit_collection[args.defender].spawn()
+    )
+    estimate = rare_event_probability(
+        unit_collection[args.attacker].spawn(), engagement, args.trials, EVENTS[args.event], seed=args.seed
+    )
+    low, high = estimate.confidence_interval()
+    print(
+        f'{args.attacker} vs {args.defender}, {args.event}: p={estimate.probability:.3e} (95% CI {low:.3e} to {high:.3e}, '
+        f'relative error {estimate.relative_error:.1%}), as precise as {estimate.plain_trials_needed():.3g} plain trials'
+    )
+
+
+if __name__ == '__main__':
+    main()
@@ -5,56 +5,78 @@ from Engagement import Engagement
 from Unit import Unit
 from Model import Model
 from warhammer.utility_functions import calculate_damage
-from copy import deepcopy
+import trace_recorder
+import argparse
 import logging
 
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    filename='app.log',  # Logs go to this file
-    filemode='w'  # 'a' to append, 'w' to overwrite
-)
 logger = logging.getLogger(__name__)
-logger.debug('Log Start')
-# TODO check how does the change in ballistic skill change likelihood to land a hit
 
 
 def shooting_round(attacker: Unit, engagement_details: Engagement):
     defender = engagement_details.opponent
-    logger.debug(f'{attacker.name} attacks enemy {defender.name}')
-    logger.debug(f'Starting state of defending unit: {[model.current_wounds for model in defender.models]}')
+    tracer = trace_recorder.active
+    if tracer is not None:
+        tracer.start_trial()
+    debug = logger.isEnabledFor(logging.DEBUG)
+    if debug:
+        logger.debug(f'{attacker.name} attacks enemy {defender.name}')
+        logger.debug(f'Starting state of defending unit: {[model.current_wounds for model in defender.models]}')
     wounds_per_weapon = attacker.shoot(engagement_details)
-    logger.debug(f'Wounds to be allocated pre-saves: {dict(wounds_per_weapon)}') # For cleaner logging
+    if debug:
+        logger.debug(f'Wounds to be allocated pre-saves: {dict(wounds_per_weapon)}') # For cleaner logging
+    # Resolve weapons from the attacker itself, so units built outside the datasheets work too
+    weapons = {weapon.name: weapon for model in attacker.models for weapon in model.ranged_weapons.values()}
     for weapon_name in wounds_per_weapon:
+        if not defender.alive: # the wounds of the remaining weapons have nothing left to go to
+            break
         num_wounds, num_crit_wounds = wounds_per_weapon[weapon_name]
-        logger.debug(f'Resolving for {weapon_name}. Total wounds: {num_wounds}, of which crits: {num_crit_wounds}')
+        if debug:
+            logger.debug(f'Resolving for {weapon_name}. Total wounds: {num_wounds}, of which crits: {num_crit_wounds}')
 
         # roll the saves - select the injured model, roll their saves, see how many wounds go through
-        weapon = weapon_collection[weapon_name]
+        weapon = weapons[weapon_name]
         wounds_taken = defender.do_saves(num_wounds, num_crit_wounds, weapon, engagement_details)
-        logger.debug(f'Wounds to be allocated post-saves: {wounds_taken} at {weapon.damage} damage each')
-        defender.allocate_wounds(wounds_taken, weapon.damage)
+        if debug:
+            logger.debug(f'Wounds to be allocated post-saves: {wounds_taken} at {weapon.damage} damage each')
+        defender.allocate_wounds(wounds_taken, weapon.damage, weapon.profile.precision)
 
-    logger.debug(f'New state of defending unit: {[model.current_wounds for model in defender.models]}')
+    if debug:
+        logger.debug(f'New state of defending unit: {[model.current_wounds for model in defender.models]}')
 
 
 def multiple_shooting_rounds(num_rounds: int, attacker: Unit, engagement_details: Engagement):
+    debug = logger.isEnabledFor(logging.DEBUG)
     for i in range(num_rounds):
         if engagement_details.opponent.alive:
-            logger.debug('-----------------------------------------------------------------------------------------')
-            logger.debug(f'-------------------------------------- Round {i+1} ------------------------------------------')
-            logger.debug('-----------------------------------------------------------------------------------------')
+            if debug:
+                logger.debug('-----------------------------------------------------------------------------------------')
+                logger.debug(f'-------------------------------------- Round {i+1} ------------------------------------------')
+                logger.debug('-----------------------------------------------------------------------------------------')
             shooting_round(attacker, engagement_details)
         else:
-            logger.debug(f'Opponent unit has been wiped out')
-
-# Unit v Unit
-# example_terminator_unit = deepcopy(unit_collection['example_terminator_unit'])
-# example_terminator_enemy_unit = deepcopy(unit_collection['example_terminator_unit'])
-ctan_nightbringer = deepcopy(unit_collection['ctan_shard_of_the_nightbringer'])
-# engagement_details = Engagement(distance=3, line_of_sight=True, in_cover=True, opponent=example_terminator_enemy_unit)
-# engagement_details = Engagement(distance=7, line_of_sight=True, in_cover=False, opponent=ctan_nightbringer)
-allarus_custodes = deepcopy(unit_collection['allarus_custodians'])
-engagement_details = Engagement(distance=7, line_of_sight=True, in_cover=False, opponent=allarus_custodes)
-
-multiple_shooting_rounds(4, ctan_nightbringer, engagement_details)
+            logger.debug('Opponent unit has been wiped out')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Example shooting rounds, logged to app.log.')
+    parser.add_argument('--fast', action='store_true', help='skip debug logging and its formatting, e.g. for timing runs')
+    args = parser.parse_args()
+    if not args.fast:
+        logging.basicConfig(
+            level=logging.DEBUG,
+            format='%(asctime)s - %(levelname)s - %(message)s',
+            filename='app.log',  # Logs go to this file
+            filemode='w'  # 'a' to append, 'w' to overwrite
+        )
+    logger.debug('Log Start')
+
+    # Unit v Unit
+    # example_terminator_unit = unit_collection['example_terminator_unit'].spawn()
+    # example_terminator_enemy_unit = unit_collection['example_terminator_unit'].spawn()
+    ctan_nightbringer = unit_collection['ctan_shard_of_the_nightbringer'].spawn()
+    # engagement_details = Engagement(distance=3, line_of_sight=True, in_cover=True, opponent=example_terminator_enemy_unit)
+    # engagement_details = Engagement(distance=7, line_of_sight=True, in_cover=False, opponent=ctan_nightbringer)
+    allarus_custodes = unit_collection['allarus_custodians'].spawn()
+    engagement_details = Engagement(distance=7, line_of_sight=True, in_cover=False, opponent=allarus_custodes)
+
+    multiple_shooting_rounds(4, ctan_nightbringer, engagement_details)
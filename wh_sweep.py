@@ -0,0 +1,189 @@
+# Matchup sweep - every attacker vs every defender over a grid of engagement parameters, evaluated with the exact
+# engine. Sub-problems (same weapon profile vs same defensive profile under equivalent conditions) are shared
+# between cells through one cache, so a grid costs roughly as much as its distinct sub-problems. Distances between
+# the same pair of weapon range breakpoints give the same result, so only one of them is evaluated
+import argparse
+import csv
+import json
+import itertools
+from bisect import bisect_left
+import numpy as np
+from numpy.typing import NDArray
+from dataclasses import dataclass
+from warhammer.datasheets.unit_collection import unit_collection
+from Engagement import Engagement, LastAction
+from wh_exact_sim import exact_shooting_round
+import logging
+logger = logging.getLogger(__name__)
+from typing import Dict, List, Sequence, Tuple, TYPE_CHECKING
+if TYPE_CHECKING:
+    from Unit import Unit
+
+AXES = ('attacker', 'defender', 'distance', 'line_of_sight', 'in_cover', 'last_action')
+
+
+@dataclass
+class SweepResult:
+    attackers: List[str]
+    defenders: List[str]
+    distances: List[int]
+    line_of_sight: List[bool]
+    in_cover: List[bool]
+    last_action: List[LastAction | None]
+    # One value per cell, indexed in the order of AXES
+    expected_damage: NDArray[np.floating]
+    expected_models_slain: NDArray[np.floating]
+    kill_probability: NDArray[np.floating]
+    damage_per_point: NDArray[np.floating] # expected damage per point spent on the attacker
+
+    def axis_values(self) -> List[list]:
+        return [self.attackers, self.defenders, self.distances, self.line_of_sight, self.in_cover, self.last_action]
+
+    def records(self) -> List[Dict]:
+        rows = []
+        for index in np.ndindex(self.expected_damage.shape):
+            row = {axis: values[i] for axis, values, i in zip(AXES, self.axis_values(), index)}
+            row.update(
+                expected_damage=float(self.expected_damage[index]),
+                expected_models_slain=float(self.expected_models_slain[index]),
+                kill_probability=float(self.kill_probability[index]),
+                damage_per_point=float(self.damage_per_point[index])
+            )
+            rows.append(row)
+        return rows
+
+
+def distance_breakpoints(attacker: 'Unit') -> List[float]:
+    # Distance only matters through comparisons with a weapon's range (can it shoot) and half its range (rapid fire,
+    # melta), always as distance <= threshold. Every ranged weapon counts, weapon selection looks at all of them
+    return sorted({
+        threshold for model in attacker.models for weapon in model.ranged_weapons.values()
+        for threshold in (weapon.weapon_range, weapon.weapon_range / 2)
+    })
+
+
+def plan_distances(attacker: 'Unit', distances: Sequence[int]) -> List[Tuple[int, List[int]]]:
+    """Group distances by the interval between breakpoints they fall in, as (representative, indices into distances)"""
+    # Two distances with the same number of breakpoints below them compare the same way with every threshold
+    breakpoints = distance_breakpoints(attacker)
+    intervals = {}
+    for i, distance in enumerate(distances):
+        intervals.setdefault(bisect_left(breakpoints, distance), []).append(i)
+    return [(distances[indices[0]], indices) for indices in intervals.values()]
+
+
+def sweep(
+        attackers: Dict[str, 'Unit'],
+        defenders: Dict[str, 'Unit'],
+        distances: Sequence[int],
+        line_of_sight: Sequence[bool] = (True,),
+        in_cover: Sequence[bool] = (False,),
+        last_action: Sequence[LastAction | None] = (None,),
+        cache: Dict | None = None
+) -> SweepResult:
+    """Evaluate every combination of attacker, defender and engagement parameters"""
+    cache = {} if cache is None else cache
+    shape = (len(attackers), len(defenders), len(distances), len(line_of_sight), len(in_cover), len(last_action))
+    expected_damage = np.zeros(shape)
+    expected_models_slain = np.zeros(shape)
+    kill_probability = np.zeros(shape)
+    point_costs = np.array([unit.point_cost for unit in attackers.values()], dtype=float)
+
+    evaluated = 0
+    for a, attacker_template in enumerate(attackers.values()):
+        attacker = attacker_template.spawn()
+        distance_plan = plan_distances(attacker, distances)
+        for d, defender_template in enumerate(defenders.values()):
+            defender = defender_template.spawn()
+            for l, action in enumerate(last_action):
+                attacker.last_action = action
+                for (distance, i), j, k in itertools.product(distance_plan, range(len(line_of_sight)), range(len(in_cover))):
+                    # i lists every grid distance the representative stands for
+                    engagement = Engagement(
+                        distance=distance, line_of_sight=line_of_sight[j], in_cover=in_cover[k], opponent=defender
+                    )
+                    result = exact_shooting_round(attacker, engagement, cache)
+                    expected_damage[a, d, i, j, k, l] = result.expected_damage
+                    expected_models_slain[a, d, i, j, k, l] = result.expected_models_slain
+                    kill_probability[a, d, i, j, k, l] = result.kill_probability
+                    evaluated += 1
+    logger.debug(
+        f'Swept {expected_damage.size} cells by evaluating {evaluated} of them, {len(cache)} distinct sub-problems'
+    )
+
+    return SweepResult(
+        attackers=list(attackers),
+        defenders=list(defenders),
+        distances=list(distances),
+        line_of_sight=list(line_of_sight),
+        in_cover=list(in_cover),
+        last_action=list(last_action),
+        expected_damage=expected_damage,
+        expected_models_slain=expected_models_slain,
+        kill_probability=kill_probability,
+        damage_per_point=expected_damage / point_costs[:, None, None, None, None, None]
+    )
+
+
+def parse_distances(values: List[str]) -> List[int]:
+    # Accepts single distances and inclusive ranges: 3 6 12-24
+    distances = []
+    for value in values:
+        if '-' in value:
+            start, stop = value.split('-')
+            distances.extend(range(int(start), int(stop) + 1))
+        else:
+            distances.append(int(value))
+    return distances
+
+
+def parse_bool(value: str) -> bool:
+    if value.lower() in ('true', 'yes', '1'):
+        return True
+    if value.lower() in ('false', 'no', '0'):
+        return False
+    raise argparse.ArgumentTypeError(f'Expected true or false, got {value}')
+
+
+def parse_last_action(value: str) -> LastAction | None:
+    return None if value == 'none' else LastAction(value)
+
+
+def main(argv: List[str] | None = None):
+    parser = argparse.ArgumentParser(description='Sweep attackers x defenders x engagement parameters.')
+    parser.add_argument('--attackers', nargs='+', default=list(unit_collection), help='unit_collection entries')
+    parser.add_argument('--defenders', nargs='+', default=list(unit_collection), help='unit_collection entries')
+    parser.add_argument('--distances', nargs='+', default=['1-24'], help='distances and ranges, e.g. 3 6 12-24')
+    parser.add_argument('--line-of-sight', nargs='+', type=parse_bool, default=[True])
+    parser.add_argument('--in-cover', nargs='+', type=parse_bool, default=[False])
+    parser.add_argument(
+        '--last-action', nargs='+', type=parse_last_action, default=[None],
+        help=f'none or one of {", ".join(LastAction)}'
+    )
+    parser.add_argument('--output', help='write results to a .json or .csv file instead of stdout')
+    args = parser.parse_args(argv)
+
+    result = sweep(
+        attackers={name: unit_collection[name] for name in args.attackers},
+        defenders={name: unit_collection[name] for name in args.defenders},
+        distances=parse_distances(args.distances),
+        line_of_sight=args.line_of_sight,
+        in_cover=args.in_cover,
+        last_action=args.last_action
+    )
+    records = result.records()
+    if args.output and args.output.endswith('.csv'):
+        with open(args.output, 'w', newline='') as output_file:
+            writer = csv.DictWriter(output_file, fieldnames=list(records[0]))
+            writer.writeheader()
+            writer.writerows(records)
+    elif args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(records, output_file, indent=4)
+    else:
+        for record in records:
+            print(', '.join(f'{key}={value:.3f}' if isinstance(value, float) else f'{key}={value}' for key, value in record.items()))
+
+
+if __name__ == '__main__':
+    main()